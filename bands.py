@@ -0,0 +1,328 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Conversion of a quilt to a native image in horizontal bands of native
+# rows, with bounded memory use, for very large quilts and displays.
+#
+# For each band the table is computed for just those rows and only the 
+# quilt rows that the band samples are read. As a PNG can only be decoded
+# sequentially the quilt is first decoded row-by-row into a temporary 
+# uncompressed file, from which the rows are then read as needed. A binary
+# PPM quilt is read directly. The native image is written band-by-band 
+# (PNG or PPM), so it is never completely in memory either.
+
+import os, sys, io, struct, zlib, tempfile
+import numpy as np
+from PIL import Image
+
+from interlace import quilt_lookup_table, interlace
+from tiledquilt import TiledQuilt, is_tiled
+from rawimage import ppm_header, load_raw, MappedOutput
+from metrics import Stages
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def png_chunk(ctype, data):
+    crc = zlib.crc32(data, zlib.crc32(ctype))
+    return struct.pack('>I', len(data)) + ctype + data + struct.pack('>I', crc)
+    
+
+def png_chunks(f):
+    
+    while True:
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            return
+        length, ctype = struct.unpack('>I4s', hdr)
+        data = f.read(length)
+        f.read(4)   # CRC
+        yield ctype, data
+        if ctype == b'IEND':
+            return
+            
+
+def png_unfilter(filtered, prev, width, colortype, rows):
+    
+    # Undo the PNG row filters of a batch of rows, by letting PIL decode
+    # a minimal PNG image that has the previous (already unfiltered) row
+    # stored unfiltered as its first row, followed by the filtered rows.
+    
+    raw = b'\x00' + prev + filtered
+    ihdr = struct.pack('>IIBBBBB', width, rows+1, 8, colortype, 0, 0, 0)
+    
+    png = PNG_SIGNATURE + png_chunk(b'IHDR', ihdr) + \
+        png_chunk(b'IDAT', zlib.compress(raw, 0)) + png_chunk(b'IEND', b'')
+        
+    return np.asarray(Image.open(io.BytesIO(png)))[1:]
+    
+
+def png_rows(filename, batch_rows=64):
+    
+    # Yield the rows of an 8-bit RGB(A) non-interlaced PNG file as arrays
+    # of (at most) batch_rows rows
+    
+    f = open(filename, 'rb')
+    
+    if f.read(8) != PNG_SIGNATURE:
+        raise ValueError('%s: not a PNG file' % filename)
+        
+    chunks = png_chunks(f)
+    
+    ctype, ihdr = next(chunks)
+    width, height, depth, colortype, compression, filt, interlaced = struct.unpack('>IIBBBBB', ihdr)
+    
+    if depth != 8 or colortype not in [2, 6] or interlaced:
+        raise NotImplementedError('%s: only 8-bit RGB(A) non-interlaced PNG files are supported' % filename)
+        
+    stride = width * (3 if colortype == 2 else 4)
+    
+    # For the first row the previous row is all zeroes
+    prev = bytes(stride)
+    data = bytearray()
+    y = 0
+    
+    # Inflated a batch at a time, a single IDAT chunk can hold the whole image
+    batch_bytes = batch_rows * (1 + stride)
+    decompressor = zlib.decompressobj()
+    
+    for ctype, chunk in chunks:
+        
+        if ctype != b'IDAT':
+            continue
+            
+        while y < height:
+            
+            limit = batch_bytes - len(data)
+            inflated = decompressor.decompress(chunk, limit)
+            data += inflated
+            chunk = decompressor.unconsumed_tail
+            
+            n = min(batch_rows, height-y, len(data) // (1 + stride))
+            if n == batch_rows or y+n == height:
+                
+                batch = png_unfilter(bytes(data[:n*(1+stride)]), prev, width, colortype, n)
+                del data[:n*(1+stride)]
+                
+                prev = batch[-1].tobytes()
+                y += n
+                
+                yield batch
+                
+            # With output left at the limit zlib can have more without input
+            if not chunk and len(inflated) < limit:
+                break
+            
+    f.close()
+    
+    if y < height:
+        raise EOFError('%s: image data ends at row %d of %d' % (filename, y, height))
+        
+
+class QuiltRows:
+    
+    # Random access to the (RGB) rows of a quilt image
+    
+    def __init__(self, filename, budget):
+        
+        self.array = None
+        
+        if filename.lower().endswith('.npy'):
+            # Memory-mapped, rows are read on access
+            self.array = load_raw(filename)
+            self.height, self.width = self.array.shape[:2]
+            return
+        
+        if filename.lower().endswith('.ppm'):
+            self.file = open(filename, 'rb')
+            self.width, self.height, self.offset = ppm_header(self.file)
+            return
+            
+        self.file = tempfile.TemporaryFile()
+        self.offset = 0
+        
+        if is_tiled(filename):
+            # Decoded a row of tiles at a time
+            with TiledQuilt(filename) as quilt:
+                self.width, self.height = quilt.quilt_size
+                for rows in quilt.row_bands():
+                    self.file.write(quilt.read_quilt(rows=rows).tobytes())
+            return
+            
+        if filename.lower().endswith('.png'):
+            
+            self.width, self.height = Image.open(filename).size
+            
+            # A batch of rows is copied a few times during decoding
+            batch_rows = max(1, budget // (self.width * 4 * 8))
+            
+            try:
+                for rows in png_rows(filename, batch_rows):
+                    self.file.write(rows[:,:,:3].tobytes())
+                return
+            except NotImplementedError as e:
+                sys.stderr.write('Warning: %s\n' % e)
+                
+        sys.stderr.write('Warning: %s will be fully decoded in memory, use PNG or PPM for bounded memory use\n' % filename)
+        
+        img = Image.open(filename)
+        self.width, self.height = img.size
+        self.file.write(img.convert('RGB').tobytes())
+        del img
+            
+    def read_rows(self, first, out):
+        
+        # Fill out, a (n, width, 3) array, with rows first to first+n-1
+        if self.array is not None:
+            out[:] = self.array[first:first+out.shape[0]]
+            return
+        self.file.seek(self.offset + first*self.width*3)
+        self.file.readinto(memoryview(out).cast('B'))
+        
+        
+class NativeWriter:
+    
+    # Writes a PNG, binary PPM, .npy or .raw image, band by band
+    
+    def __init__(self, filename, width, height, compress_level=6, order='rgb'):
+        
+        self.width = width
+        self.mapped = None
+        
+        if filename.lower().endswith(('.npy', '.raw')):
+            # Bands are copied into the memory-mapped file
+            self.mapped = MappedOutput(filename, width, height, order)
+            self.row = 0
+            return
+        
+        if not filename.lower().endswith(('.ppm', '.png')):
+            raise NotImplementedError('%s: only PNG, PPM, .npy and .raw output is supported' % filename)
+        
+        # Written under a temporary name, and renamed when complete
+        self.filename = filename
+        self.file = open(filename + '.part', 'wb')
+        
+        if filename.lower().endswith('.ppm'):
+            self.compressor = None
+            self.file.write(b'P6\n%d %d\n255\n' % (width, height))
+        else:
+            self.compressor = zlib.compressobj(compress_level)
+            self.file.write(PNG_SIGNATURE)
+            self.file.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+            
+    def write_rows(self, rows):
+        
+        if self.mapped is not None:
+            self.mapped.rgb[self.row:self.row+rows.shape[0]] = rows
+            self.row += rows.shape[0]
+            return
+        
+        if self.compressor is None:
+            self.file.write(rows)
+            return
+            
+        # Filter type 0 (none) for each row
+        filtered = np.zeros((rows.shape[0], 1 + self.width*3), np.uint8)
+        filtered[:,1:] = rows.reshape(rows.shape[0], -1)
+        
+        data = self.compressor.compress(filtered)
+        if data:
+            self.file.write(png_chunk(b'IDAT', data))
+            
+    def close(self):
+        
+        if self.mapped is not None:
+            self.mapped.close()
+            return
+        
+        if self.compressor is not None:
+            self.file.write(png_chunk(b'IDAT', self.compressor.flush()))
+            self.file.write(png_chunk(b'IEND', b''))
+            
+        self.file.close()
+        os.replace(self.filename + '.part', self.filename)
+        
+
+def convert_bands(calibration, tiles, quilt_image_file, native_image_file, budget, stages=None, 
+    compress_level=6, order='rgb'):
+    
+    # budget: approximate maximum memory use, in bytes. stages: a 
+    # metrics.Stages, the band steps are added to its stages
+    
+    if stages is None:
+        stages = Stages()
+    
+    screenW, screenH = calibration.screenW, calibration.screenH
+    
+    with stages('decode'):
+        quilt = QuiltRows(quilt_image_file, budget)
+    QWIDTH, QHEIGHT = quilt.width, quilt.height
+    
+    # Estimate of the memory needed per native row: the output row, the
+    # table and the index arrays derived from it, the float64 temporaries 
+    # in computing the table, plus the quilt rows sampled (a native row 
+    # samples one row in each row of tiles)
+    per_row = screenW*3 + screenW*3*4*5 + screenW*8*10
+    per_row += QWIDTH*3 * max(tiles[1], QHEIGHT // screenH + 1)
+    band_rows = max(1, min(screenH, budget // per_row))
+    
+    out = NativeWriter(native_image_file, screenW, screenH, compress_level, order)
+    
+    for first in range(0, screenH, band_rows):
+        
+        last = min(screenH, first + band_rows)
+        
+        with stages('table'):
+            
+            table = quilt_lookup_table(calibration, tiles, (QWIDTH, QHEIGHT), (first, last))
+            
+            # Quilt rows sampled by this band
+            y = table // (QWIDTH*3)
+            used = np.zeros(QHEIGHT, bool)
+            used[y] = True
+            rows = np.flatnonzero(used)
+        
+        # Read them, as runs of consecutive rows
+        with stages('decode'):
+            
+            band_quilt = np.empty((len(rows), QWIDTH, 3), np.uint8)
+            
+            runs = np.flatnonzero(np.diff(rows) != 1) + 1
+            for start, end in zip(np.r_[0, runs], np.r_[runs, len(rows)]):
+                quilt.read_rows(rows[start], band_quilt[start:end])
+            
+        # Make the table refer to the rows in band_quilt
+        with stages('table'):
+            remap = np.zeros(QHEIGHT, np.uint32)
+            remap[rows] = np.arange(len(rows), dtype=np.uint32)
+            table -= (y - remap[y]) * np.uint32(QWIDTH*3)
+        
+        with stages('gather'):
+            band = interlace(band_quilt, table)
+            
+        with stages('encode'):
+            out.write_rows(band)
+        
+    with stages('encode'):
+        out.close()
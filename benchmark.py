@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+#
+# Benchmark the *2native.py conversions (speed, per-stage timings and
+# peak memory use) and check their output for pixel-exact equivalence
+# with the original per-pixel implementation.
+#
+#
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os, sys, json, time, getopt, hashlib, colorsys, tempfile, subprocess
+from math import floor
+
+from metrics import Stages, peak_memory
+
+def usage():
+    print('usage: %s [options]' % sys.argv[0])
+    print()
+    print('Benchmarks the native image conversions on synthetic inputs and checks')
+    print('their output against a per-pixel reference implementation (the original')
+    print('pixel_color() loops).')
+    print()
+    print('options:')
+    print('  -c <case>,...    Cases to run (default: all): %s' % ', '.join(CASES.keys()))
+    print('  -e <engine>,...  Engines to run (default: all): %s' % ', '.join(sorted(set(sum(ENGINES.values(), [])))))
+    print('  -n <pixels>      Number of native pixels to check against the reference')
+    print('                   implementation (default: 20000), 0 checks all pixels')
+    print('  -d <dir>         Directory for the synthetic inputs, reused when it exists')
+    print('                   (default: a temporary directory)')
+    print()
+    sys.exit(-1)
+
+
+# Synthetic calibrations, values as in a visual.json
+CALIBRATIONS = {
+    'default':  'visual.default.json',
+    'alt':      dict(screenW=2560.0, screenH=1600.0, DPI=338.0, pitch=47.58, slope=-5.49, center=0.37),
+    '8k':       dict(screenW=7680.0, screenH=4320.0, DPI=283.0, pitch=50.13, slope=-7.02, center=-0.11),
+}
+
+# name: (kind, calibration, tiles, quilt or view size)
+CASES = {
+    '5x9':      ('quilt', 'default', (5, 9), (4096, 4096)),
+    '4x8':      ('quilt', 'alt', (4, 8), (2048, 2048)),
+    'linear45': ('linear', 'default', (45, 1), (45*360, 225)),
+    'frames45': ('frames', 'default', 45, (819, 512)),
+    '8k':       ('quilt', '8k', (5, 9), (8192, 8192)),
+}
+
+ENGINES = {
+    'quilt':    ['serial', 'threads', 'processes', 'bands'],
+    'linear':   ['serial', 'threads', 'processes', 'bands'],
+    'frames':   ['serial', 'bucketed'],
+}
+
+# Synthetic inputs
+
+def write_calibration(name, filename):
+
+    values = CALIBRATIONS[name]
+
+    if isinstance(values, str):
+        values = json.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), values)))
+    else:
+        values = dict((k, dict(value=v)) for k, v in values.items())
+
+    json.dump(values, open(filename, 'wt'), indent=4)
+
+
+def tile_image(tile_idx, tile_w, tile_h, rng):
+
+    # As gen_numbers_quilt.py, a different hue per tile, plus noise so
+    # that any wrongly sampled texel shows up
+
+    import numpy as np
+
+    hue = (tile_idx % 12) / 12
+    col = np.array(colorsys.hsv_to_rgb(hue, 0.8, 0.7)) * 255
+
+    img = rng.integers(-40, 40, (tile_h, tile_w, 3)) + col
+
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def generate_inputs(case, d):
+
+    import numpy as np
+    from PIL import Image
+
+    kind, calibration, tiles, size = CASES[case]
+
+    write_calibration(calibration, os.path.join(d, '%s.json' % case))
+
+    rng = np.random.default_rng(12345)
+
+    if kind == 'frames':
+        for i in range(tiles):
+            img = tile_image(i, size[0], size[1], rng)
+            Image.fromarray(img).save(os.path.join(d, '%s-%02d.png' % (case, i)), compress_level=1)
+        return
+
+    quilt_w, quilt_h = size
+    tile_w, tile_h = quilt_w // tiles[0], quilt_h // tiles[1]
+
+    quilt = np.zeros((quilt_h, quilt_w, 3), np.uint8)
+
+    # Views go from the bottom left to the top right
+    tile_idx = 0
+    for j in range(tiles[1]):
+        top = quilt_h - (j+1)*tile_h
+        for i in range(tiles[0]):
+            quilt[top:top+tile_h, i*tile_w:(i+1)*tile_w] = tile_image(tile_idx, tile_w, tile_h, rng)
+            tile_idx += 1
+
+    Image.fromarray(quilt).save(os.path.join(d, '%s.png' % case), compress_level=1)
+
+
+# Reference implementation, the per-pixel code of the original scripts
+
+def reference_quilt_pixel(calibration, tiles, qpx, qsize, i, j):
+
+    tilt, pitch, center, subp = calibration.tilt, calibration.pitch, calibration.center, calibration.subp
+
+    def quilt_tile(a):
+        tile = [tiles[0] - 1, 0]
+        a = a%1 * tiles[1]
+        tile[1] += floor(a)
+        a = a%1 * tiles[0]
+        tile[0] += -floor(a)
+        return tile
+
+    u = i / calibration.screenW
+    v = j / calibration.screenH
+
+    a = (u + (1.0 - v)*tilt)*pitch - center
+
+    res = []
+    for c, aa in enumerate([a, a + subp, a + 2*subp]):
+        tile = quilt_tile(aa)
+        pos = ((u + tile[0]) * (1.0/tiles[0]), (v + tile[1]) * (1.0/tiles[1]))
+        res.append(qpx[pos[0]*qsize[0], pos[1]*qsize[1]][c])
+
+    return tuple(res)
+
+
+def reference_linear_pixel(calibration, tiles, qpx, qsize, i, j):
+
+    tilt, pitch, center, subp = calibration.tilt, calibration.pitch, calibration.center, calibration.subp
+    TILES = tiles[0]
+
+    def quilt_tile(a):
+        tile = TILES - 1
+        a = a%1 * TILES
+        tile -= floor(a)
+        return tile
+
+    u = i / calibration.screenW
+    v = j / calibration.screenH
+
+    a = (u + (1.0 - v)*tilt)*pitch - center
+
+    res = []
+    for c, aa in enumerate([a, a + subp, a + 2*subp]):
+        tile = quilt_tile(aa)
+        pos = ((u + tile) * (1.0/TILES), v)
+        res.append(qpx[pos[0]*qsize[0], pos[1]*qsize[1]][c])
+
+    return tuple(res)
+
+
+def reference_frames_pixel(calibration, num_frames, fpx, fsize, i, j):
+
+    tilt, pitch, center, subp = calibration.tilt, calibration.pitch, calibration.center, calibration.subp
+
+    def determine_view(a):
+        res = num_frames - 1
+        a = a%1 * num_frames
+        res -= floor(a)
+        return res
+
+    u = (i+0.5) / calibration.screenW
+    v = (j+0.5) / calibration.screenH
+
+    x = int(u * fsize[0])
+    y = int(v * fsize[1])
+
+    a = (u + (1.0 - v)*tilt)*pitch - center
+
+    return tuple(fpx[determine_view(aa)][x,y][c] for c, aa in enumerate([a, a + subp, a + 2*subp]))
+
+
+def reference_check(case, d, calibration, native, sample):
+
+    # Returns the number of checked pixels that differ from the reference
+
+    import numpy as np
+    from PIL import Image
+
+    kind, _, tiles, size = CASES[case]
+    H, W = native.shape[:2]
+
+    if sample == 0 or sample >= W*H:
+        pixels = np.arange(W*H)
+    else:
+        pixels = np.random.default_rng(1).choice(W*H, sample, replace=False)
+
+    if kind == 'frames':
+        imgs = [Image.open(os.path.join(d, '%s-%02d.png' % (case, i))) for i in range(tiles)]
+        px = [img.load() for img in imgs]
+        pixel_color = lambda i, j: reference_frames_pixel(calibration, tiles, px, size, i, j)
+    else:
+        img = Image.open(os.path.join(d, '%s.png' % case))
+        px = img.load()
+        reference = reference_quilt_pixel if kind == 'quilt' else reference_linear_pixel
+        pixel_color = lambda i, j: reference(calibration, tiles, px, size, i, j)
+
+    errors = 0
+    for p in pixels:
+        j, i = divmod(int(p), W)
+        if tuple(native[j,i]) != pixel_color(i, j):
+            errors += 1
+
+    return errors, len(pixels)
+
+
+# Running a single engine (in a child process)
+
+def run_engine(case, engine, d, sample):
+
+    import numpy as np
+    from PIL import Image
+
+    from calibration import Calibration
+    import interlace
+
+    kind, _, tiles, size = CASES[case]
+    workers = os.cpu_count()
+
+    calibration = Calibration(os.path.join(d, '%s.json' % case))
+    stage = Stages()
+
+    t0 = time.perf_counter()
+
+    if kind == 'frames':
+
+        files = [os.path.join(d, '%s-%02d.png' % (case, i)) for i in range(tiles)]
+
+        if engine == 'serial':
+            with stage('decode'):
+                frames = np.stack([interlace.load_quilt(f) for f in files])
+            with stage('table'):
+                views, offsets = interlace.get_frames_lookup_table(calibration, tiles, size)
+            with stage('gather'):
+                native = interlace.interlace_frames(frames, views, offsets)
+
+        elif engine == 'bucketed':
+            with stage('table'):
+                views, offsets = interlace.get_frames_lookup_table(calibration, tiles, size)
+                buckets = interlace.get_frames_buckets(calibration, tiles, size)
+                del views
+            # Decoding overlaps with the gather
+            with stage('decode+gather'):
+                native = np.empty((calibration.screenH, calibration.screenW, 3), np.uint8)
+                interlace.interlace_frames_bucketed(lambda i: interlace.load_quilt(files[i]),
+                    tiles, offsets, buckets, native)
+
+    else:
+
+        quilt_file = os.path.join(d, '%s.png' % case)
+
+        if engine == 'bands':
+            from bands import convert_bands
+            with stage('total'):
+                out_file = os.path.join(d, '%s-bands.png' % case)
+                convert_bands(calibration, tiles, quilt_file, out_file, 128*1024*1024)
+            native = np.asarray(Image.open(out_file))
+
+        else:
+            from parallel import interlace_parallel
+
+            with stage('decode'):
+                quilt = interlace.load_quilt(quilt_file)
+            with stage('table'):
+                table = interlace.get_quilt_lookup_table(calibration, tiles, size)
+            with stage('gather'):
+                if engine == 'serial':
+                    native = interlace.interlace(quilt, table)
+                else:
+                    native = interlace_parallel(quilt, table, workers, engine == 'processes')
+
+    if engine != 'bands':
+        with stage('encode'):
+            Image.fromarray(native).save(os.path.join(d, '%s-%s.png' % (case, engine)))
+
+    total = time.perf_counter() - t0
+
+    # Before the reference check, which needs quite some memory itself
+    peak_rss = peak_memory()
+
+    errors, checked = reference_check(case, d, calibration, native, sample)
+
+    return dict(
+        stages=stage.times,
+        total=total,
+        mpixels=native.shape[0]*native.shape[1] / 1e6,
+        peak_rss=peak_rss,
+        sha1=hashlib.sha1(native.tobytes()).hexdigest(),
+        errors=errors,
+        checked=checked)
+
+
+def run_child(case, engine, d, sample):
+
+    # Run an engine in a separate process, so its peak memory use is
+    # measured independently
+
+    p = subprocess.run([sys.executable, os.path.abspath(__file__), '-x',
+        '%s,%s,%s,%d' % (case, engine, d, sample)], stdout=subprocess.PIPE)
+
+    if p.returncode != 0:
+        return None
+
+    return json.loads(p.stdout.decode('utf8').strip().split('\n')[-1])
+
+
+def main():
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'c:e:n:d:x:')
+    except getopt.GetoptError:
+        usage()
+
+    if len(args) != 0:
+        usage()
+
+    cases = list(CASES.keys())
+    engines = None
+    sample = 20000
+    d = None
+
+    for o, a in opts:
+        if o == '-c':
+            cases = a.split(',')
+        elif o == '-e':
+            engines = a.split(',')
+        elif o == '-n':
+            sample = int(a)
+        elif o == '-d':
+            d = a
+        elif o == '-x':
+            # Child process
+            case, engine, d, sample = a.split(',')
+            os.environ['LG_CACHE_DIR'] = os.path.join(d, 'cache')
+            print(json.dumps(run_engine(case, engine, d, int(sample))))
+            return
+
+    for case in cases:
+        if case not in CASES:
+            usage()
+
+    if d is None:
+        d = tempfile.mkdtemp(prefix='lg-benchmark-')
+    os.makedirs(d, exist_ok=True)
+
+    os.environ['LG_CACHE_DIR'] = os.path.join(d, 'cache')
+
+    from calibration import Calibration
+    import interlace
+
+    print('Inputs in %s, %d cores' % (d, os.cpu_count()))
+    print()
+    print('%-10s %-10s %8s %8s %8s %8s %8s %8s %9s  %s' %
+        ('case', 'engine', 'MP/s', 'total', 'decode', 'table', 'gather', 'encode', 'peak RSS', 'check'))
+
+    for case in cases:
+
+        kind, _, tiles, size = CASES[case]
+
+        if not os.path.isfile(os.path.join(d, '%s.json' % case)):
+            generate_inputs(case, d)
+
+        # Time the lookup table computation, and make sure it is cached
+        # for the engines
+        calibration = Calibration(os.path.join(d, '%s.json' % case))
+        t0 = time.perf_counter()
+        if kind == 'frames':
+            interlace.frames_lookup_table(calibration, tiles, size)
+        else:
+            interlace.quilt_lookup_table(calibration, tiles, size)
+        table_time = time.perf_counter() - t0
+
+        if kind == 'frames':
+            interlace.get_frames_buckets(calibration, tiles, size)
+        else:
+            interlace.get_quilt_lookup_table(calibration, tiles, size)
+
+        print('%-10s %dx%d native, %s %s, table computation %.3fs' % (case,
+            calibration.screenW, calibration.screenH,
+            'x'.join(map(str, tiles)) if kind != 'frames' else '%d views' % tiles,
+            '%dx%d' % size, table_time))
+
+        # The first engine that ran is the reference for the others
+        reference_sha1 = None
+        reference_engine = None
+
+        for engine in ENGINES[kind]:
+
+            if engines is not None and engine not in engines:
+                continue
+
+            res = run_child(case, engine, d, sample)
+
+            if res is None:
+                print('%-10s %-10s FAILED' % ('', engine))
+                continue
+
+            if reference_sha1 is None:
+                reference_sha1 = res['sha1']
+                reference_engine = engine
+
+            if res['errors'] > 0:
+                check = 'MISMATCH (%d of %d pixels checked)' % (res['errors'], res['checked'])
+            elif res['sha1'] != reference_sha1:
+                check = 'MISMATCH (differs from %s)' % reference_engine
+            else:
+                check = 'ok (%d pixels checked)' % res['checked']
+
+            # Stages that could not be timed separately are shown combined
+            # in the gather column
+            stages = res['stages']
+            fmt = lambda *names: next(('%.3f' % stages[n] for n in names if n in stages), '-')
+
+            print('%-10s %-10s %8.1f %8.3f %8s %8s %8s %8s %6d MB  %s' % ('', engine,
+                res['mpixels'] / res['total'], res['total'],
+                fmt('decode'), fmt('table'), fmt('gather', 'decode+gather', 'total'), fmt('encode'),
+                res['peak_rss'] // (1024*1024), check))
+
+
+if __name__ == '__main__':
+    main()
@@ -23,25 +23,72 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import json
-from math import cos, atan
+import os, json
+from math import cos, atan, isfinite
+
+def cache_dir():
+    
+    # Directory for cached data (lookup tables, calibrations). An empty 
+    # string means caching is disabled.
+    
+    d = os.environ.get('LG_CACHE_DIR')
+    if d is None:
+        d = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+        d = os.path.join(d, 'looking-glass')
+        
+    return d
+    
 
 class Calibration:
     
     def __init__(self, jsonfile):
 
         config = json.loads(open(jsonfile, 'rt').read())
+        self.config = config
 
         self.screenW = int(config['screenW']['value'])
         self.screenH = int(config['screenH']['value'])
         self.DPI = int(config['DPI']['value'])
-        self.pitch = config['pitch']['value']
-        self.slope = config['slope']['value']
-        self.center = config['center']['value']
-
+        
+        self.update(config['pitch']['value'], config['slope']['value'], config['center']['value'])
+        
+    def update(self, pitch=None, slope=None, center=None):
+        
+        # Change calibration values (as stored in the JSON file, None keeps
+        # the current value) and recompute the derived ones. Raises 
+        # ValueError for invalid values, leaving the calibration unchanged.
+        
+        values = dict(pitch=pitch, slope=slope, center=center)
+        for name, value in values.items():
+            if value is None:
+                values[name] = self.config[name]['value']
+            elif not isfinite(value):
+                raise ValueError('Invalid %s value %s' % (name, value))
+        if values['slope'] == 0:
+            raise ValueError('Invalid slope value 0')
+            
         # Physical image width
-        self.screenInches = self.screenW / self.DPI
-
-        self.pitch = self.pitch * self.screenInches * cos(atan(1.0/self.slope))
-        self.tilt = self.screenH/(self.screenW * self.slope)
-        self.subp = 1.0 / (3*self.screenW) * self.pitch
\ No newline at end of file
+        screenInches = self.screenW / self.DPI
+        
+        # Derived values first, so nothing is changed when they fail
+        derived_pitch = values['pitch'] * screenInches * cos(atan(1.0/values['slope']))
+        tilt = self.screenH/(self.screenW * values['slope'])
+        subp = 1.0 / (3*self.screenW) * derived_pitch
+        
+        for name, value in values.items():
+            self.config[name]['value'] = value
+            
+        self.slope = values['slope']
+        self.center = values['center']
+        self.screenInches = screenInches
+        self.pitch = derived_pitch
+        self.tilt = tilt
+        self.subp = subp
+        
+    def save(self, jsonfile):
+        
+        # Write the (updated) calibration values, in the same form as read
+        tmpname = jsonfile + '.part'
+        with open(tmpname, 'wt') as f:
+            json.dump(self.config, f, indent=4)
+        os.replace(tmpname, jsonfile)
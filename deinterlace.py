@@ -0,0 +1,177 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Inverse of the quilt to native mapping: each native subpixel is
+# scattered back to the quilt value (view, texel and channel) it was
+# sampled from. Quilt values sampled by several native subpixels get
+# their average. Values that are not sampled at all can be filled from
+# the covered values in the same view.
+
+import numpy as np
+
+from layout import quilt_view_rects, pixel_range
+
+def scatter_counts(inverse, count):
+    # Number of native subpixels per used quilt value (see sparse_index())
+    return np.bincount(inverse.reshape(-1), minlength=count)
+    
+    
+def deinterlace(native, used, inverse, counts, quilt_size, out=None):
+    
+    # native: (screenH, screenW, 3) uint8 array. used, inverse: as returned
+    # by sparse_index(). Values not covered are left untouched in out, or 
+    # zero when out is not given
+    
+    QWIDTH, QHEIGHT = quilt_size
+    
+    sums = np.bincount(inverse.reshape(-1), weights=native.reshape(-1), minlength=len(used))
+    sums /= counts
+    sums += 0.5
+    
+    if out is None:
+        out = np.zeros((QHEIGHT, QWIDTH, 3), np.uint8)
+        
+    out.reshape(-1)[used] = sums
+    
+    return out
+    
+    
+def coverage_mask(used, quilt_size):
+    
+    QWIDTH, QHEIGHT = quilt_size
+    
+    mask = np.zeros((QHEIGHT, QWIDTH, 3), bool)
+    mask.reshape(-1)[used] = True
+    
+    return mask
+    
+    
+def view_slices(tiles, quilt_size):
+    
+    # Pixel rows and columns of each view in the quilt
+    
+    slices = []
+    for x0, y0, x1, y1 in quilt_view_rects(tiles, quilt_size):
+        rows = pixel_range(y0, y1, quilt_size[1])
+        cols = pixel_range(x0, x1, quilt_size[0])
+        slices.append((slice(*rows), slice(*cols)))
+        
+    return slices
+    
+    
+def fill_nearest(view, mask):
+    
+    # Repeatedly copy covered values to their uncovered horizontal and 
+    # vertical neighbours, per channel, until everything is covered
+    
+    mask = mask.copy()
+    
+    while not mask.all():
+        
+        before = np.count_nonzero(mask)
+        
+        for axis in (0, 1):
+            for step in (1, -1):
+                
+                dst = [slice(None)] * 3
+                src = [slice(None)] * 3
+                dst[axis] = slice(step, None) if step > 0 else slice(None, step)
+                src[axis] = slice(None, -step) if step > 0 else slice(-step, None)
+                dst, src = tuple(dst), tuple(src)
+                
+                take = mask[src] & ~mask[dst]
+                view[dst][take] = view[src][take]
+                mask[dst] |= take
+                
+        if np.count_nonzero(mask) == before:
+            # No covered values at all in some channel
+            break
+            
+            
+def interpolate_rows(view, mask):
+    
+    # Fill uncovered values by interpolating between the nearest covered 
+    # values to the left and right in the same row, or copying the one 
+    # on one side at the ends. Updates mask.
+    
+    h, w, channels = view.shape
+    pos = np.arange(w, dtype=np.int32)[np.newaxis,:,np.newaxis]
+    
+    left = np.where(mask, pos, -1)
+    np.maximum.accumulate(left, axis=1, out=left)
+    right = np.where(mask, pos, w)[:,::-1]
+    right = np.minimum.accumulate(right, axis=1)[:,::-1]
+    
+    fill = ~mask & ((left >= 0) | (right < w))
+    np.copyto(left, right, where=left < 0)
+    np.copyto(right, left, where=right >= w)
+    
+    # Flat offsets of the row and channel in a contiguous copy
+    values = np.ascontiguousarray(view).reshape(-1)
+    base = np.arange(h, dtype=np.int32)[:,np.newaxis,np.newaxis] * (w*channels)
+    base = base + np.arange(channels, dtype=np.int32)
+    
+    a = np.take(values, base + left*channels, mode='clip').astype(np.float32)
+    b = np.take(values, base + right*channels, mode='clip').astype(np.float32)
+    
+    t = (pos - left).astype(np.float32)
+    right -= left
+    t /= np.maximum(right, 1)
+    
+    b -= a
+    b *= t
+    a += b
+    a += 0.5
+    
+    view[fill] = a[fill]
+    mask |= fill
+    
+    
+def fill_linear(view, mask):
+    
+    # Interpolate along rows, then along columns for the rows without
+    # any covered values
+    
+    mask = mask.copy()
+    
+    interpolate_rows(view, mask)
+    
+    if not mask.all():
+        interpolate_rows(view.swapaxes(0, 1), mask.swapaxes(0, 1))
+        
+        
+def fill_gaps(quilt, mask, tiles, method='nearest'):
+    
+    # Fill the uncovered values in each view of the quilt, from covered
+    # values in the same view only
+    
+    fill = dict(nearest=fill_nearest, linear=fill_linear).get(method)
+    if fill is None:
+        raise ValueError('Unknown fill method "%s"' % method)
+        
+    for rows, cols in view_slices(tiles, quilt.shape[1::-1]):
+        fill(quilt[rows, cols], mask[rows, cols])
+        
+    return quilt
@@ -0,0 +1,130 @@
+# Stand-in for the hid module (python-hidapi) that simulates one or more
+# Looking Glass displays, so get_calibration_from_eeprom.py can be tested
+# and benchmarked without hardware. The calibration JSON of each display
+# is stored in a fake EEPROM, which answers page queries the way the
+# real device does: the 4 byte request header echoed back, followed by
+# the 64 byte page, delivered as 64 byte reports after some latency.
+#
+# Paul Melis <paul.melis@surfsara.nl>
+# SURFsara Visualization group
+#
+#
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json, time
+from struct import pack
+
+PAGE_SIZE = 64
+REPORT_SIZE = 64
+
+class FakeDevice:
+    
+    def __init__(self, displays, latency_ms):
+        self.displays = displays
+        self.latency = latency_ms / 1000
+        self.eeprom = None
+        self.reports = []
+        self.ready = 0
+        self.queries = 0
+        
+    def open_path(self, path):
+        if path not in self.displays:
+            raise IOError('open failed')
+        self.eeprom = self.displays[path]
+        
+    def close(self):
+        self.eeprom = None
+        
+    def send_feature_report(self, buffer):
+        
+        assert self.eeprom is not None
+        
+        addr = (buffer[2] << 8) | buffer[3]
+        page = self.eeprom[addr*PAGE_SIZE:(addr+1)*PAGE_SIZE]
+        page = page.ljust(PAGE_SIZE, b'\0')
+        
+        res = list(buffer[:4]) + list(page)
+        self.reports = [res[i:i+REPORT_SIZE] for i in range(0, len(res), REPORT_SIZE)]
+        self.ready = time.perf_counter() + self.latency
+        self.queries += 1
+        
+        return len(buffer)
+        
+    def read(self, max_length, timeout_ms=0):
+        
+        # Like hidapi: return one report, or an empty list when nothing
+        # arrived within the timeout
+        
+        now = time.perf_counter()
+        wait = float('inf') if timeout_ms < 0 else timeout_ms/1000
+        
+        if len(self.reports) == 0 or now + wait < self.ready:
+            if timeout_ms > 0:
+                time.sleep(timeout_ms / 1000)
+            return []
+        
+        if now < self.ready:
+            time.sleep(self.ready - now)
+            
+        return self.reports.pop(0)[:max_length]
+        
+        
+class FakeHID:
+    
+    # Mimics the parts of the hid module interface that are used, e.g.
+    #
+    #   hid = FakeHID(['visual.json'])
+    #   devs = hid.enumerate(USB_VID, USB_PID)
+    #   dev = hid.device()
+    
+    def __init__(self, jsonfiles, latency_ms=1.0, vendor_id=0x04d8, product_id=0xef7e):
+        
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.latency_ms = latency_ms
+        self.displays = {}
+        self.serials = {}
+        
+        for idx, fname in enumerate(jsonfiles):
+            
+            data = open(fname, 'rb').read()
+            serial = json.loads(data.decode('utf8')).get('serial', 'FAKE-%d' % idx)
+            
+            path = ('fake/%d' % idx).encode('utf8')            
+            self.displays[path] = pack('>I', len(data)) + data
+            self.serials[path] = serial
+            
+    def enumerate(self, vendor_id=0, product_id=0):
+        
+        if vendor_id not in (0, self.vendor_id) or product_id not in (0, self.product_id):
+            return []
+        
+        return [dict(path=path, vendor_id=self.vendor_id, product_id=self.product_id,
+                    serial_number=self.serials[path], product_string='HoloPlay')
+                for path in sorted(self.displays.keys())]
+        
+    def device(self):
+        return FakeDevice(self.displays, self.latency_ms)
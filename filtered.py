@@ -0,0 +1,351 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Filtered sampling of the quilt (or view images), instead of taking the
+# single nearest texel per native subpixel:
+#
+# - 'bilinear': the four texels around the sample position
+# - '<N>x<M>': supersampling, N x M samples spread over the native pixel
+#   (each taking the nearest texel)
+#
+# The view each subpixel shows is the same as with nearest-neighbour 
+# sampling, and the samples are clamped to that view's tile, so views 
+# never bleed into each other.
+#
+# The texel offsets and weights only depend on the calibration, layout
+# and quilt size, so they're computed once (and cached) as a sparse 
+# weight table: per native subpixel a fixed number of flat offsets into
+# the quilt, with weights in 1/256 units that add up to 256. Unused taps
+# have weight 0. A native image is then a weighted sum of a few gathers,
+# done in 16 bits (255*256 still fits).
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from interlace import (calibration_key, cached, native_uv, quilt_phase, quilt_tiles,
+    view_lookup_table, get_quilt_lookup_table)
+
+SAMPLING = ('nearest', 'bilinear', '<N>x<M>')
+
+def parse_sampling(sampling):
+    
+    # Returns None for nearest-neighbour, 'bilinear' or (N, M) samples
+    
+    if sampling in (None, 'nearest'):
+        return None
+    if sampling == 'bilinear':
+        return sampling
+        
+    try:
+        n, m = map(int, sampling.split('x'))
+    except ValueError:
+        raise ValueError('Unknown sampling "%s", expected one of %s' % (sampling, ', '.join(SAMPLING)))
+        
+    if n < 1 or m < 1:
+        raise ValueError('Invalid number of samples "%s"' % sampling)
+        
+    return (n, m)
+    
+    
+class WeightTable:
+    
+    # Can be used in place of a nearest-neighbour lookup table with 
+    # interlace() and the functions in parallel.py, which only need its 
+    # shape and bands of rows
+    
+    def __init__(self, offsets, weights, scratch=None):
+        
+        # offsets: (K, H, W, 3) flat offsets, weights: (K, H, W, 3) uint16
+        self.offsets = offsets
+        self.weights = weights
+        
+        # Per thread memory for the temporaries of gather(), kept between
+        # calls (e.g. for each frame of a stream) and shared with the bands
+        # of rows taken from this table
+        self.scratch = threading.local() if scratch is None else scratch
+        
+    @property
+    def shape(self):
+        return self.offsets.shape[1:]
+        
+    @property
+    def size(self):
+        return self.offsets[0].size
+        
+    @property
+    def taps(self):
+        return self.offsets.shape[0]
+        
+    def __getitem__(self, rows):
+        return WeightTable(self.offsets[:,rows], self.weights[:,rows], self.scratch)
+        
+    def temporaries(self):
+        
+        # Returns the (texels, acc, tmp) arrays for gather(), from this 
+        # thread's scratch memory
+        
+        size = self.size
+        buf = getattr(self.scratch, 'buf', None)
+        if buf is None or buf.size < size*2 + (size+1)//2:
+            buf = self.scratch.buf = np.empty(size*2 + (size+1)//2, np.uint16)
+            
+        acc = buf[:size].reshape(self.shape)
+        tmp = buf[size:size*2].reshape(self.shape)
+        texels = buf[size*2:].view(np.uint8)[:size].reshape(self.shape)
+        
+        return texels, acc, tmp
+        
+    def gather(self, source, out=None):
+        
+        source = source.reshape(-1)
+        
+        if out is None:
+            out = np.empty(self.shape, np.uint8)
+            
+        texels, acc, tmp = self.temporaries()
+        
+        for k in range(self.taps):
+            np.take(source, self.offsets[k], out=texels, mode='clip')
+            if k == 0:
+                np.multiply(texels, self.weights[k], out=acc)
+            else:
+                np.multiply(texels, self.weights[k], out=tmp)
+                acc += tmp
+                
+        # Round
+        acc += 128
+        acc >>= 8
+        out[:] = acc
+        
+        return out
+        
+        
+def axis_span(spacing, samples):
+    
+    # Number of taps along an axis: n samples are spread over (n-1)/n
+    # of spacing texels, so hit at most this many consecutive texels 
+    # (with some margin for rounding)
+    
+    if samples == 'bilinear':
+        return 2
+    if samples == 1:
+        return 1
+        
+    return int(np.floor(spacing*(samples - 1)/samples + 1e-6)) + 2
+    
+    
+def axis_taps(p, lo, hi, spacing, samples):
+    
+    # Taps along one axis. p: texel coordinate of the sample position 
+    # (nearest-neighbour takes texel floor(p)), lo and hi: first and last
+    # texel of the tile, spacing: distance between native pixels in texels.
+    # samples: 'bilinear' or the number of supersamples. Returns a list 
+    # of axis_span() (texel, weight) arrays.
+    
+    if samples == 'bilinear':
+        # Texel centers are at +0.5
+        q = p - 0.5
+        i = np.floor(q)
+        f = q - i
+        i = i.astype(np.int64)
+        return [(np.clip(i, lo, hi), 1.0 - f), (np.clip(i+1, lo, hi), f)]
+        
+    # Samples spread evenly over a native pixel, centered on p. As they
+    # are increasing the texels they hit form a consecutive range.
+    texels = [np.clip(np.floor(p + ((k + 0.5)/samples - 0.5)*spacing).astype(np.int64), lo, hi)
+        for k in range(samples)]
+    first = texels[0]
+    
+    taps = []
+    for d in range(axis_span(spacing, samples)):
+        count = sum((t == first + d).astype(np.float64) for t in texels)
+        taps.append((np.minimum(first + d, hi), count / samples))
+        
+    return taps
+    
+    
+def store_taps(x_taps, y_taps, base, width, offsets, weights):
+    
+    # Store the 2D taps, from the separable ones, as flat offsets and 
+    # fixed-point weights in offsets and weights (K, H, W) 
+    
+    K = len(x_taps) * len(y_taps)
+    real = np.empty(offsets.shape, np.float64)
+    
+    k = 0
+    for y, wy in y_taps:
+        for x, wx in x_taps:
+            offsets[k] = base + (y*width + x)*3
+            real[k] = wy*wx
+            k += 1
+            
+    # Round to 1/256 units, adding the rounding error to the largest 
+    # weight so the sum is exact
+    fixed = np.floor(real*256 + 0.5).astype(np.int32)
+    largest = np.argmax(real, axis=0)[np.newaxis]
+    error = 256 - fixed.sum(axis=0)
+    np.put_along_axis(fixed, largest, np.take_along_axis(fixed, largest, 0) + error, 0)
+    
+    weights[:] = fixed
+    
+    
+def sampling_taps(sampling, spacing):
+    
+    # Samples along x and y, and the number of taps
+    
+    samples = parse_sampling(sampling)
+    samples = (samples, samples) if samples == 'bilinear' else samples
+    
+    K = axis_span(spacing[0], samples[0]) * axis_span(spacing[1], samples[1])
+    
+    return samples, K
+    
+    
+def quilt_weight_table(calibration, tiles, quilt_size, sampling, rows=None, out=None):
+    
+    # For a grid or linear quilt, see quilt_lookup_table(). Returns
+    # (offsets, weights), or fills out with them.
+    
+    QWIDTH, QHEIGHT = quilt_size
+    
+    # Tile size, and the distance between native pixels, in texels
+    TILE_WIDTH, TILE_HEIGHT = QWIDTH / tiles[0], QHEIGHT / tiles[1]
+    spacing = (TILE_WIDTH / calibration.screenW, TILE_HEIGHT / calibration.screenH)
+    samples, K = sampling_taps(sampling, spacing)
+    
+    u, v = native_uv(calibration)
+    if rows is not None:
+        v = v[rows[0]:rows[1]]
+    a = quilt_phase(calibration, u, v)
+    
+    if out is None:
+        out = (np.empty((K,) + a.shape + (3,), np.uint32), np.empty((K,) + a.shape + (3,), np.uint16))
+    offsets, weights = out
+    
+    for c in range(3):
+        
+        tx, ty = quilt_tiles(a + c*calibration.subp, tiles)
+        
+        x_taps = axis_taps((tx + u)*TILE_WIDTH, np.floor(tx*TILE_WIDTH), 
+            np.ceil((tx + 1)*TILE_WIDTH) - 1, spacing[0], samples[0])
+        y_taps = axis_taps((ty + v)*TILE_HEIGHT, np.floor(ty*TILE_HEIGHT), 
+            np.ceil((ty + 1)*TILE_HEIGHT) - 1, spacing[1], samples[1])
+            
+        store_taps(x_taps, y_taps, c, QWIDTH, offsets[...,c], weights[...,c])
+        
+    return out
+    
+    
+def frames_weight_table(calibration, num_frames, frame_size, sampling, rows=None, out=None):
+    
+    # For separate view images, with offsets into the 
+    # (NUM_FRAMES, FRAME_HEIGHT, FRAME_WIDTH, 3) array of all frames
+    # (as frames_flat_table())
+    
+    FRAME_WIDTH, FRAME_HEIGHT = frame_size
+    frame_bytes = FRAME_WIDTH * FRAME_HEIGHT * 3
+    
+    spacing = (FRAME_WIDTH / calibration.screenW, FRAME_HEIGHT / calibration.screenH)
+    samples, K = sampling_taps(sampling, spacing)
+    
+    # Same views and sample positions as frames_lookup_table()
+    views, _ = view_lookup_table(calibration, (num_frames, 1), frame_size, 0.5, rows)
+    u, v = native_uv(calibration, 0.5)
+    if rows is not None:
+        v = v[rows[0]:rows[1]]
+        
+    if out is None:
+        dtype = np.uint32 if num_frames*frame_bytes <= 2**32 else np.int64
+        out = (np.empty((K,) + views.shape, dtype), np.empty((K,) + views.shape, np.uint16))
+    offsets, weights = out
+    
+    x_taps = axis_taps(u*FRAME_WIDTH, 0, FRAME_WIDTH-1, spacing[0], samples[0])
+    y_taps = axis_taps(v*FRAME_HEIGHT, 0, FRAME_HEIGHT-1, spacing[1], samples[1])
+    
+    for c in range(3):
+        base = views[:,:,c].astype(np.int64) * frame_bytes + c
+        store_taps(x_taps, y_taps, base, FRAME_WIDTH, offsets[...,c], weights[...,c])
+        
+    return out
+    
+    
+def banded(compute, calibration, workers):
+    
+    # Run compute(rows, out) over bands of native rows (keeping the 
+    # temporaries small), with workers threads. The first band determines
+    # the number of taps and the offset type.
+    
+    from parallel import row_bands
+    
+    bands = row_bands(calibration.screenH, max(16, workers))
+    
+    first = compute(bands[0], None)
+    shape = (first[0].shape[0], calibration.screenH, calibration.screenW, 3)
+    
+    out = (np.empty(shape, first[0].dtype), np.empty(shape, np.uint16))
+    out[0][:,:bands[0][1]] = first[0]
+    out[1][:,:bands[0][1]] = first[1]
+    
+    def compute_band(band):
+        compute(band, (out[0][:,band[0]:band[1]], out[1][:,band[0]:band[1]]))
+        
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(compute_band, bands[1:]))
+        
+    return out
+    
+    
+def get_quilt_weight_table(calibration, tiles, quilt_size, sampling, workers=1):
+    
+    params = (calibration_key(calibration), tuple(tiles), tuple(quilt_size), sampling)
+    
+    def compute():
+        return banded(lambda rows, out: quilt_weight_table(calibration, tiles, quilt_size, 
+            sampling, rows, out), calibration, workers)
+    
+    return WeightTable(*cached('quilt-weights', params, compute))
+        
+        
+def get_frames_weight_table(calibration, num_frames, frame_size, sampling, workers=1):
+    
+    params = (calibration_key(calibration), num_frames, tuple(frame_size), sampling)
+    
+    def compute():
+        return banded(lambda rows, out: frames_weight_table(calibration, num_frames, frame_size, 
+            sampling, rows, out), calibration, workers)
+    
+    return WeightTable(*cached('frames-weights', params, compute))
+        
+        
+def get_lookup_table(calibration, tiles, quilt_size, sampling='nearest', workers=1):
+    
+    # The nearest-neighbour lookup table, or a WeightTable for the other
+    # sampling modes. Both can be used with interlace().
+    
+    if parse_sampling(sampling) is None:
+        return get_quilt_lookup_table(calibration, tiles, quilt_size, workers)
+        
+    return get_quilt_weight_table(calibration, tiles, quilt_size, sampling, workers)
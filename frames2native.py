@@ -45,99 +45,202 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import sys, json
-from math import floor
-from PIL import Image
+import os, sys, getopt
+import numpy as np
 
 from calibration import Calibration
+from interlace import get_frames_lookup_table, load_quilt, image_size
+from tiledquilt import TiledQuilt, is_tiled
+from filtered import get_frames_weight_table, parse_sampling
+from interlacer import Interlacer
+from metrics import Metrics
+from rawimage import check_order
+from sequence import save_native
 
 def usage():
-    print('usage: %s <visual.json> <frame-pattern> <first> <last> <native-image>' % sys.argv[0])
+    print('usage: %s [options] <visual.json> <frame-pattern> <first> <last> <native-image>' % sys.argv[0])
+    print()
+    print('options:')
+    print('  -r <w>x<h>   <frame-pattern> and <native-image> are streams of raw RGB frames')
+    print('               (files, named pipes or - for stdin/stdout). Each native image is')
+    print('               made from the next last-first+1 view images of <w> x <h> in the input.')
+    print('  -l           Low memory use: read the view images one at a time, instead of all')
+    print('               at once')
+    print('  -f <sampling>    nearest (default), bilinear or <N>x<M> supersampling: filtered')
+    print('               sampling of the view images, against aliasing (not with -l)')
+    print('  -z <level>   PNG compression level, 0 (fastest) - 9 (smallest), default 6')
+    print('  -O <order>   Channel order for .npy and .raw output: rgb (default), bgr, rgba')
+    print('               or bgra')
+    print('  -m <file.jsonl>  Append wall/CPU time and peak memory per stage (decode, table,')
+    print('               gather, encode) as JSON lines to <file.jsonl> (- for stderr), one')
+    print('               line per frame for streams')
+    print('  -x <file.prof>   Write cProfile statistics of the stages to <file.prof>')
+    print()
+    print('<frame-pattern> can also be a tiled quilt file (see make_quilt.py -T), <first> and')
+    print('<last> are then view numbers. Only the tiles of those views are decoded.')
+    print()
+    print('View images and the native image can also be uncompressed .npy or .ppm files,')
+    print('the native image also a .raw file (pixels only)')
     print()
     sys.exit(-1)
     
-if len(sys.argv) != 6:
-    usage()
-
+def main():
+    
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'r:lf:z:O:m:x:')
+    except getopt.GetoptError:
+        usage()
+        
+    if len(args) != 5:
+        usage()
 
-calibration = Calibration(sys.argv[1])
-screenW = calibration.screenW
-screenH = calibration.screenH
-tilt = calibration.tilt
-pitch = calibration.pitch
-center = calibration.center
-subp = calibration.subp
+    raw_size = None
+    low_memory = False
+    sampling = 'nearest'
+    compress_level = 6
+    order = 'rgb'
+    metrics_file = None
+    profile_file = None
 
-frame_file_pattern = sys.argv[2]
-frame_file_first = int(sys.argv[3])
-frame_file_last = int(sys.argv[4])
+    for o, a in opts:
+        if o == '-r':
+            raw_size = tuple(map(int, a.split('x')))
+        elif o == '-l':
+            low_memory = True
+        elif o == '-f':
+            sampling = a
+        elif o == '-z':
+            compress_level = int(a)
+        elif o == '-O':
+            order = a
+        elif o == '-m':
+            metrics_file = a
+        elif o == '-x':
+            profile_file = a
 
-native_image_file = sys.argv[5]
+    try:
+        parse_sampling(sampling)
+        check_order(args[4], order)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+        
+    if low_memory and sampling != 'nearest':
+        print('Low memory conversion only supports nearest-neighbour sampling')
+        sys.exit(-1)
+        
 
-NUM_FRAMES = frame_file_last - frame_file_first + 1
-INV_NUM_FRAMES = 1.0 / NUM_FRAMES
+    calibration = Calibration(args[0])
 
-# Load tiles
+    frame_file_pattern = args[1]
+    frame_file_first = int(args[2])
+    frame_file_last = int(args[3])
 
-tile_images = []    # For holding references to image objects
-tile_pixels = []    # For PixelAccess objects
+    native_image_file = args[4]
 
-FRAME_WIDTH = FRAME_HEIGHT = None
+    NUM_FRAMES = frame_file_last - frame_file_first + 1
+    
+    metrics = Metrics(metrics_file, profile_file, script=os.path.basename(sys.argv[0]), args=sys.argv[1:])
+    stages = metrics.stages()
+    
+    container = None
+    if raw_size is None and is_tiled(frame_file_pattern):
+        container = TiledQuilt(frame_file_pattern)
+        
+    def read_frame(i):
+        if container is not None:
+            return container.read_view(frame_file_first + i)
+        return load_quilt(frame_file_pattern % (frame_file_first + i))
 
-for i in range(NUM_FRAMES):
-    tile_file = frame_file_pattern % (frame_file_first + i)
-    #print(tile_file)
-    img = Image.open(tile_file)
-    tile_images.append(img)
-    tile_pixels.append(img.load())
-    if FRAME_WIDTH is None:
-        FRAME_WIDTH, FRAME_HEIGHT = img.size
+    if raw_size is not None:
+        
+        from interlace import frames_flat_table
+        from sequence import convert_stream
+        
+        FRAME_WIDTH, FRAME_HEIGHT = raw_size
+        
+        with stages('table'):
+            if sampling != 'nearest':
+                table = get_frames_weight_table(calibration, NUM_FRAMES, (FRAME_WIDTH, FRAME_HEIGHT), sampling)
+            else:
+                views, offsets = get_frames_lookup_table(calibration, NUM_FRAMES, (FRAME_WIDTH, FRAME_HEIGHT))
+                table = frames_flat_table(views, offsets, (FRAME_WIDTH, FRAME_HEIGHT))
+        metrics.write(stages, setup=True)
+        
+        frames = np.empty((NUM_FRAMES, FRAME_HEIGHT, FRAME_WIDTH, 3), np.uint8)
+        
+        convert_stream(frame_file_pattern, native_image_file, frames, table, metrics=metrics)
+        metrics.close()
+        
+        return
+        
+    elif low_memory:
+        
+        from interlace import get_frames_buckets, interlace_frames_bucketed
         
-print('Tile size %d x %d' % (FRAME_WIDTH, FRAME_HEIGHT))
+        def load_frame(i):
+            img = read_frame(i)
+            if img.shape[1::-1] != (FRAME_WIDTH, FRAME_HEIGHT):
+                raise ValueError('View image %d has a different size' % (frame_file_first + i))
+            return img
+        
+        if container is not None:
+            FRAME_WIDTH, FRAME_HEIGHT = container.view_size(frame_file_first)
+        else:
+            FRAME_WIDTH, FRAME_HEIGHT = image_size(frame_file_pattern % frame_file_first)
+        print('Tile size %d x %d' % (FRAME_WIDTH, FRAME_HEIGHT))
+        
+        with stages('table'):
+            views, offsets = get_frames_lookup_table(calibration, NUM_FRAMES, (FRAME_WIDTH, FRAME_HEIGHT))
+            buckets = get_frames_buckets(calibration, NUM_FRAMES, (FRAME_WIDTH, FRAME_HEIGHT))
+            del views
+        
+        # The view images are decoded while gathering, so the 'gather'
+        # stage includes decoding
+        with stages('gather'):
+            out = np.empty((calibration.screenH, calibration.screenW, 3), np.uint8)
+            interlace_frames_bucketed(load_frame, NUM_FRAMES, offsets, buckets, out)
+        
+        with stages('encode'):
+            save_native(out, native_image_file, order, compress_level=compress_level)
+        
+        metrics.write(stages, pixels=calibration.screenW*calibration.screenH)
+        metrics.close()
+        
+        return
+        
+    # Load tiles
 
-def determine_view(a):
-    res = NUM_FRAMES - 1
-    a = a%1 * NUM_FRAMES
-    res -= floor(a)
-    return res
-    
-def pixel_color(u, v):
-    
-    # XXX simplified to use the same i value for each subpixel. Seems to
-    # work, as the subpixels can still get different views, but not sure
-    # this is fully equivalent to what the Lenticular shader does :)
-    i = int(u * FRAME_WIDTH)
-    j = int(v * FRAME_HEIGHT)
-    
-    a = (u + (1.0 - v)*tilt)*pitch - center
-    
-    # Red
-    view = determine_view(a)
-    img = tile_pixels[view]
-    r = img[i,j][0]
-    
-    # Green
-    view = determine_view(a+subp)
-    img = tile_pixels[view]
-    g = img[i,j][1]
-    
-    # Blue
-    view = determine_view(a+2*subp)
-    img = tile_pixels[view]
-    b = img[i,j][2]
-    
-    return (r, g, b)
-    
-outimg = Image.new('RGB', (screenW, screenH))
-opx = outimg.load()
+    frames = None
 
-for j in range(screenH):
-    v = (j+0.5) / screenH
+    with stages('decode'):
+        if container is not None:
+            # Only the chunks holding these views, in parallel
+            images = container.read_views(list(range(frame_file_first, frame_file_last+1)))
+        else:
+            images = map(read_frame, range(NUM_FRAMES))
+        for i, img in enumerate(images):
+            if frames is None:
+                FRAME_HEIGHT, FRAME_WIDTH = img.shape[:2]
+                frames = np.empty((NUM_FRAMES, FRAME_HEIGHT, FRAME_WIDTH, 3), np.uint8)
+            frames[i] = img
+            
+    print('Tile size %d x %d' % (FRAME_WIDTH, FRAME_HEIGHT))
+
+    interlacer = Interlacer(calibration, 'frames', NUM_FRAMES, sampling=sampling)
     
-    for i in range(screenW):
-        u = (i+0.5) / screenW
+    with stages('table'):
+        interlacer.lookup_table((FRAME_WIDTH, FRAME_HEIGHT))
         
-        opx[i,j] = pixel_color(u, v)
+    with stages('gather'):
+        native = interlacer.convert(frames)
+
+    with stages('encode'):
+        save_native(native, native_image_file, order, compress_level=compress_level)
         
-del opx
-outimg.save(native_image_file)
+    metrics.write(stages, pixels=calibration.screenW*calibration.screenH)
+    metrics.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -34,25 +34,62 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import os, sys, getopt, json, time, tempfile
 from struct import unpack
-import json
-import hid
+
+from calibration import cache_dir
 
 USB_VID = 0x04d8
 USB_PID = 0xef7e
 
-def hid_multiread(dev):
+# Data is read in pages of 64 bytes. First page (0) starts with a
+# 4 byte header denoting the length of the calibration data (in JSON
+# format). The response to a page query is the 4 byte request header,
+# followed by the page.
+PAGE_SIZE = 64
+RESPONSE_SIZE = 4 + PAGE_SIZE
+READ_TIMEOUT_MS = 1000
+
+def usage():
+    print('usage: %s [options]' % sys.argv[0])
+    print()
+    print('Prints the calibration of the attached display. With multiple displays')
+    print('a JSON object mapping serial numbers to calibrations is printed.')
+    print()
+    print('options:')
+    print('  -o <directory>     Save the calibration of each display to <directory>/<serial>.json')
+    print('  -r                 Read the full calibration, also when it is cached (e.g. after')
+    print('                     recalibrating), and update the cache')
+    print('  -f                 Ignore (and do not update) cached calibrations')
+    print('  -t                 Print timing information to stderr')
+    print('  -F <visual.json>[,<visual.json>...]')
+    print('                     Use fake displays holding the given calibrations, instead of')
+    print('                     actual hardware (for testing and benchmarking)')
+    print('  -L <ms>            Response latency of the fake displays (default: 1)')
+    print()
+    sys.exit(-1)
+    
+def hid_read(dev, size):
+    
+    # Read reports until size bytes have arrived. Only waits for as long
+    # as the device takes to respond, instead of for a timeout after the
+    # last report
     
-    data = dev.read(128, timeout_ms=10)
-    res = data
+    res = []
     
-    while len(data) > 0:
-        data = dev.read(128, timeout_ms=10)
+    while len(res) < size:
+        data = dev.read(128, timeout_ms=READ_TIMEOUT_MS)
+        if len(data) == 0:
+            raise IOError('Timeout reading from device')
         res.extend(data)
         
     return res
 
 def hid_query(dev, addr):
+    
+    # Discard anything left over from an earlier request
+    while len(dev.read(128, timeout_ms=0)) > 0:
+        pass
 
     # 68 byte request, might actually need 64, but not clear
     # when hid versus hidraw is used.
@@ -66,40 +103,166 @@ def hid_query(dev, addr):
     res = dev.send_feature_report(buffer)        
     assert res >= 0
 
-    res = hid_multiread(dev)
+    res = hid_read(dev, RESPONSE_SIZE)
     assert res[:4] == list(buffer[:4])
     
-    return res[4:]
+    return res[4:RESPONSE_SIZE]
+    
+def read_calibration(dev, page=None):
+    
+    # Returns the calibration JSON text. page: the first page, when it 
+    # was read already
+    
+    if page is None:
+        page = hid_query(dev, 0)
+    json_size = unpack('>I', bytes(page[:4]))[0]
+    
+    json_data = page[4:]
+    addr = 1
+    while len(json_data) < json_size:    
+        page = hid_query(dev, addr)
+        json_data.extend(page)
+        addr += 1
+        
+    json_data = json_data[:json_size]
+    json_data = bytes(json_data)
+    json_data = json_data.decode('utf8')
+    
+    return json_data
+    
+def safe_name(serial):
+    # For use in a file name
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(serial))
+    
+def cache_file(serial):
+    
+    d = cache_dir()
+    if not d or not serial:
+        return None
+        
+    return os.path.join(d, 'eeprom-%s.json' % safe_name(serial))
+    
+def load_cached(serial):
+    
+    fname = cache_file(serial)
+    if fname is None:
+        return None
+    
+    try:
+        return json.load(open(fname, 'rt'))
+    except (OSError, ValueError):
+        return None
+        
+def store_cached(serial, header, calibration):
+    
+    fname = cache_file(serial)
+    if fname is None:
+        return
+    
+    d = os.path.dirname(fname)
+    
+    try:
+        os.makedirs(d, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=d, suffix='.tmp')
+        with os.fdopen(fd, 'wt') as f:
+            json.dump(dict(header=header, calibration=calibration), f)
+        os.replace(tmpname, fname)
+    except OSError as e:
+        sys.stderr.write('Warning: could not store calibration in %s: %s\n' % (d, e))
+        
+def read_display(hid, devinfo, use_cache=True, refresh=False):
+    
+    # The parsed calibration is cached per serial number, and used when
+    # the first page of the EEPROM is unchanged: the size and the start 
+    # of the JSON text (configVersion, serial). So only one page is read
+    # for a known display. A recalibration that keeps the size the same 
+    # is not noticed, refresh reads the full calibration regardless.
+    
+    serial = devinfo.get('serial_number')
+    
+    dev = hid.device()
+    dev.open_path(devinfo['path'])
+    try:
+        page = hid_query(dev, 0)
+        header = bytes(page).hex()
+        
+        if use_cache and not refresh:
+            cached = load_cached(serial)
+            if cached is not None and cached.get('header') == header:
+                return cached['calibration']
+                
+        json_data = read_calibration(dev, page)
+    finally:
+        dev.close()
+        
+    calibration = json.loads(json_data)
+    
+    if use_cache:
+        store_cached(serial, header, calibration)
+        
+    return calibration
+    
 
-devs = list(hid.enumerate(USB_VID, USB_PID))
-#print(devs)
-assert len(devs) == 1
-devinfo = devs[0]
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'o:rftF:L:')
+except getopt.GetoptError:
+    usage()
+    
+if len(args) != 0:
+    usage()
+    
+output_dir = None
+use_cache = True
+refresh = False
+timing = False
+fake_files = None
+fake_latency = 1.0
 
-dev = hid.device()
-dev.open_path(devinfo['path'])
-#dev.set_nonblocking(1)
+for o, a in opts:
+    if o == '-o':
+        output_dir = a
+    elif o == '-r':
+        refresh = True
+    elif o == '-f':
+        use_cache = False
+    elif o == '-t':
+        timing = True
+    elif o == '-F':
+        fake_files = a.split(',')
+    elif o == '-L':
+        fake_latency = float(a)
 
-# Data is read in pages of 64 bytes. First page (0) starts with a
-# 4 byte header denoting the length of the calibration data (in JSON
-# format)
-page = hid_query(dev, 0)
+if fake_files is not None:
+    from fakehid import FakeHID
+    hid = FakeHID(fake_files, fake_latency)
+else:
+    import hid
 
-json_size = unpack('>I', bytes(page[:4]))[0]
-#print('JSON size: %d' % json_size)
+devs = list(hid.enumerate(USB_VID, USB_PID))
+if len(devs) == 0:
+    sys.stderr.write('No Looking Glass display found\n')
+    sys.exit(1)
 
-json_data = page[4:]
-addr = 1
-while len(json_data) < json_size:    
-    page = hid_query(dev, addr)
-    json_data.extend(page)
-    addr += 1
-    
-json_data = json_data[:json_size]
-json_data = bytes(json_data)
-json_data = json_data.decode('utf8')
+calibrations = []
 
+for devinfo in devs:
+    t0 = time.time()
+    calibration = read_display(hid, devinfo, use_cache, refresh)
+    t1 = time.time()
+    
+    serial = calibration.get('serial', devinfo.get('serial_number'))
+    calibrations.append((serial, calibration))
+    
+    if timing:
+        sys.stderr.write('%s: %.1f ms\n' % (serial, (t1-t0)*1000))
+    
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, '%s.json' % safe_name(serial or 'unknown')), 'wt') as f:
+            json.dump(calibration, f, indent=4)
+            
 # Pretty print
-parsed = json.loads(json_data)
-print(json.dumps(parsed, indent=4))
-
+if len(calibrations) == 1:
+    print(json.dumps(calibrations[0][1], indent=4))
+else:
+    print(json.dumps(dict(calibrations), indent=4))
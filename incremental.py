@@ -0,0 +1,233 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Incremental interlacing, for content where only small parts of the
+# quilt (or set of view images) change between frames. The native 
+# subpixels are grouped by the block of source pixels they sample, so
+# after a change only the subpixels sampling the changed blocks are 
+# gathered again. Changed regions can be passed explicitly, or are found
+# by comparing blocks with the previous source.
+
+import numpy as np
+
+from interlace import (calibration_key, cached, interlace, frames_flat_table,
+    get_quilt_lookup_table, get_frames_lookup_table)
+from layout import quilt_view_rects
+
+# Above this fraction of changed subpixels a full gather is faster
+FULL_GATHER_FRACTION = 0.4
+
+def block_index(table, source_size, block):
+    
+    # Group the native subpixels by the source block (of block x block 
+    # pixels) they sample. Returns the flat native positions ordered by
+    # block, and the start of each block's range in them.
+    
+    SWIDTH, SHEIGHT = source_size
+    blocks_x = -(-SWIDTH // block)
+    blocks_y = -(-SHEIGHT // block)
+    
+    pixel = table.reshape(-1) // 3
+    y = pixel // SWIDTH
+    pixel -= y * SWIDTH
+    pixel //= block
+    y //= block
+    y *= blocks_x
+    y += pixel
+    del pixel
+    
+    positions = np.argsort(y, kind='stable').astype(np.uint32)
+    
+    bounds = np.zeros(blocks_x*blocks_y + 1, np.int64)
+    np.cumsum(np.bincount(y, minlength=blocks_x*blocks_y), out=bounds[1:])
+    
+    return positions, bounds
+    
+    
+class IncrementalInterlacer:
+    
+    def __init__(self, table, source_size, index, block, view_rects=None):
+        
+        # table: flat offsets into the (SHEIGHT, SWIDTH, 3) source, as 
+        # for interlace(). index: as returned by block_index(). 
+        # view_rects: optional (x0, y0, x1, y1) of each view in the source
+        
+        self.table = table
+        self.source_size = source_size
+        self.positions, self.bounds = index
+        self.block = block
+        self.view_rects = view_rects
+        
+        SWIDTH, SHEIGHT = source_size
+        self.blocks_shape = (-(-SHEIGHT // block), -(-SWIDTH // block))
+        
+        self.previous = None
+        self.out = np.empty(table.shape, np.uint8)
+        
+        # Number of native subpixels gathered by the last update()
+        self.updated = 0
+        
+    def region_blocks(self, regions):
+        
+        # regions: (x0, y0, x1, y1) in source pixels, or (view, x0, y0, x1, y1)
+        # in pixels of that view
+        
+        SWIDTH, SHEIGHT = self.source_size
+        dirty = np.zeros(self.blocks_shape, bool)
+        
+        for r in regions:
+            
+            if len(r) == 5:
+                vx0, vy0, vx1, vy1 = self.view_rects[r[0]]
+                x0, y0 = int(vx0 + r[1]), int(vy0 + r[2])
+                x1, y1 = min(-int(-(vx0 + r[3])), -int(-vx1)), min(-int(-(vy0 + r[4])), -int(-vy1))
+            else:
+                x0, y0, x1, y1 = r
+                
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, SWIDTH), min(y1, SHEIGHT)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            
+            dirty[y0//self.block:-(-y1//self.block), x0//self.block:-(-x1//self.block)] = True
+            
+        return dirty
+        
+    def diff_blocks(self, source):
+        
+        # Compare one row of blocks at a time, as 64-bit words when the
+        # row and block widths allow, skipping rows without changes
+        
+        B = self.block
+        blocks_y, blocks_x = self.blocks_shape
+        SWIDTH, SHEIGHT = self.source_size
+        
+        word = 8 if (SWIDTH*3) % 8 == 0 and (B*3) % 8 == 0 else 1
+        dtype = np.uint64 if word == 8 else np.uint8
+        current = source.reshape(SHEIGHT, -1).view(dtype)
+        previous = self.previous.reshape(SHEIGHT, -1).view(dtype)
+        
+        dirty = np.zeros(self.blocks_shape, bool)
+        columns = np.zeros(blocks_x * B*3 // word, bool)
+        
+        for by in range(blocks_y):
+            rows = slice(by*B, (by+1)*B)
+            changed = current[rows] != previous[rows]
+            if not changed.any():
+                continue
+            changed.any(axis=0, out=columns[:current.shape[1]])
+            columns.reshape(blocks_x, -1).any(axis=1, out=dirty[by])
+            
+        return dirty
+        
+    def update(self, source, regions=None):
+        
+        # Returns the native image for source, a (SHEIGHT, SWIDTH, 3) 
+        # uint8 array. regions: the changed regions since the previous 
+        # call (see region_blocks()), or None to find them by comparing
+        # with the previous source.
+        
+        SWIDTH, SHEIGHT = self.source_size
+        source = source.reshape((SHEIGHT, SWIDTH, 3))
+        
+        if self.previous is None:
+            self.previous = source.copy()
+            interlace(source, self.table, out=self.out)
+            self.updated = self.table.size
+            return self.out
+            
+        if regions is None:
+            dirty = self.diff_blocks(source)
+        else:
+            dirty = self.region_blocks(regions)
+            
+        self.updated = 0
+        
+        blocks = np.flatnonzero(dirty)
+        if len(blocks) == 0:
+            return self.out
+        
+        # Keep a copy of the changed parts, as the caller may reuse
+        # the source array for the next frame
+        B = self.block
+        for by in np.flatnonzero(dirty.any(axis=1)):
+            bx = np.flatnonzero(dirty[by])
+            rows = slice(by*B, (by+1)*B)
+            cols = slice(bx[0]*B, (bx[-1]+1)*B)
+            self.previous[rows, cols] = source[rows, cols]
+            
+        starts = self.bounds[blocks]
+        counts = self.bounds[blocks+1] - starts
+        total = int(counts.sum())
+        
+        if total > FULL_GATHER_FRACTION * self.table.size:
+            interlace(source, self.table, out=self.out)
+            self.updated = self.table.size
+            return self.out
+        
+        # Concatenated ranges of the positions of all changed blocks
+        ends = np.cumsum(counts)
+        index = np.arange(total, dtype=np.int64)
+        index += np.repeat(starts - (ends - counts), counts)
+        
+        positions = self.positions[index]
+        del index
+        
+        out = self.out.reshape(-1)
+        out[positions] = source.reshape(-1)[self.table.reshape(-1)[positions]]
+        
+        self.updated = total
+        
+        return self.out
+        
+        
+def quilt_interlacer(calibration, tiles, quilt_size, block=16):
+    
+    table = get_quilt_lookup_table(calibration, tiles, quilt_size)
+    
+    params = (calibration_key(calibration), tuple(tiles), tuple(quilt_size), block)
+    index = cached('quilt-blocks', params, lambda: block_index(table, quilt_size, block))
+    
+    return IncrementalInterlacer(table, quilt_size, index, block, 
+        quilt_view_rects(tiles, quilt_size))
+        
+        
+def frames_interlacer(calibration, num_frames, frame_size, block=16):
+    
+    # The source is the (NUM_FRAMES, FRAME_HEIGHT, FRAME_WIDTH, 3) array 
+    # of all frames, treated as one image of the frames stacked vertically
+    
+    FRAME_WIDTH, FRAME_HEIGHT = frame_size
+    source_size = (FRAME_WIDTH, num_frames*FRAME_HEIGHT)
+    
+    views, offsets = get_frames_lookup_table(calibration, num_frames, frame_size)
+    table = frames_flat_table(views, offsets, frame_size)
+    
+    params = (calibration_key(calibration), num_frames, tuple(frame_size), block)
+    index = cached('frames-blocks', params, lambda: block_index(table, source_size, block))
+    
+    view_rects = [(0, i*FRAME_HEIGHT, FRAME_WIDTH, (i+1)*FRAME_HEIGHT) for i in range(num_frames)]
+    
+    return IncrementalInterlacer(table, source_size, index, block, view_rects)
@@ -0,0 +1,434 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Array-based versions of the per-pixel loops in the *2native.py scripts.
+#
+# Instead of evaluating pixel_color() for every native pixel the mapping
+# from native subpixel to quilt texel is computed for the whole screen at
+# once, as a table of flat offsets into the (H, W, 3) quilt array. 
+# Producing a native image is then a single gather from the quilt.
+#
+# All floating-point operations are done in the same order as in the 
+# original scripts, so the results are bit-identical.
+#
+# As the tables only depend on the calibration values and the layout
+# they are cached on disk (in $LG_CACHE_DIR, by default 
+# ~/.cache/looking-glass), and memory-mapped when used again. Set 
+# LG_CACHE_DIR to an empty string to disable the cache.
+
+import os, sys, hashlib, tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+from calibration import cache_dir
+from tiledquilt import TiledQuilt, is_tiled
+from rawimage import is_raw, load_raw, raw_size
+
+# Increase when the table contents change
+CACHE_VERSION = 2
+
+# Size limit of the reduced quilts cached by load_quilt_reduced(), the
+# least recently used are removed beyond it
+REDUCED_CACHE_BYTES = 1024 * 1024 * 1024
+
+def native_uv(calibration, offset=0.0):
+
+    # XXX offset with 0.5 a pixel?
+    u = (np.arange(calibration.screenW) + offset) / calibration.screenW
+    v = (np.arange(calibration.screenH) + offset) / calibration.screenH
+    
+    return u[np.newaxis,:], v[:,np.newaxis]
+
+
+def quilt_phase(calibration, u, v):
+    return (u + (1.0 - v)*calibration.tilt)*calibration.pitch - calibration.center
+
+
+def frac(a):
+    # Same result as a%1 (also for negative a), but a lot faster than np.mod
+    return a - np.floor(a)
+    
+
+def quilt_tiles(a, tiles):
+
+    # Y major positive direction, X minor negative direction
+    a = frac(a)
+    a *= tiles[1]
+    ty = np.floor(a)
+    a -= ty
+    a *= tiles[0]
+    tx = np.floor(a, out=a)
+    np.subtract(tiles[0] - 1, tx, out=tx)
+    
+    return tx, ty
+
+
+def quilt_lookup_table(calibration, tiles, quilt_size, rows=None, out=None):
+    
+    # rows: optional (first, last+1) range of native rows to compute the table for
+    
+    QWIDTH, QHEIGHT = quilt_size
+    INV_TILES = (1.0/tiles[0], 1.0/tiles[1])
+    
+    u, v = native_uv(calibration)
+    if rows is not None:
+        v = v[rows[0]:rows[1]]
+    a = quilt_phase(calibration, u, v)
+    
+    table = np.empty(a.shape + (3,), np.uint32) if out is None else out
+    
+    # R, G and B sample with a phase offset of 0, 1 and 2 subpixels
+    for c in range(3):
+        
+        tx, ty = quilt_tiles(a + c*calibration.subp, tiles)
+        
+        # XXX nearest-neighbour sampling
+        tx += u
+        tx *= INV_TILES[0]
+        tx *= QWIDTH
+        ty += v
+        ty *= INV_TILES[1]
+        ty *= QHEIGHT
+        x = tx.astype(np.int64)
+        y = ty.astype(np.int64)
+        
+        y *= QWIDTH
+        y += x
+        y *= 3
+        y += c
+        table[:,:,c] = y
+        
+    return table
+    
+
+def view_lookup_table(calibration, tiles, view_size, offset=0.0, rows=None):
+    
+    # Per native subpixel the view it samples, numbered from the bottom-left
+    # tile as in make_quilt.py, plus (shared by the three subpixels) the 
+    # flat offset of the pixel it samples in a view image of view_size.
+    # offset is the position within a native pixel that is sampled. This
+    # is how frames2native.py samples separate view images, views placed
+    # in a (padded) quilt are sampled at quilt_lookup_table() positions.
+    # rows: optional (first, last+1) range of native rows to compute the 
+    # tables for.
+    
+    VIEW_WIDTH, VIEW_HEIGHT = view_size
+    
+    u, v = native_uv(calibration, offset)
+    if rows is not None:
+        v = v[rows[0]:rows[1]]
+    i = (u * VIEW_WIDTH).astype(np.int64)
+    j = (v * VIEW_HEIGHT).astype(np.int64)
+    
+    offsets = np.empty((v.shape[0], calibration.screenW), np.uint32)
+    offsets[:] = (j*VIEW_WIDTH + i)*3
+    
+    a = quilt_phase(calibration, u, v)
+    
+    num_views = tiles[0] * tiles[1]
+    views = np.empty((v.shape[0], calibration.screenW, 3), 
+        np.uint8 if num_views <= 256 else np.uint16)
+    
+    for c in range(3):
+        tx, ty = quilt_tiles(a + c*calibration.subp, tiles)
+        # Tile row ty counts from the top of the quilt
+        ty -= tiles[1] - 1
+        ty *= -tiles[0]
+        ty += tx
+        views[:,:,c] = ty
+        
+    return views, offsets
+    
+    
+def frames_lookup_table(calibration, num_frames, frame_size):
+    
+    # Linear mapping, with a separate image per view. Per subpixel we
+    # store the view index, the pixel offset within the view is shared 
+    # by the three subpixels.
+    
+    # XXX simplified to use the same i value for each subpixel, see frames2native.py
+    return view_lookup_table(calibration, (num_frames, 1), frame_size, 0.5)
+    
+
+def frames_buckets(views, num_frames):
+    
+    # Group the native subpixels by the view they sample. Returns the 
+    # flat output positions ordered by view, and the start of each 
+    # view's range in them (num_frames+1 values, as views that are not
+    # sampled at all get an empty range).
+    
+    views = views.reshape(-1)
+    
+    positions = np.argsort(views, kind='stable').astype(np.uint32)
+    
+    bounds = np.zeros(num_frames+1, np.int64)
+    np.cumsum(np.bincount(views, minlength=num_frames), out=bounds[1:])
+    
+    return positions, bounds
+    
+
+def calibration_key(calibration):
+    # The (derived) values that determine the mapping
+    return (calibration.screenW, calibration.screenH, calibration.pitch, 
+        calibration.tilt, calibration.subp, calibration.center)
+    
+    
+def cached(name, params, compute):
+    
+    # Return the arrays computed by compute(), loading them memory-mapped
+    # from the cache when available. params needs to contain everything
+    # the result depends on.
+    
+    d = cache_dir()
+    if not d:
+        return compute()
+    
+    key = hashlib.sha1(repr((CACHE_VERSION, name, params)).encode('utf8')).hexdigest()
+    prefix = os.path.join(d, '%s-%s' % (name, key))
+    
+    try:
+        n = int(open(prefix + '.count', 'rt').read())
+        return tuple(np.load('%s.%d.npy' % (prefix, i), mmap_mode='r') for i in range(n))
+    except (OSError, ValueError):
+        pass
+        
+    arrays = compute()
+    
+    try:
+        os.makedirs(d, exist_ok=True)
+        
+        # Write to temporary files first and rename, so concurrent 
+        # processes never see partial files. The count file goes last.
+        for i, arr in enumerate(arrays):
+            fd, tmpname = tempfile.mkstemp(dir=d, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, arr)
+            os.replace(tmpname, '%s.%d.npy' % (prefix, i))
+            
+        fd, tmpname = tempfile.mkstemp(dir=d, suffix='.tmp')
+        with os.fdopen(fd, 'wt') as f:
+            f.write(str(len(arrays)))
+        os.replace(tmpname, prefix + '.count')
+        
+    except OSError as e:
+        sys.stderr.write('Warning: could not store lookup table in %s: %s\n' % (d, e))
+        
+    return arrays
+    
+    
+def get_quilt_lookup_table(calibration, tiles, quilt_size, workers=1):
+    
+    params = (calibration_key(calibration), tuple(tiles), tuple(quilt_size))
+    
+    def compute():
+        if workers > 1:
+            from parallel import quilt_lookup_table_threaded
+            return (quilt_lookup_table_threaded(calibration, tiles, quilt_size, workers),)
+        return (quilt_lookup_table(calibration, tiles, quilt_size),)
+    
+    return cached('quilt', params, compute)[0]
+    
+    
+def get_frames_lookup_table(calibration, num_frames, frame_size):
+    
+    params = (calibration_key(calibration), num_frames, tuple(frame_size))
+    
+    return cached('frames', params, 
+        lambda: frames_lookup_table(calibration, num_frames, frame_size))
+    
+
+def get_frames_buckets(calibration, num_frames, frame_size):
+    
+    params = (calibration_key(calibration), num_frames, tuple(frame_size))
+    
+    return cached('frames-buckets', params, 
+        lambda: frames_buckets(get_frames_lookup_table(calibration, num_frames, frame_size)[0], num_frames))
+        
+        
+def load_quilt(filename):
+    
+    # An image, a tiled quilt file (see tiledquilt.py) or an uncompressed
+    # NPY or PPM file, which is memory-mapped (see rawimage.py)
+    
+    if is_tiled(filename):
+        with TiledQuilt(filename) as quilt:
+            return quilt.read_quilt()
+            
+    if is_raw(filename):
+        return load_raw(filename)
+    
+    img = Image.open(filename)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+        
+    return np.asarray(img)
+    
+    
+def image_size(filename):
+    
+    # (width, height) of an image or tiled quilt file, without decoding it
+    
+    if is_tiled(filename):
+        with TiledQuilt(filename) as quilt:
+            return quilt.quilt_size
+            
+    if is_raw(filename):
+        return raw_size(filename)
+            
+    return Image.open(filename).size
+    
+    
+def reduction_factor(calibration, quilt_size):
+    
+    # Each of the views gets screenW*screenH/num_views native samples per
+    # channel, against QWIDTH*QHEIGHT/num_views texels in its tile. Returns
+    # the integer factor the quilt can be reduced by while keeping at 
+    # least as many texels as samples.
+    
+    QWIDTH, QHEIGHT = quilt_size
+    ratio = (calibration.screenW * calibration.screenH) / (QWIDTH * QHEIGHT)
+    
+    if ratio >= 1:
+        return 1
+        
+    return int(1 / ratio**0.5)
+    
+    
+def load_quilt_reduced(filename, calibration):
+    
+    # Load the quilt at the reduced resolution the display needs. JPEG
+    # images are decoded at a reduced scale directly, other formats are 
+    # reduced (box filter) once and the result cached (in "reduced" in 
+    # the cache directory, up to REDUCED_CACHE_BYTES).
+    
+    factor = reduction_factor(calibration, image_size(filename))
+    
+    if factor == 1:
+        return load_quilt(filename)
+        
+    if not is_tiled(filename) and not is_raw(filename):
+        
+        img = Image.open(filename)
+        
+        if img.format == 'JPEG':
+            img.draft('RGB', (-(-img.size[0] // factor), -(-img.size[1] // factor)))
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            return np.asarray(img)
+        
+    # Imports this module
+    from nativecache import NativeCache
+    
+    d = cache_dir()
+    cache = NativeCache(REDUCED_CACHE_BYTES, os.path.join(d, 'reduced') if d else None)
+    
+    st = os.stat(filename)
+    params = (os.path.realpath(filename), st.st_mtime_ns, st.st_size, factor)
+    key = hashlib.sha1(repr((CACHE_VERSION, params)).encode('utf8')).hexdigest()
+    
+    quilt = cache.load_array(key)
+    
+    if quilt is None:
+        quilt = np.asarray(Image.fromarray(load_quilt(filename)).reduce(factor))
+        cache.store_array(key, quilt)
+        
+    return quilt
+    
+    
+def interlace(quilt, table, out=None):
+    # quilt: (QHEIGHT, QWIDTH, 3) uint8 array, table: as returned by quilt_lookup_table(),
+    # or a filtered.WeightTable. The table only holds valid offsets, mode='clip' is used
+    # as with the default mode='raise' np.take() writes to a temporary buffer instead of
+    # directly to out.
+    if not isinstance(table, np.ndarray):
+        return table.gather(quilt, out)
+    return np.take(quilt.reshape(-1), table, out=out, mode='clip')
+    
+    
+def frames_flat_table(views, offsets, frame_size):
+    
+    # Combine the view and offset tables into a single table of flat 
+    # offsets into the (NUM_FRAMES, FRAME_HEIGHT, FRAME_WIDTH, 3) array 
+    # of all frames, for use with interlace()
+    
+    FRAME_WIDTH, FRAME_HEIGHT = frame_size
+    frame_bytes = FRAME_WIDTH * FRAME_HEIGHT * 3
+    
+    dtype = np.uint32 if int(views.max()+1)*frame_bytes <= 2**32 else np.int64
+    
+    table = views.astype(dtype)
+    table *= frame_bytes
+    table += offsets[:,:,np.newaxis]
+    table += np.arange(3, dtype=dtype)
+    
+    return table
+    
+    
+def interlace_frames_bucketed(load_frame, num_frames, offsets, buckets, out):
+    
+    # Gather the native image one view at a time, with load_frame(i) 
+    # returning view i as (FRAME_HEIGHT, FRAME_WIDTH, 3) array. Only 
+    # the current view is kept in memory, while the next one is decoded
+    # in the background.
+    
+    positions, bounds = buckets
+    offsets = offsets.reshape(-1)
+    out_flat = out.reshape(-1)
+    
+    with ThreadPoolExecutor(1) as decoder:
+        
+        pending = decoder.submit(load_frame, 0)
+        
+        for i in range(num_frames):
+            
+            frame = pending.result()
+            
+            if i+1 < num_frames:
+                pending = decoder.submit(load_frame, i+1)
+                
+            pos = positions[bounds[i]:bounds[i+1]]
+            src = offsets[pos // 3]
+            src += pos % 3
+            
+            out_flat[pos] = frame.reshape(-1)[src]
+            
+            del frame, src
+            
+    return out
+    
+    
+def interlace_frames(frames, views, offsets, out=None):
+    
+    # frames: (NUM_FRAMES, FRAME_HEIGHT, FRAME_WIDTH, 3) uint8 array
+    frames = frames.reshape(frames.shape[0], -1)
+    
+    if out is None:
+        out = np.empty(views.shape, np.uint8)
+        
+    for c in range(3):
+        out[:,:,c] = frames[views[:,:,c], offsets + c]
+        
+    return out
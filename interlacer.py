@@ -0,0 +1,259 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Interface for using the conversions from other Python code, e.g.
+#
+#   from interlacer import Interlacer
+#
+#   interlacer = Interlacer('visual.json', 'grid', (5, 9))
+#   native = interlacer.convert(quilt)
+#
+# An Interlacer is made once per calibration and quilt layout, and keeps
+# the lookup tables for the quilt (or view) sizes it has seen. Inputs 
+# and outputs are NumPy arrays or PIL images. NumPy and PIL are only 
+# imported when first needed, so importing this module is cheap.
+
+from calibration import Calibration
+
+LAYOUTS = ('grid', 'linear', 'frames')
+
+class Interlacer:
+    
+    def __init__(self, calibration, layout='grid', tiles=None, workers=1, processes=False,
+        sampling='nearest'):
+        
+        # calibration: a Calibration, or the name of a calibration JSON file.
+        # tiles: (tilesh, tilesv) for a grid quilt (default 5x9), the number
+        # of tiles for a linear quilt or the number of views for separate
+        # frames (default 45). workers > 1 converts with multiple threads,
+        # or processes. sampling: 'nearest', 'bilinear' or '<N>x<M>' 
+        # supersampling (see filtered.py).
+        
+        if not isinstance(calibration, Calibration):
+            calibration = Calibration(calibration)
+            
+        if layout not in LAYOUTS:
+            raise ValueError('Unknown layout "%s"' % layout)
+            
+        from filtered import parse_sampling
+        if parse_sampling(sampling) is None:
+            sampling = 'nearest'
+            
+        if tiles is None:
+            tiles = (5, 9) if layout == 'grid' else 45
+        if layout != 'grid':
+            tiles = (int(tiles), 1)
+            
+        self.calibration = calibration
+        self.layout = layout
+        self.tiles = tuple(tiles)
+        self.workers = workers
+        self.processes = processes
+        self.sampling = sampling
+        
+        self.tables = {}
+        self.executor = None
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+        
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+            
+    @property
+    def native_size(self):
+        return self.calibration.screenW, self.calibration.screenH
+        
+    def lookup_table(self, size):
+        
+        # size: quilt size, or frame size for separate frames
+        
+        size = tuple(size)
+        
+        if size not in self.tables:
+            
+            from interlace import get_frames_lookup_table
+            from filtered import get_lookup_table, get_frames_weight_table
+            
+            if self.layout != 'frames':
+                self.tables[size] = get_lookup_table(self.calibration, self.tiles, size, 
+                    self.sampling, self.workers)
+            elif self.sampling != 'nearest':
+                self.tables[size] = get_frames_weight_table(self.calibration, self.tiles[0], size,
+                    self.sampling, self.workers)
+            else:
+                self.tables[size] = get_frames_lookup_table(self.calibration, self.tiles[0], size)
+                
+        return self.tables[size]
+        
+    def convert(self, quilt, out=None):
+        
+        # quilt: (QHEIGHT, QWIDTH, 3) uint8 array or PIL image. For frames
+        # a (NUM_FRAMES, FRAME_HEIGHT, FRAME_WIDTH, 3) array or a list of 
+        # arrays or images. Returns the native image as a PIL image when 
+        # given images, as an array otherwise (in out, when given).
+        
+        import numpy as np
+        from PIL import Image
+        
+        if self.layout == 'frames':
+            is_image = len(quilt) > 0 and isinstance(quilt[0], Image.Image)
+            if is_image or isinstance(quilt, (list, tuple)):
+                quilt = np.stack([self.as_array(frame) for frame in quilt])
+            if quilt.shape[0] != self.tiles[0]:
+                raise ValueError('Expected %d frames, got %d' % (self.tiles[0], quilt.shape[0]))
+            native = self.convert_frames(quilt, out)
+        else:
+            is_image = isinstance(quilt, Image.Image)
+            native = self.convert_quilt(self.as_array(quilt), out)
+            
+        return Image.fromarray(native) if is_image else native
+        
+    def as_array(self, img):
+        
+        import numpy as np
+        from PIL import Image
+        
+        if isinstance(img, Image.Image):
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            return np.asarray(img)
+            
+        if img.ndim != 3 or img.shape[2] != 3 or img.dtype != np.uint8:
+            raise ValueError('Expected an RGB uint8 array, got shape %s %s' % (img.shape, img.dtype))
+            
+        return img
+        
+    def convert_quilt(self, quilt, out):
+        
+        import numpy as np
+        from interlace import interlace
+        
+        table = self.lookup_table(quilt.shape[1::-1])
+        
+        if self.workers <= 1:
+            return interlace(quilt, table, out)
+            
+        if self.processes:
+            from parallel import interlace_processes
+            native = interlace_processes(quilt, table, self.workers)
+            if out is None:
+                return native
+            out[:] = native
+            return out
+            
+        from concurrent.futures import ThreadPoolExecutor
+        from parallel import interlace_threaded
+        
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers)
+        if out is None:
+            out = np.empty(table.shape, np.uint8)
+            
+        return interlace_threaded(quilt, table, out, self.executor, self.workers)
+        
+    def convert_frames(self, frames, out):
+        
+        from interlace import interlace, interlace_frames
+        
+        table = self.lookup_table(frames.shape[2:0:-1])
+        
+        if self.sampling != 'nearest':
+            return interlace(frames, table, out)
+        
+        views, offsets = table
+        
+        return interlace_frames(frames, views, offsets, out)
+        
+    def convert_file(self, quilt_file, native_file, preview=False, stages=None, order='rgb', 
+        cache=None, **params):
+        
+        # For frames quilt_file is a list of file names. With preview a 
+        # quilt is loaded at the reduced resolution the display needs (see
+        # load_quilt_reduced()). stages: a metrics.Stages, to time the 
+        # decode, table, gather and encode stages. Uncompressed output files
+        # (see rawimage.py) are written in channel order, the native image
+        # is gathered straight into them. params are passed on to PIL for
+        # other formats, e.g. compress_level. cache: a nativecache.NativeCache,
+        # returns True when the native image was taken from it.
+        
+        from interlace import load_quilt, load_quilt_reduced
+        from metrics import Stages
+        from rawimage import is_raw, check_order, MappedOutput
+        from sequence import save_native
+        
+        check_order(native_file, order)
+        
+        if stages is None:
+            stages = Stages()
+            
+        if cache is not None:
+            
+            from nativecache import conversion_params
+            
+            with stages('cache'):
+                key = cache.key(quilt_file, conversion_params(self.calibration, self.layout, 
+                    self.tiles, native_file, sampling=self.sampling, preview=preview, order=order, **params))
+                if cache.fetch(key, native_file):
+                    return True
+        
+        with stages('decode'):
+            if self.layout == 'frames':
+                quilt = [load_quilt(f) for f in quilt_file]
+            elif preview:
+                quilt = load_quilt_reduced(quilt_file, self.calibration)
+            else:
+                quilt = load_quilt(quilt_file)
+            
+        with stages('table'):
+            self.lookup_table(quilt[0].shape[1::-1] if self.layout == 'frames' else quilt.shape[1::-1])
+            
+        if is_raw(native_file):
+            
+            with stages('encode'):
+                output = MappedOutput(native_file, *self.native_size, order=order)
+            with stages('gather'):
+                self.convert(quilt, output.rgb)
+            with stages('encode'):
+                output.close()
+                
+        else:
+            
+            with stages('gather'):
+                native = self.convert(quilt)
+                
+            with stages('encode'):
+                save_native(native, native_file, order, **params)
+                
+        if cache is not None:
+            with stages('cache'):
+                cache.store(key, native_file)
+                
+        return False
@@ -0,0 +1,161 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Quilt layouts. A quilt (grid or linear) or set of separate frames is 
+# handled as a list of views, each a rectangle (x0, y0, x1, y1) in an 
+# image array. For a quilt all views refer to the same array, so nothing
+# is copied. Views are numbered from the bottom-left tile, as in 
+# make_quilt.py, rectangles are in continuous pixel coordinates (tiles
+# don't need to have a whole number of pixels).
+
+import numpy as np
+
+def quilt_view_rects(tiles, quilt_size):
+    
+    QWIDTH, QHEIGHT = quilt_size
+    rects = []
+    
+    for view in range(tiles[0]*tiles[1]):
+        tx = view % tiles[0]
+        ty = tiles[1] - 1 - view // tiles[0]
+        rects.append((tx*QWIDTH/tiles[0], ty*QHEIGHT/tiles[1], 
+            (tx+1)*QWIDTH/tiles[0], (ty+1)*QHEIGHT/tiles[1]))
+        
+    return rects
+    
+    
+def quilt_views(quilt, tiles):
+    return [(quilt, rect) for rect in quilt_view_rects(tiles, quilt.shape[1::-1])]
+    
+    
+def frame_views(frames):
+    return [(frame, (0, 0, frame.shape[1], frame.shape[0])) for frame in frames]
+    
+    
+def pixel_range(r0, r1, size):
+    # The pixels whose centre lies in [r0, r1)
+    return max(0, int(np.ceil(r0 - 0.5))), min(size, int(np.ceil(r1 - 0.5)))
+    
+    
+def sample_positions(dst_range, drect0, drect1, srect0, srect1):
+    
+    # Continuous source coordinates for the centres of the destination pixels
+    d = np.arange(*dst_range) + 0.5
+    d -= drect0
+    d *= (srect1 - srect0) / (drect1 - drect0)
+    d += srect0
+    
+    return d
+    
+    
+def sample_indices(s, srect0, srect1, size, offset):
+    
+    # Pixel indices for coordinates s, limited to the source view
+    lo = max(0, int(np.floor(srect0)))
+    hi = min(size, int(np.ceil(srect1))) - 1
+    
+    return np.clip(np.floor(s - offset).astype(np.intp), lo, hi), lo, hi
+    
+    
+def resample_view(src, srect, dst, drect, method='nearest'):
+    
+    # Resample the view at srect in src to drect in dst, with 'nearest' or 
+    # 'linear' interpolation
+    
+    cols = pixel_range(drect[0], drect[2], dst.shape[1])
+    rows = pixel_range(drect[1], drect[3], dst.shape[0])
+    if cols[1] <= cols[0] or rows[1] <= rows[0]:
+        return
+    
+    sx = sample_positions(cols, drect[0], drect[2], srect[0], srect[2])
+    sy = sample_positions(rows, drect[1], drect[3], srect[1], srect[3])
+    
+    out = dst[rows[0]:rows[1], cols[0]:cols[1]]
+    
+    if method == 'nearest':
+        
+        x = sample_indices(sx, srect[0], srect[2], src.shape[1], 0)[0]
+        y = sample_indices(sy, srect[1], srect[3], src.shape[0], 0)[0]
+        
+        # Plain copy when the view size doesn't change
+        if np.all(np.diff(y) == 1):
+            y = slice(y[0], y[-1]+1)
+        if np.all(np.diff(x) == 1):
+            out[:] = src[y, x[0]:x[-1]+1]
+        else:
+            np.take(src[y], x, axis=1, out=out)
+            
+    elif method == 'linear':
+        
+        # Interpolate between pixel centres, clamped to the source view.
+        # Horizontally first, over the rows of the source view only.
+        x0, xlo, xhi = sample_indices(sx, srect[0], srect[2], src.shape[1], 0.5)
+        fx = np.clip(sx - 0.5 - x0, 0, 1).astype(np.float32)[np.newaxis,:,np.newaxis]
+        x1 = np.minimum(x0 + 1, xhi)
+        
+        y0, ylo, yhi = sample_indices(sy, srect[1], srect[3], src.shape[0], 0.5)
+        fy = np.clip(sy - 0.5 - y0, 0, 1).astype(np.float32)[:,np.newaxis,np.newaxis]
+        y1 = np.minimum(y0 + 1, yhi)
+        
+        view = src[ylo:yhi+1]
+        h = np.take(view, x0, axis=1).astype(np.float32)
+        d = np.take(view, x1, axis=1).astype(np.float32)
+        d -= h
+        d *= fx
+        h += d
+        
+        a = np.take(h, y0 - ylo, axis=0)
+        d = np.take(h, y1 - ylo, axis=0)
+        d -= a
+        d *= fy
+        a += d
+        a += 0.5
+        out[:] = a
+        
+    else:
+        raise ValueError('Unknown interpolation method "%s"' % method)
+        
+        
+def source_view(view, num_sources, num_targets):
+    
+    # With a different number of views, use the nearest one in the 
+    # view cone
+    
+    if num_sources == num_targets:
+        return view
+    if num_targets == 1:
+        return num_sources // 2
+        
+    return int(round(view * (num_sources - 1) / (num_targets - 1)))
+    
+    
+def transcode(sources, targets, method='nearest'):
+    
+    # sources, targets: lists of (array, rect) per view, as returned by
+    # quilt_views() and frame_views()
+    
+    for view, (dst, drect) in enumerate(targets):
+        src, srect = sources[source_view(view, len(sources), len(targets))]
+        resample_view(src, srect, dst, drect, method)
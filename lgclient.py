@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Convert a quilt to a native image using a running lgserver.py
+#
+# Paul Melis <paul.melis@surfsara.nl>
+# SURFsara Visualization group
+#
+#
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os, sys, getopt
+from PIL import Image
+
+from lgservice import Client
+
+def usage():
+    print('usage: %s [options] <socket> <quilt-image> <native-image>' % sys.argv[0])
+    print()
+    print('options:')
+    print('  -d <name>          Device to convert for (default: the first one loaded by the server)')
+    print('  -t <tilesh>x<tilesv>')
+    print('                     Tiles in the quilt (default: 5x9)')
+    print('  -l <tilesh>        Linear quilt with <tilesh> tiles')
+    print('  -z <level>         PNG compression level of the native image')
+    print('  -s                 Send the quilt pixels and save the native image here, instead of')
+    print('                     passing file names to the server')
+    print()
+    sys.exit(-1)
+    
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'd:t:l:z:s')
+except getopt.GetoptError:
+    usage()
+    
+if len(args) != 3:
+    usage()
+    
+device = None
+layout = 'grid'
+tiles = None
+compress_level = None
+send = False
+
+for o, a in opts:
+    if o == '-d':
+        device = a
+    elif o == '-t':
+        tiles = tuple(map(int, a.split('x')))
+    elif o == '-l':
+        layout = 'linear'
+        tiles = (int(a),)
+    elif o == '-z':
+        compress_level = int(a)
+    elif o == '-s':
+        send = True
+        
+socket_path, quilt_image_file, native_image_file = args
+
+client = Client(socket_path)
+
+try:
+    if send:
+        from interlace import load_quilt
+        native = client.convert(load_quilt(quilt_image_file), device=device, layout=layout, tiles=tiles)
+        params = {} if compress_level is None else dict(compress_level=compress_level)
+        Image.fromarray(native).save(native_image_file, **params)
+    else:
+        # The server resolves paths relative to its own working directory
+        client.convert(os.path.abspath(quilt_image_file), os.path.abspath(native_image_file),
+            device=device, layout=layout, tiles=tiles, compress_level=compress_level)
+except RuntimeError as e:
+    sys.stderr.write('%s\n' % e)
+    sys.exit(1)
+finally:
+    client.close()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Long-running interlacing service. Loads one or more calibrations and
+# converts quilts to native images on request over a Unix socket, keeping
+# lookup tables and recently decoded quilts in memory. See lgservice.py 
+# for the protocol and lgclient.py for a command-line client.
+#
+# Paul Melis <paul.melis@surfsara.nl>
+# SURFsara Visualization group
+#
+#
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os, sys, getopt, signal, asyncio
+
+from calibration import Calibration
+from lgservice import InterlaceService
+
+def usage():
+    print('usage: %s [options] <socket> [<name>=]<visual.json> ...' % sys.argv[0])
+    print()
+    print('The device name of a calibration defaults to the file name without extension.')
+    print()
+    print('options:')
+    print('  -j <workers>       Number of worker threads (default: number of cores)')
+    print('  -q <count>         Number of decoded quilts to keep in memory (default: 8)')
+    print('  -w <name>:<tilesh>x<tilesv>:<w>x<h>')
+    print('                     Compute the lookup table for device <name>, the given tiles')
+    print('                     and quilt size at startup (can be repeated)')
+    print()
+    sys.exit(-1)
+    
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'j:q:w:')
+except getopt.GetoptError:
+    usage()
+    
+if len(args) < 2:
+    usage()
+    
+workers = None
+cache_size = 8
+warm = []
+
+for o, a in opts:
+    if o == '-j':
+        workers = int(a)
+    elif o == '-q':
+        cache_size = int(a)
+    elif o == '-w':
+        name, tiles, size = a.split(':')
+        warm.append((name, tuple(map(int, tiles.split('x'))), tuple(map(int, size.split('x')))))
+        
+socket_path = args[0]
+
+calibrations = []
+for arg in args[1:]:
+    if '=' in arg:
+        name, fname = arg.split('=', 1)
+    else:
+        fname = arg
+        name = os.path.splitext(os.path.basename(fname))[0]
+    calibrations.append((name, Calibration(fname)))
+    
+service = InterlaceService(calibrations, workers, cache_size)
+
+# Stop on SIGTERM as on Ctrl-C, removing the socket
+signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+try:
+    asyncio.run(service.serve(socket_path, warm))
+except KeyboardInterrupt:
+    pass
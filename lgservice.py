@@ -0,0 +1,326 @@
+# Interlacing service: keeps calibrations, their lookup tables and 
+# recently decoded quilts in memory and converts quilts to native images 
+# on request, over a local Unix socket. See lgserver.py and lgclient.py.
+#
+# Each message (in both directions) is a 4 byte big-endian length, a 
+# JSON header of that length, and a binary payload of header['length'] 
+# bytes. A conversion request contains
+#
+#   device          name of the calibration to use (default: the first one)
+#   layout          "grid" (default) or "linear"
+#   tiles           [tilesh, tilesv] for a grid (default [5, 9]), 
+#                   [tilesh] for a linear quilt (default [45])
+#   quilt           path of the quilt image, or
+#   size            [width, height] of a raw RGB quilt sent as payload
+#   output          path to write the native image to (optional)
+#   compress_level  PNG compression level for output (optional)
+#
+# The response contains "ok" and either "error", or "size" of the native 
+# image together with "output", or the raw RGB native image as payload.
+#
+# Paul Melis <paul.melis@surfsara.nl>
+# SURFsara Visualization group
+#
+#
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os, json, socket, asyncio
+from struct import pack, unpack
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+from interlace import get_quilt_lookup_table, load_quilt, interlace
+from parallel import row_bands
+from sequence import save_image
+
+def encode_message(header, payload=b''):
+    
+    header = dict(header, length=len(payload))
+    data = json.dumps(header).encode('utf8')
+    
+    return pack('>I', len(data)) + data
+    
+    
+async def read_message(reader):
+    
+    # Returns (header, payload), or None at end of stream
+    
+    try:
+        size = unpack('>I', await reader.readexactly(4))[0]
+    except asyncio.IncompleteReadError:
+        return None
+        
+    header = json.loads((await reader.readexactly(size)).decode('utf8'))
+    payload = await reader.readexactly(header.get('length', 0))
+    
+    return header, payload
+    
+    
+def tiles_for(header):
+    
+    layout = header.get('layout', 'grid')
+    
+    if layout == 'grid':
+        tiles = tuple(header.get('tiles', (5, 9)))
+    elif layout == 'linear':
+        tiles = (header.get('tiles', (45,))[0], 1)
+    else:
+        raise ValueError('Unknown layout "%s"' % layout)
+        
+    if len(tiles) != 2 or min(tiles) < 1:
+        raise ValueError('Invalid tiles %s' % (tiles,))
+        
+    return tuple(map(int, tiles))
+    
+    
+class InterlaceService:
+    
+    def __init__(self, calibrations, workers=None, cache_size=8):
+        
+        # calibrations: list of (name, Calibration)
+        
+        self.calibrations = OrderedDict(calibrations)
+        self.workers = workers or os.cpu_count()
+        self.cache_size = cache_size
+        self.executor = ThreadPoolExecutor(self.workers)
+        
+        # Futures, so concurrent requests for the same table or quilt
+        # wait for a single computation
+        self.tables = {}
+        self.quilts = OrderedDict()
+        
+    def run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        
+    def calibration(self, device):
+        
+        if device is None:
+            return next(iter(self.calibrations.items()))
+            
+        if device not in self.calibrations:
+            raise ValueError('Unknown device "%s"' % device)
+            
+        return device, self.calibrations[device]
+        
+    async def get_table(self, device, tiles, quilt_size):
+        
+        name, calibration = self.calibration(device)
+        key = (name, tiles, quilt_size)
+        
+        if key not in self.tables:
+            
+            def compute():
+                # Load the (memory-mapped) cached table into memory
+                return np.array(get_quilt_lookup_table(calibration, tiles, quilt_size, self.workers))
+                
+            self.tables[key] = asyncio.ensure_future(self.run(compute))
+            
+        try:
+            return await asyncio.shield(self.tables[key])
+        except Exception:
+            self.tables.pop(key, None)
+            raise
+            
+    async def get_quilt(self, filename):
+        
+        st = os.stat(filename)
+        key = (os.path.realpath(filename), st.st_mtime_ns, st.st_size)
+        
+        if key in self.quilts:
+            self.quilts.move_to_end(key)
+            future = self.quilts[key]
+        else:
+            future = asyncio.ensure_future(self.run(load_quilt, filename))
+            self.quilts[key] = future
+            while len(self.quilts) > self.cache_size:
+                self.quilts.popitem(last=False)
+                
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            self.quilts.pop(key, None)
+            raise
+            
+    async def warm(self, device, tiles, quilt_size):
+        await self.get_table(device, tuple(tiles), tuple(quilt_size))
+        
+    async def convert(self, header, payload):
+        
+        tiles = tiles_for(header)
+        
+        if 'quilt' in header:
+            quilt = await self.get_quilt(header['quilt'])
+        else:
+            width, height = header['size']
+            if len(payload) != width * height * 3:
+                raise ValueError('Expected %d bytes of RGB data, got %d' % (width * height * 3, len(payload)))
+            quilt = np.frombuffer(payload, np.uint8).reshape((height, width, 3))
+            
+        quilt_size = (quilt.shape[1], quilt.shape[0])
+        table = await self.get_table(header.get('device'), tiles, quilt_size)
+        
+        out = np.empty(table.shape, np.uint8)
+        
+        def gather(band):
+            interlace(quilt, table[band[0]:band[1]], out=out[band[0]:band[1]])
+            
+        await asyncio.gather(*[self.run(gather, band) for band in row_bands(table.shape[0], self.workers)])
+        
+        response = dict(ok=True, size=[out.shape[1], out.shape[0]])
+        
+        if 'output' in header:
+            params = {}
+            if 'compress_level' in header:
+                params['compress_level'] = int(header['compress_level'])
+            await self.run(lambda: save_image(Image.fromarray(out), header['output'], **params))
+            response['output'] = header['output']
+            return response, b''
+        
+        return response, out.reshape(-1).data
+        
+    async def handle(self, reader, writer):
+        
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                    
+                try:
+                    response, payload = await self.convert(*message)
+                except Exception as e:
+                    response, payload = dict(ok=False, error='%s: %s' % (type(e).__name__, e)), b''
+                    
+                writer.write(encode_message(response, payload))
+                if len(payload) > 0:
+                    writer.write(payload)
+                await writer.drain()
+                
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            
+    async def serve(self, path, warm=[]):
+        
+        # warm: list of (device, tiles, quilt_size) tables to compute 
+        # before accepting requests
+        
+        for device, tiles, quilt_size in warm:
+            await self.warm(device, tiles, quilt_size)
+            
+        if os.path.exists(path):
+            os.unlink(path)
+            
+        server = await asyncio.start_unix_server(self.handle, path)
+        
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+            self.executor.shutdown()
+            
+            
+class Client:
+    
+    # Blocking client for InterlaceService, e.g.
+    #
+    #   client = Client('/tmp/lg.sock')
+    #   client.convert('quilt.png', output='native.png')
+    #   native = client.convert(quilt_array, device='portrait')
+    
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        
+    def close(self):
+        self.sock.close()
+        
+    def recv(self, size):
+        
+        buf = bytearray(size)
+        view = memoryview(buf)
+        
+        while len(view) > 0:
+            n = self.sock.recv_into(view)
+            if n == 0:
+                raise ConnectionError('Connection closed by server')
+            view = view[n:]
+            
+        return buf
+        
+    def request(self, header, payload=b''):
+        
+        self.sock.sendall(encode_message(header, payload))
+        if len(payload) > 0:
+            self.sock.sendall(payload)
+            
+        size = unpack('>I', self.recv(4))[0]
+        header = json.loads(self.recv(size).decode('utf8'))
+        payload = self.recv(header.get('length', 0))
+        
+        return header, payload
+        
+    def convert(self, quilt, output=None, device=None, layout='grid', tiles=None, compress_level=None):
+        
+        # quilt: path of the quilt image (as seen by the server), or an 
+        # RGB array. Returns the native image as array when no output
+        # path is given
+        
+        header = dict(layout=layout)
+        payload = b''
+        
+        if isinstance(quilt, str):
+            header['quilt'] = quilt
+        else:
+            quilt = np.ascontiguousarray(quilt, np.uint8)
+            header['size'] = [quilt.shape[1], quilt.shape[0]]
+            payload = quilt.reshape(-1).data
+            
+        if output is not None:
+            header['output'] = output
+        if device is not None:
+            header['device'] = device
+        if tiles is not None:
+            header['tiles'] = list(tiles)
+        if compress_level is not None:
+            header['compress_level'] = compress_level
+            
+        response, payload = self.request(header, payload)
+        
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+            
+        if output is not None:
+            return response['output']
+            
+        width, height = response['size']
+        
+        return np.frombuffer(payload, np.uint8).reshape((height, width, 3))
@@ -41,34 +41,35 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import sys, random, colorsys
-from PIL import Image, ImageDraw
+import os, sys, getopt
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+from interlace import load_quilt
+from metrics import Metrics
+from rawimage import is_raw, MappedOutput
 
 def usage():
-    print('usage: %s <quilt-image> <tiles-h> <tiles-v> <tile-pattern> <first> <last>' % sys.argv[0])
+    print('usage: %s [options] <quilt-image> <tiles-h> <tiles-v> <tile-pattern> <first> <last>' % sys.argv[0])
+    print()
+    print('options:')
+    print('  -j <workers>   Number of threads decoding tile images (default: number of cores)')
+    print('  -z <level>     PNG compression level, 0 (fastest) - 9 (smallest), default 6')
+    print('  -S <visual.json>')
+    print('                 Write a sparse quilt file for the display with this calibration,')
+    print('                 instead of a quilt image (see quilt2sparse.py)')
+    print('  -T tile|row     Write a tiled quilt file, with each tile or row of tiles compressed')
+    print('                 separately, so views can be decoded on their own (see tiledquilt.py)')
+    print('  -m <file.jsonl> Append wall/CPU time and peak memory per stage (decode, encode)')
+    print('                 as a JSON line to <file.jsonl> (- for stderr)')
+    print('  -x <file.prof> Write cProfile statistics of the stages to <file.prof>')
+    print()
+    print('<quilt-image> can also be an uncompressed .npy, .ppm or .raw file, the tiles are')
+    print('then placed directly in the (memory-mapped) output file')
     print()
     sys.exit(-1)
 
-if len(sys.argv) != 7:
-    usage()
-    
-quilt_image_file = sys.argv[1]
-tiles_h = int(sys.argv[2])
-tiles_v = int(sys.argv[3])
-tile_pattern = sys.argv[4]
-tile_first = int(sys.argv[5])
-tile_last = int(sys.argv[6])
-
-# Open a tile image to get resolution
-tile_img = Image.open(tile_pattern % tile_first)
-
-tile_w, tile_h = tile_img.size
-
-quilt_w = tile_w * tiles_h
-quilt_h = tile_h * tiles_v
-
-print('Quilt size based on tile dimensions and count: %d x %d' % (quilt_w, quilt_h))
-
 # https://www.geeksforgeeks.org/smallest-power-of-2-greater-than-or-equal-to-n/
 def nextPowerOf2(n): 
     count = 0;
@@ -77,35 +78,161 @@ def nextPowerOf2(n):
     # case where n is 0 
     if (n and not(n & (n - 1))): 
         return n 
-      
+
     while( n != 0): 
         n >>= 1
         count += 1
-      
-    return 1 << count
 
-quilt_w = nextPowerOf2(quilt_w)
-quilt_h = nextPowerOf2(quilt_h)
-print('Quilt size: %d x %d' % (quilt_w, quilt_h))
+    return 1 << count
 
-outimg = Image.new('RGB', (quilt_w, quilt_h))
 
-tile_idx = tile_first
-tile_top = quilt_h - tile_h
+def padded_quilt_size(tile_size, tiles):
+    
+    # The quilt is padded to a power of two in both directions
+    return nextPowerOf2(tile_size[0] * tiles[0]), nextPowerOf2(tile_size[1] * tiles[1])
+    
+    
+def tile_position(view, tile_size, tiles, quilt_height):
+    
+    # Top-left corner of a view's tile. Views go from the bottom left, row
+    # by row, to the top right, so the padding rows are at the top.
+    i, j = divmod(view, tiles[0])[::-1]
+    return i * tile_size[0], quilt_height - (j+1) * tile_size[1]
+    
 
-for j in range(tiles_v):
+def main():
     
-    tile_left = 0
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'j:z:S:T:m:x:')
+    except getopt.GetoptError:
+        usage()
+        
+    if len(args) != 6:
+        usage()
+        
+    workers = os.cpu_count()
+    compress_level = 6
+    sparse_calibration = None
+    chunks = None
+    metrics_file = None
+    profile_file = None
+
+    for o, a in opts:
+        if o == '-j':
+            workers = int(a)
+        elif o == '-z':
+            compress_level = int(a)
+        elif o == '-S':
+            sparse_calibration = a
+        elif o == '-T':
+            if a not in ('tile', 'row'):
+                usage()
+            chunks = a
+        elif o == '-m':
+            metrics_file = a
+        elif o == '-x':
+            profile_file = a
+        
+    quilt_image_file = args[0]
+    tiles_h = int(args[1])
+    tiles_v = int(args[2])
+    tile_pattern = args[3]
+    tile_first = int(args[4])
+    tile_last = int(args[5])
     
-    for i in range(tiles_h):
+    metrics = Metrics(metrics_file, profile_file, script=os.path.basename(sys.argv[0]), args=sys.argv[1:])
+    stages = metrics.stages()
+
+    # Decode the first tile image, to get the resolution
+    with stages('decode'):
+        first_tile = load_quilt(tile_pattern % tile_first)
 
-        tile_img = Image.open(tile_pattern % tile_idx)
+    tile_h, tile_w = first_tile.shape[:2]
+
+    quilt_w = tile_w * tiles_h
+    quilt_h = tile_h * tiles_v
+
+    print('Quilt size based on tile dimensions and count: %d x %d' % (quilt_w, quilt_h))
+
+    quilt_w, quilt_h = padded_quilt_size((tile_w, tile_h), (tiles_h, tiles_v))
+    print('Quilt size: %d x %d' % (quilt_w, quilt_h))
+
+    if is_raw(quilt_image_file) and sparse_calibration is None and chunks is None:
+        output = MappedOutput(quilt_image_file, quilt_w, quilt_h)
+        quilt = output.rgb
+    else:
+        output = None
+        quilt = np.zeros((quilt_h, quilt_w, 3), np.uint8)
+
+    def place_tile(tile_idx):
+        
+        tile_left, tile_top = tile_position(tile_idx - tile_first, (tile_w, tile_h), (tiles_h, tiles_v), quilt_h)
+        
+        if tile_idx == tile_first:
+            tile = first_tile
+        else:
+            tile = load_quilt(tile_pattern % tile_idx)
+            
+        if tile.shape[:2] != (tile_h, tile_w):
+            raise ValueError('%s: tile size %d x %d, expected %d x %d' % 
+                (tile_pattern % tile_idx, tile.shape[1], tile.shape[0], tile_w, tile_h))
+        
+        # Directly into its slot in the quilt
+        quilt[tile_top:tile_top+tile_h, tile_left:tile_left+tile_w] = tile
+        
+        
+    tiles = range(tile_first, tile_first + tiles_h*tiles_v)
+
+    with stages('decode'), ThreadPoolExecutor(workers) as executor:
+        list(executor.map(place_tile, tiles))
         
-        outimg.paste(tile_img, (tile_left, tile_top))
+    del first_tile
 
-        tile_idx += 1
-        tile_left += tile_w
+    if sparse_calibration is not None:
         
-    tile_top -= tile_h
+        from calibration import Calibration
+        from sparse import write_sparse
         
-outimg.save(quilt_image_file)
+        calibration = Calibration(sparse_calibration)
+        with stages('encode'):
+            count = write_sparse(quilt_image_file, calibration, (tiles_h, tiles_v), quilt, compress_level)
+        
+        print('%d of %d quilt values used (%.1f%%)' % (count, quilt.size, 100.0*count/quilt.size))
+        
+        metrics.write(stages, pixels=quilt_w*quilt_h, sparse=True)
+        metrics.close()
+        return
+
+    if chunks is not None:
+        
+        from tiledquilt import write_tiled
+        
+        # The actual tile positions, the padding isn't stored
+        view_rects = []
+        for tile_idx in tiles:
+            x, y = tile_position(tile_idx - tile_first, (tile_w, tile_h), (tiles_h, tiles_v), quilt_h)
+            view_rects.append((x, y, x + tile_w, y + tile_h))
+            
+        with stages('encode'):
+            size = write_tiled(quilt_image_file, quilt, (tiles_h, tiles_v), view_rects, 
+                chunks == 'row', compress_level=compress_level, workers=workers)
+            
+        print('%d bytes in %d chunks' % (size, tiles_v if chunks == 'row' else len(view_rects)))
+        
+        metrics.write(stages, pixels=quilt_w*quilt_h, chunks=chunks)
+        metrics.close()
+        return
+
+    with stages('encode'):
+        if output is not None:
+            output.close()
+        else:
+            outimg = Image.fromarray(quilt)
+            outimg.save(quilt_image_file, compress_level=compress_level)
+        
+    metrics.write(stages, pixels=quilt_w*quilt_h)
+    metrics.close()
+
+
+if __name__ == '__main__':
+    main()
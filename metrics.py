@@ -0,0 +1,225 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Instrumentation of the conversion scripts: wall time, CPU time and peak 
+# memory per stage (decode, table, gather, encode, ...), written as one 
+# JSON object per line per conversion, plus an optional cProfile dump.
+
+import os, sys, json, time, resource
+
+def _current_peak():
+    
+    # On Linux getrusage() reports the maximum of this process and its
+    # parent at the time of the fork, VmHWM is for this process only
+    try:
+        for line in open('/proc/self/status', 'rt'):
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+        
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss*1024
+    
+    
+# Highest peak before the last reset_peak_memory()
+_peak = 0
+
+# Stages being measured, which need to keep their peak when another
+# (nested, or in another thread) stage resets it
+_open = set()
+
+# Number of Metrics writing records. Only then do stages reset the peak,
+# which is for the whole process (worker processes are forked, and 
+# inherit the count).
+_sinks = 0
+
+def peak_memory():
+    # Peak resident memory of this process in bytes
+    return max(_peak, _current_peak())
+    
+    
+def reset_peak_memory():
+    
+    # Start measuring the peak from the current resident memory (Linux 
+    # only). Returns False when not supported.
+    
+    global _peak
+    
+    current = _current_peak()
+    _peak = max(_peak, current)
+    for stage in list(_open):
+        stage.running_peak = max(stage.running_peak, current)
+    
+    try:
+        with open('/proc/self/clear_refs', 'wt') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+        
+        
+def cpu_time():
+    # Of this process (all threads) and its finished child processes
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+    
+    
+class Stages:
+    
+    # Use as
+    #
+    #   stages = Stages()
+    #   with stages('decode'):
+    #       ...
+    #
+    # Times of stages with the same name are added up. The stages of one
+    # Stages should not be nested, but those of different ones can (e.g. 
+    # a caller timing a call that times its own stages). profiler: an 
+    # optional cProfile.Profile, enabled during the stages.
+    #
+    # Peak memory is only measured while a Metrics writes records. There
+    # is one peak counter per process, so the peak of a stage includes 
+    # the memory used by stages running at the same time in other 
+    # threads (e.g. decoding the next quilt in sequence.py).
+    
+    def __init__(self, profiler=None):
+        
+        self.times = {}
+        self.cpu = {}
+        self.peak = {}
+        self.profiler = profiler
+        
+    def __call__(self, name):
+        self.name = name
+        return self
+        
+    def __enter__(self):
+        
+        if _sinks > 0:
+            reset_peak_memory()
+        self.running_peak = 0
+        _open.add(self)
+        self.t0 = time.perf_counter()
+        self.c0 = cpu_time()
+        
+        if self.profiler is not None:
+            self.profiler.enable()
+        
+    def __exit__(self, *args):
+        
+        if self.profiler is not None:
+            self.profiler.disable()
+            
+        _open.discard(self)
+        
+        name = self.name
+        self.times[name] = self.times.get(name, 0) + time.perf_counter() - self.t0
+        self.cpu[name] = self.cpu.get(name, 0) + cpu_time() - self.c0
+        self.peak[name] = max(self.peak.get(name, 0), self.running_peak, _current_peak())
+        
+    def result(self):
+        return {name: dict(wall=round(self.times[name], 6), cpu=round(self.cpu[name], 6),
+                    peak_mb=round(self.peak[name] / 2**20, 1))
+                for name in self.times}
+                
+                
+class Metrics:
+    
+    # Writes a JSON line per conversion (or frame) to filename ('-' for
+    # stderr), appending to an existing file. With profile the stages 
+    # in this process are profiled, and the statistics written to that
+    # file (for pstats or e.g. snakeviz) by close().
+    
+    def __init__(self, filename=None, profile=None, **info):
+        
+        self.info = info
+        self.profile = profile
+        self.profiler = None
+        self.file = None
+        
+        if profile is not None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            
+        if filename == '-':
+            self.file = sys.stderr
+        elif filename is not None:
+            self.file = open(filename, 'at')
+            
+        if self.file is not None:
+            global _sinks
+            _sinks += 1
+            
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+        
+    def stages(self):
+        return Stages(self.profiler)
+        
+    def write(self, stages, pixels=None, **fields):
+        
+        # stages: a Stages, or the result() of one (e.g. from a worker
+        # process). pixels: the number of output pixels
+        
+        if self.file is None:
+            return
+        
+        if isinstance(stages, Stages):
+            stages = stages.result()
+            
+        wall = sum(s['wall'] for s in stages.values())
+        
+        record = dict(time=round(time.time(), 3))
+        record.update(self.info)
+        record.update(fields)
+        record.update(
+            stages=stages,
+            wall=round(wall, 6),
+            cpu=round(sum(s['cpu'] for s in stages.values()), 6),
+            peak_mb=max([s['peak_mb'] for s in stages.values()] + [0]))
+            
+        if pixels is not None:
+            record['pixels'] = pixels
+            record['mpixels_per_s'] = round(pixels / wall / 1e6, 3) if wall > 0 else None
+            
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        
+    def close(self):
+        
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile)
+            self.profiler = None
+            
+        if self.file is not None:
+            global _sinks
+            _sinks -= 1
+            if self.file is not sys.stderr:
+                self.file.close()
+        self.file = None
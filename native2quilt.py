@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# Recover a quilt (or separate view images) from a native image, the 
+# inverse of quilt2native.py
+#
+# Paul Melis <paul.melis@surfsara.nl>
+# SURFsara Visualization group
+#
+#
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os, sys, getopt, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+from calibration import Calibration
+from interlace import load_quilt
+from sparse import sparse_index
+from deinterlace import scatter_counts, deinterlace, coverage_mask, fill_gaps
+from layout import quilt_views, frame_views, transcode
+from sequence import save_image
+
+def usage():
+    print('usage: %s [options] <visual.json> <native-image> [tilesh tilesv] <quilt-image>' % sys.argv[0])
+    print()
+    print('options:')
+    print('  -q <w>x<h>         Quilt size (default: 4096x4096)')
+    print('  -V                 Write separate view images instead of a quilt, <quilt-image> is')
+    print('                     then a printf-style pattern for the view number, e.g. view%02d.png')
+    print('  -m <mask-image>    Write the coverage mask, white for each quilt subpixel that is')
+    print('                     shown on the display (a pattern with -V)')
+    print('  -g <method>        Fill the subpixels that are not shown from the ones that are,')
+    print('                     within the same view: nearest or linear')
+    print('  -s <first>:<last>  Convert a sequence of frames, <native-image> and <quilt-image>')
+    print('                     are then printf-style patterns, e.g. native%04d.png')
+    print('  -c                 Check a round trip instead: compare the recovered values with')
+    print('                     the ones in <quilt-image> (exit status 1 on differences)')
+    print('  -z <level>         PNG compression level, 0 (fastest) - 9 (smallest), default 6')
+    print('  -j <workers>       Number of threads used for a sequence (default: number of cores)')
+    print()
+    sys.exit(-1)
+    
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'q:Vm:g:s:cz:j:')
+except getopt.GetoptError:
+    usage()
+    
+if len(args) not in [3,5]:
+    usage()
+    
+quilt_size = (4096, 4096)
+views = False
+mask_file = None
+fill = None
+sequence = None
+check = False
+compress_level = 6
+workers = os.cpu_count()
+
+for o, a in opts:
+    if o == '-q':
+        quilt_size = tuple(map(int, a.split('x')))
+    elif o == '-V':
+        views = True
+    elif o == '-m':
+        mask_file = a
+    elif o == '-g':
+        fill = a
+    elif o == '-s':
+        sequence = tuple(map(int, a.split(':')))
+    elif o == '-c':
+        check = True
+    elif o == '-z':
+        compress_level = int(a)
+    elif o == '-j':
+        workers = int(a)
+        
+calibration = Calibration(args[0])
+
+native_image_file = args[1]
+if len(args) == 5:
+    TILES = tuple(map(int, args[2:4]))
+    quilt_image_file = args[4]
+else:
+    TILES = (5, 9)
+    quilt_image_file = args[2]
+    
+if sequence is not None and views:
+    print('Separate view images can not be written for a sequence')
+    sys.exit(-1)
+    
+QWIDTH, QHEIGHT = quilt_size
+
+used, inverse = sparse_index(calibration, TILES, quilt_size)
+counts = scatter_counts(inverse, len(used))
+mask = coverage_mask(used, quilt_size)
+
+def save_views(quilt, pattern):
+    
+    # View images of the size of a (rounded) tile
+    vw, vh = int(round(QWIDTH/TILES[0])), int(round(QHEIGHT/TILES[1]))
+    frames = [np.empty((vh, vw, quilt.shape[2]), quilt.dtype) for i in range(TILES[0]*TILES[1])]
+    transcode(quilt_views(quilt, TILES), frame_views(frames))
+    
+    for i, frame in enumerate(frames):
+        save_image(Image.fromarray(frame), pattern % i, compress_level=compress_level)
+        
+def save(quilt, filename):
+    if views:
+        save_views(quilt, filename)
+    else:
+        save_image(Image.fromarray(quilt), filename, compress_level=compress_level)
+        
+def convert(native_file, quilt_file):
+    
+    native = load_quilt(native_file)
+    
+    if native.shape[1::-1] != (calibration.screenW, calibration.screenH):
+        raise ValueError('%s: native image size %d x %d, expected %d x %d' % 
+            ((native_file,) + native.shape[1::-1] + (calibration.screenW, calibration.screenH)))
+        
+    quilt = deinterlace(native, used, inverse, counts, quilt_size)
+    
+    if check:
+        # Only the values that are shown can be recovered
+        original = load_quilt(quilt_file)
+        differences = np.count_nonzero((original != quilt) & mask)
+        return differences
+    
+    if fill is not None:
+        fill_gaps(quilt, mask, TILES, fill)
+        
+    save(quilt, quilt_file)
+    
+    return 0
+    
+
+if mask_file is not None:
+    save(mask.astype(np.uint8) * 255, mask_file)
+
+t0 = time.time()
+
+if sequence is None:
+    frames = [(native_image_file, quilt_image_file)]
+else:
+    first, last = sequence
+    frames = [(native_image_file % f, quilt_image_file % f) for f in range(first, last+1)]
+    
+with ThreadPoolExecutor(workers) as pool:
+    results = list(pool.map(lambda f: convert(*f), frames))
+    
+t1 = time.time()
+
+if check:
+    
+    for (native_file, quilt_file), differences in zip(frames, results):
+        if differences > 0:
+            print('%s: %d of %d shown quilt values differ from %s' % 
+                (native_file, differences, len(used), quilt_file))
+            
+    print('%d frames checked in %.2f s, %d with differences' % 
+        (len(frames), t1-t0, sum(1 for d in results if d > 0)))
+    
+    if any(d > 0 for d in results):
+        sys.exit(1)
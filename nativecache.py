@@ -0,0 +1,249 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Content-addressed cache of converted native images, so reconverting
+# the same quilt for the same device (e.g. when rebuilding a playlist) 
+# costs a hash of the quilt file instead of a conversion. Entries are
+# keyed by the quilt file contents plus everything else that determines
+# the native image file: the calibration values, the quilt layout, the
+# sampling and the output format and options.
+#
+# A hit hard-links the stored file to the output name (or copies it,
+# across file systems). Entries are read-only, so a tool writing into 
+# a linked output file fails instead of silently changing the cache; 
+# the conversion scripts always replace their output file instead.
+#
+# The least recently used entries are removed when the cache grows 
+# beyond its size limit. Several processes can use the cache at the 
+# same time: entries are written under a temporary name and renamed,
+# and eviction is serialized with a lock file.
+#
+# store_array() and load_array() keep arrays in the same way, e.g. the
+# reduced quilts of interlace.load_quilt_reduced().
+
+import os, sys, errno, fcntl, hashlib, shutil, tempfile, time
+import numpy as np
+
+from calibration import cache_dir
+from interlace import calibration_key
+
+# Increase when the native images change for the same key
+CACHE_VERSION = 1
+
+# Temporary files older than this (in seconds) are from interrupted runs
+STALE_AGE = 3600
+
+def file_digest(filename):
+    
+    h = hashlib.sha1()
+    
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            h.update(data)
+            
+    return h.hexdigest()
+    
+    
+def conversion_params(calibration, layout, tiles, native_file, **options):
+    
+    # Everything besides the quilt that determines the native image file.
+    # options: e.g. sampling, preview, order and compress_level.
+    
+    ext = os.path.splitext(native_file)[1].lower()
+    
+    return (calibration_key(calibration), layout, tuple(tiles), ext, sorted(options.items()))
+    
+    
+class NativeCache:
+    
+    def __init__(self, max_bytes, directory=None):
+        
+        # directory: by default "native" in the cache directory (see 
+        # calibration.cache_dir()), None when caching is disabled
+        
+        if directory is None and cache_dir():
+            directory = os.path.join(cache_dir(), 'native')
+            
+        self.directory = directory
+        self.max_bytes = max_bytes
+        
+        # File digests, for using the same quilt for several keys
+        self.digests = {}
+        
+    def key(self, quilt_files, params):
+        
+        # quilt_files: a file name, or a list of them (e.g. view images).
+        # params: see conversion_params().
+        
+        if isinstance(quilt_files, str):
+            quilt_files = [quilt_files]
+            
+        digests = []
+        
+        for f in quilt_files:
+            st = os.stat(f)
+            ident = (os.path.realpath(f), st.st_mtime_ns, st.st_size)
+            if ident not in self.digests:
+                self.digests[ident] = file_digest(f)
+            digests.append(self.digests[ident])
+        
+        return hashlib.sha1(repr((CACHE_VERSION, digests, params)).encode('utf8')).hexdigest()
+        
+    def entry(self, key, native_file):
+        return os.path.join(self.directory, key + os.path.splitext(native_file)[1].lower())
+        
+    def fetch(self, key, native_file):
+        
+        # Put the cached native image at native_file. Returns False when
+        # not cached.
+        
+        if self.directory is None:
+            return False
+            
+        entry = self.entry(key, native_file)
+        tmpname = '%s.%d.part' % (native_file, os.getpid())
+        
+        try:
+            # Mark as most recently used
+            os.utime(entry)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            pass
+            
+        try:
+            try:
+                os.link(entry, tmpname)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    raise
+                shutil.copyfile(entry, tmpname)
+        except FileNotFoundError:
+            # Evicted in the meantime
+            return False
+            
+        os.replace(tmpname, native_file)
+        
+        return True
+        
+    def store(self, key, native_file):
+        
+        # Add the converted native_file. Failures are only warned about, 
+        # the cache is an optimization.
+        
+        if self.directory is None:
+            return
+            
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            
+            fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            os.close(fd)
+            shutil.copyfile(native_file, tmpname)
+            os.chmod(tmpname, 0o444)
+            os.replace(tmpname, self.entry(key, native_file))
+            
+            self.evict()
+            
+        except OSError as e:
+            sys.stderr.write('Warning: could not store %s in %s: %s\n' % (native_file, self.directory, e))
+            
+    def load_array(self, key):
+        
+        # The array stored with store_array(), memory-mapped. Returns None
+        # when not cached.
+        
+        if self.directory is None:
+            return None
+            
+        entry = self.entry(key, 'array.npy')
+        
+        try:
+            os.utime(entry)
+            return np.load(entry, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+            
+    def store_array(self, key, arr):
+        
+        if self.directory is None:
+            return
+            
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            
+            fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, arr)
+            os.chmod(tmpname, 0o444)
+            os.replace(tmpname, self.entry(key, 'array.npy'))
+            
+            self.evict()
+            
+        except OSError as e:
+            sys.stderr.write('Warning: could not store array in %s: %s\n' % (self.directory, e))
+            
+    def evict(self):
+        
+        # Remove the least recently used entries until the cache fits
+        # in max_bytes
+        
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock:
+            
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            
+            now = time.time()
+            entries = []
+            
+            for d in os.scandir(self.directory):
+                try:
+                    st = d.stat()
+                except FileNotFoundError:
+                    continue
+                if d.name == 'lock':
+                    continue
+                if d.name.endswith('.tmp'):
+                    # Being written by another process, unless stale
+                    if now - st.st_mtime > STALE_AGE:
+                        self.remove(d.path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, d.path))
+                
+            total = sum(size for _, size, _ in entries)
+            
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self.remove(path)
+                total -= size
+                
+    def remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
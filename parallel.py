@@ -0,0 +1,112 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Multi-core versions of the table computation and gather. The native 
+# image is split into bands of rows, which are processed by a pool of
+# threads (NumPy releases the GIL for these operations) or processes. 
+# Either way all workers write directly into the same output array and 
+# the result is identical to the serial version.
+
+import mmap
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from interlace import quilt_lookup_table, interlace
+
+def row_bands(height, count):
+    
+    # Split the rows in (at most) count bands of (first, last+1)
+    edges = np.linspace(0, height, min(count, height)+1).astype(int)
+    
+    return list(zip(edges[:-1], edges[1:]))
+    
+
+def quilt_lookup_table_threaded(calibration, tiles, quilt_size, workers):
+    
+    table = np.empty((calibration.screenH, calibration.screenW, 3), np.uint32)
+    
+    def compute(band):
+        quilt_lookup_table(calibration, tiles, quilt_size, band, table[band[0]:band[1]])
+    
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(compute, row_bands(calibration.screenH, workers)))
+        
+    return table
+    
+    
+def interlace_threaded(quilt, table, out, executor, workers):
+    
+    # executor: a ThreadPoolExecutor, which can be reused over calls
+    
+    def gather(band):
+        interlace(quilt, table[band[0]:band[1]], out=out[band[0]:band[1]])
+        
+    list(executor.map(gather, row_bands(table.shape[0], workers)))
+    
+    return out
+    
+    
+def _interlace_band(band):
+    
+    quilt, table, out = _shared
+    interlace(quilt, table[band[0]:band[1]], out=out[band[0]:band[1]])
+    
+    
+def interlace_processes(quilt, table, workers):
+    
+    # The quilt and table are inherited read-only by the forked workers, 
+    # the output is written to an anonymous shared memory mapping
+    
+    global _shared
+    
+    buf = mmap.mmap(-1, table.size)
+    out = np.frombuffer(buf, np.uint8).reshape(table.shape)
+    
+    _shared = (quilt, table, out)
+    
+    try:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(workers) as pool:
+            # Some more bands than workers, for load balancing
+            pool.map(_interlace_band, row_bands(table.shape[0], workers*4))
+    finally:
+        _shared = None
+        
+    return out
+    
+    
+def interlace_parallel(quilt, table, workers, processes=False):
+    
+    if workers <= 1:
+        return interlace(quilt, table)
+        
+    if processes:
+        return interlace_processes(quilt, table, workers)
+    
+    out = np.empty(table.shape, np.uint8)
+    
+    with ThreadPoolExecutor(workers) as executor:
+        return interlace_threaded(quilt, table, out, executor, workers)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# Take a quilt image and store only the quilt values that are sampled
+# when converting it to a native image for a specific LG, in a sparse
+# quilt file. See sparse.py. Use sparse2native.py to get the native
+# image from it.
+#
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import sys, getopt
+
+from calibration import Calibration
+from interlace import load_quilt
+from sparse import write_sparse
+
+def usage():
+    print('usage: %s [options] <visual.json> <quilt-image> [tilesh tilesv] <sparse-file>' % sys.argv[0])
+    print()
+    print('options:')
+    print('  -z <level>   zlib compression level, 0 (none) - 9, default 6')
+    print()
+    sys.exit(-1)
+    
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'z:')
+except getopt.GetoptError:
+    usage()
+    
+if len(args) not in [3,5]:
+    usage()
+    
+compress_level = 6
+
+for o, a in opts:
+    if o == '-z':
+        compress_level = int(a)
+        
+
+calibration = Calibration(args[0])
+
+quilt_image_file = args[1]
+if len(args) == 5:
+    TILES = tuple(map(int, args[2:4]))
+    sparse_file = args[4]
+else:
+    TILES = (5, 9)
+    sparse_file = args[2]
+    
+quilt = load_quilt(quilt_image_file)
+
+count = write_sparse(sparse_file, calibration, TILES, quilt, compress_level)
+
+print('%d of %d quilt values used (%.1f%%)' % (count, quilt.size, 100.0*count/quilt.size))
@@ -0,0 +1,336 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Command line handling of quilt2native.py and linquilt2native.py, which
+# only differ in the quilt layout. All conversion modes get their lookup
+# tables from an Interlacer (see interlacer.py).
+
+import os, sys, getopt
+
+from calibration import Calibration
+from interlace import load_quilt, load_quilt_reduced, reduction_factor, image_size
+from filtered import parse_sampling
+from interlacer import Interlacer
+from metrics import Metrics
+from rawimage import check_order
+from nativecache import NativeCache, conversion_params
+
+# Per layout the optional tile arguments, and their number
+TILE_ARGS = {
+    'grid': ('[tilesh tilesv]', 2),
+    'linear': ('[tilesh]', 1),
+}
+
+def usage(layout):
+    print('usage: %s [options] <visual.json> <quilt-image> %s <native-image>' % (sys.argv[0], TILE_ARGS[layout][0]))
+    print()
+    print('options:')
+    print('  -s <first>:<last>  Convert a sequence of frames, <quilt-image> and <native-image>')
+    print('                     are then printf-style patterns, e.g. quilt%04d.png')
+    print('  -j <workers>       Number of workers (default: number of cores), processes when')
+    print('                     converting a sequence, threads otherwise')
+    print('  -p                 Use worker processes instead of threads for a single image')
+    print('  -c                 Continue a sequence, skipping frames whose native image already exists')
+    print('  -r <w>x<h>         <quilt-image> and <native-image> are streams of raw RGB frames')
+    print('                     (files, named pipes or - for stdin/stdout), with quilt size <w> x <h>')
+    print('  -b <MB>            Convert in bands of native rows, using about <MB> megabytes of memory')
+    print('                     (PNG, PPM or tiled quilt files only)')
+    print('  -P                 Preview: load the quilt at the reduced resolution the display')
+    print('                     needs, which is a lot faster for oversized quilts (JPEG images')
+    print('                     are decoded at reduced scale, others are reduced once and cached)')
+    print('  -f <sampling>      nearest (default), bilinear or <N>x<M> supersampling: filtered')
+    print('                     sampling of the quilt, against aliasing (not with -b)')
+    print('  -z <level>         PNG compression level, 0 (fastest) - 9 (smallest), default 6')
+    print('  -O <order>         Channel order for .npy and .raw output: rgb (default), bgr,')
+    print('                     rgba or bgra')
+    print('  -C <MB>            Cache native images, keyed by the quilt file contents, calibration')
+    print('                     and options, using at most <MB> megabytes (see nativecache.py).')
+    print('                     A cached native image is linked, without converting')
+    print('  -m <file.jsonl>    Append wall/CPU time and peak memory per stage (decode, table,')
+    print('                     gather, encode) as JSON lines to <file.jsonl> (- for stderr),')
+    print('                     one line per frame for sequences and streams')
+    print('  -x <file.prof>     Write cProfile statistics of the stages to <file.prof>')
+    print()
+    print('<visual.json> can be a comma-separated list of calibrations, to convert a single')
+    print('quilt for several devices. <native-image> then needs to contain %s, which is')
+    print('replaced by the calibration file name without extension, e.g. native-%s.png')
+    print()
+    print('Quilts and native images can also be uncompressed .npy or .ppm files (memory-mapped),')
+    print('native images also .raw files (pixels only), which avoids encoding and decoding')
+    print('intermediate images')
+    print()
+    sys.exit(-1)
+    
+    
+def main(layout):
+    
+    # layout: 'grid' or 'linear'
+    
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 's:j:pcr:b:Pf:z:O:C:m:x:')
+    except getopt.GetoptError:
+        usage(layout)
+        
+    if len(args) not in [3, 3 + TILE_ARGS[layout][1]]:
+        usage(layout)
+
+    sequence = None
+    workers = None
+    processes = False
+    skip_existing = False
+    raw_size = None
+    budget = None
+    preview = False
+    sampling = 'nearest'
+    compress_level = 6
+    order = 'rgb'
+    cache_mb = None
+    metrics_file = None
+    profile_file = None
+
+    for o, a in opts:
+        if o == '-s':
+            sequence = tuple(map(int, a.split(':')))
+        elif o == '-j':
+            workers = int(a)
+        elif o == '-p':
+            processes = True
+        elif o == '-c':
+            skip_existing = True
+        elif o == '-r':
+            raw_size = tuple(map(int, a.split('x')))
+        elif o == '-b':
+            budget = int(a) * 1024 * 1024
+        elif o == '-P':
+            preview = True
+        elif o == '-f':
+            sampling = a
+        elif o == '-z':
+            compress_level = int(a)
+        elif o == '-O':
+            order = a
+        elif o == '-C':
+            cache_mb = int(a)
+        elif o == '-m':
+            metrics_file = a
+        elif o == '-x':
+            profile_file = a
+
+
+    if preview and (sequence is not None or raw_size is not None or budget is not None):
+        print('Preview is only available when converting single images')
+        sys.exit(-1)
+        
+    try:
+        parse_sampling(sampling)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+        
+    try:
+        check_order(args[-1], order)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+        
+    if cache_mb is not None and raw_size is not None:
+        print('The cache can only be used with image files')
+        sys.exit(-1)
+        
+    if budget is not None and sampling != 'nearest':
+        print('Banded conversion only supports nearest-neighbour sampling')
+        sys.exit(-1)
+        
+    calibration_files = args[0].split(',')
+    calibrations = [Calibration(f) for f in calibration_files]
+    calibration = calibrations[0]
+
+    quilt_image_file = args[1]
+    native_image_file = args[-1]
+    
+    # Default 5x9 grid or 45 views, see Interlacer
+    tiles = None
+    if len(args) > 3:
+        tiles = tuple(map(int, args[2:-1]))
+        if layout == 'linear':
+            tiles = tiles[0]
+    
+    if sequence is None and raw_size is None and workers is None:
+        workers = os.cpu_count()
+        
+    # One per device, for the lookup tables (and the conversion of single
+    # images)
+    interlacers = [Interlacer(c, layout, tiles, workers or os.cpu_count(), processes, sampling) 
+        for c in calibrations]
+    interlacer = interlacers[0]
+    
+    cache = None
+    if cache_mb is not None:
+        cache = NativeCache(cache_mb * 1024 * 1024)
+        
+    def params(calibration, native_file, preview=False):
+        # Conversion parameters for the cache key, as in Interlacer.convert_file()
+        return conversion_params(calibration, layout, interlacer.tiles, native_file, sampling=sampling, 
+            preview=preview, order=order, compress_level=compress_level)
+        
+    metrics = Metrics(metrics_file, profile_file, script=os.path.basename(sys.argv[0]), args=sys.argv[1:])
+    stages = metrics.stages()
+
+    if len(calibrations) > 1:
+        
+        from sequence import convert_devices
+        
+        if sequence is not None or raw_size is not None or budget is not None:
+            print('Multiple calibrations can only be used when converting a single image')
+            sys.exit(-1)
+        
+        if '%s' not in native_image_file:
+            usage(layout)
+            
+        names = [os.path.splitext(os.path.basename(f))[0] for f in calibration_files]
+        if len(set(names)) != len(names):
+            print('Calibration file names need to be unique')
+            sys.exit(-1)
+            
+        native_files = [native_image_file % name for name in names]
+        todo = list(range(len(calibrations)))
+        
+        if cache is not None:
+            with stages('cache'):
+                keys = [cache.key(quilt_image_file, params(c, f, preview)) 
+                    for c, f in zip(calibrations, native_files)]
+                todo = [i for i in todo if not cache.fetch(keys[i], native_files[i])]
+                
+        if len(todo) > 0:
+            
+            # Decode the quilt once for all devices, or with -P once per
+            # reduction factor, so each device gets the same quilt as when
+            # converting for it alone (and its cache key stays valid)
+            groups = {}
+            if preview:
+                quilt_size = image_size(quilt_image_file)
+                for i in todo:
+                    groups.setdefault(reduction_factor(calibrations[i], quilt_size), []).append(i)
+            else:
+                groups[1] = todo
+                
+            for group in groups.values():
+                
+                with stages('decode'):
+                    if preview:
+                        quilt = load_quilt_reduced(quilt_image_file, calibrations[group[0]])
+                    else:
+                        quilt = load_quilt(quilt_image_file)
+                
+                with stages('table'):
+                    tables = [interlacers[i].lookup_table(quilt.shape[1::-1]) for i in group]
+                
+                convert_devices(quilt, tables, [native_files[i] for i in group], workers, processes, stages, 
+                    order, compress_level=compress_level)
+                del quilt, tables
+                
+            if cache is not None:
+                with stages('cache'):
+                    for i in todo:
+                        cache.store(keys[i], native_files[i])
+        
+        fields = dict(cached=len(calibrations) - len(todo)) if cache is not None else {}
+        metrics.write(stages, pixels=sum(c.screenW*c.screenH for c in calibrations), devices=len(calibrations),
+            **fields)
+        metrics.close()
+        
+        return
+        
+    if raw_size is not None:
+        
+        import numpy as np
+        from sequence import convert_stream
+        
+        QWIDTH, QHEIGHT = raw_size
+        workers = workers or os.cpu_count()
+        
+        with stages('table'):
+            table = interlacer.lookup_table(raw_size)
+        metrics.write(stages, setup=True)
+        
+        quilt = np.empty((QHEIGHT, QWIDTH, 3), np.uint8)
+        
+        convert_stream(quilt_image_file, native_image_file, quilt, table, workers, metrics)
+        metrics.close()
+        
+        return
+        
+    elif budget is not None:
+        
+        from bands import convert_bands
+        
+        cached = False
+        if cache is not None:
+            with stages('cache'):
+                key = cache.key(quilt_image_file, params(calibration, native_image_file))
+                cached = cache.fetch(key, native_image_file)
+                
+        if not cached:
+            convert_bands(calibration, interlacer.tiles, quilt_image_file, native_image_file, budget, stages, 
+                compress_level, order)
+            if cache is not None:
+                with stages('cache'):
+                    cache.store(key, native_image_file)
+        
+        fields = dict(cached=cached) if cache is not None else {}
+        metrics.write(stages, pixels=calibration.screenW*calibration.screenH, budget_mb=budget // 2**20, 
+            **fields)
+        metrics.close()
+        
+        return
+        
+    elif sequence is not None:
+        
+        from sequence import convert_sequence
+        
+        first, last = sequence
+        
+        # Assume all quilts in the sequence have the same size
+        QWIDTH, QHEIGHT = image_size(quilt_image_file % first)
+        
+        with stages('table'):
+            table = interlacer.lookup_table((QWIDTH, QHEIGHT))
+        metrics.write(stages, setup=True)
+        
+        convert_sequence(table, (QWIDTH, QHEIGHT), quilt_image_file, native_image_file, 
+            first, last, workers, skip_existing, metrics=metrics, order=order, cache=cache,
+            cache_params=params(calibration, native_image_file), compress_level=compress_level)
+        metrics.close()
+        
+        return
+        
+
+    with interlacer:
+        cached = interlacer.convert_file(quilt_image_file, native_image_file, preview, stages, order, 
+            cache, compress_level=compress_level)
+        
+    fields = dict(cached=cached) if cache is not None else {}
+    metrics.write(stages, pixels=calibration.screenW*calibration.screenH, **fields)
+    metrics.close()
@@ -0,0 +1,168 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Uncompressed image files, for intermediates between the tools, where
+# PNG encoding and decoding would take longer than the conversion itself:
+#
+# - .npy: NumPy array file, (height, width, channels) uint8
+# - .ppm: binary 8-bit PPM (P6), always RGB
+# - .raw: no header at all, the pixels as they'd go into a framebuffer
+#
+# NPY and PPM files are memory-mapped when read, so a quilt is only paged
+# in as far as it's sampled. Output files are created at their final size
+# and memory-mapped, so a native image can be gathered straight into the
+# file. NPY and raw output can use BGR(A) channel order, the alpha 
+# channel is opaque.
+
+import os
+import numpy as np
+
+RAW_EXTENSIONS = ('.npy', '.ppm', '.raw')
+ORDERS = ('rgb', 'bgr', 'rgba', 'bgra')
+
+def is_raw(filename):
+    return os.path.splitext(filename)[1].lower() in RAW_EXTENSIONS
+    
+    
+def ppm_header(f):
+    
+    # Returns (width, height, data offset) of a binary 8-bit PPM file
+    
+    tokens = []
+    while len(tokens) < 4:
+        line = f.readline()
+        if not line:
+            raise ValueError('Truncated PPM header')
+        tokens.extend(line.split(b'#')[0].split())
+        
+    if tokens[0] != b'P6' or int(tokens[3]) != 255:
+        raise NotImplementedError('Only binary 8-bit PPM files (P6) are supported')
+        
+    return int(tokens[1]), int(tokens[2]), f.tell()
+    
+    
+def load_raw(filename):
+    
+    # Returns the image as memory-mapped (height, width, 3) RGB array
+    
+    ext = os.path.splitext(filename)[1].lower()
+    
+    if ext == '.npy':
+        
+        pixels = np.load(filename, mmap_mode='r')
+        
+        if pixels.ndim != 3 or pixels.shape[2] not in (3, 4) or pixels.dtype != np.uint8:
+            raise ValueError('%s: expected an RGB(A) uint8 array, got shape %s %s' % 
+                (filename, pixels.shape, pixels.dtype))
+                
+        if pixels.shape[2] == 4:
+            # Can't be used in place
+            pixels = np.ascontiguousarray(pixels[:,:,:3])
+            
+        return pixels
+        
+    if ext == '.ppm':
+        
+        with open(filename, 'rb') as f:
+            width, height, offset = ppm_header(f)
+            
+        return np.memmap(filename, np.uint8, 'r', offset, (height, width, 3))
+        
+    raise ValueError('%s: raw files have no header with the image size, use a raw stream (-r) instead' % filename)
+    
+    
+def raw_size(filename):
+    
+    # (width, height) of an NPY or PPM file
+    
+    pixels = load_raw(filename)
+    return pixels.shape[1], pixels.shape[0]
+    
+    
+def check_order(filename, order):
+    
+    # Raises ValueError when order can't be used for the output file
+    
+    if order not in ORDERS:
+        raise ValueError('Unknown channel order "%s", expected one of %s' % (order, ', '.join(ORDERS)))
+        
+    ext = os.path.splitext(filename)[1].lower()
+    
+    if order != 'rgb' and ext not in ('.npy', '.raw'):
+        raise ValueError('%s: channel order %s needs a .npy or .raw file' % (filename, order))
+        
+        
+class MappedOutput:
+    
+    # A new uncompressed image file, memory-mapped for writing. Fill the 
+    # rgb array (a view in the file's channel order), then call close(). 
+    # The file is written under a temporary name first, so an interrupted
+    # run never leaves a partial file behind.
+    
+    def __init__(self, filename, width, height, order='rgb'):
+        
+        check_order(filename, order)
+        
+        self.filename = filename
+        self.tmpname = filename + '.part'
+        
+        channels = len(order)
+        shape = (height, width, channels)
+        ext = os.path.splitext(filename)[1].lower()
+        
+        if ext == '.npy':
+            self.pixels = np.lib.format.open_memmap(self.tmpname, 'w+', np.uint8, shape)
+        else:
+            header = b'P6\n%d %d\n255\n' % (width, height) if ext == '.ppm' else b''
+            with open(self.tmpname, 'wb') as f:
+                f.write(header)
+                f.truncate(len(header) + width*height*channels)
+            self.pixels = np.memmap(self.tmpname, np.uint8, 'r+', len(header), shape)
+            
+        if channels == 4:
+            self.pixels[:,:,3] = 255
+            
+        # The R, G and B channels, in the order RGB
+        self.rgb = self.pixels[:,:,2::-1] if order.startswith('bgr') else self.pixels[:,:,:3]
+        
+    def write(self, native):
+        # native: (height, width, 3) RGB array
+        self.rgb[:] = native
+        
+    def close(self):
+        
+        if self.pixels is None:
+            return
+            
+        self.pixels.flush()
+        self.pixels = self.rgb = None
+        os.replace(self.tmpname, self.filename)
+        
+        
+def save_raw(native, filename, order='rgb'):
+    
+    output = MappedOutput(filename, native.shape[1], native.shape[0], order)
+    output.write(native)
+    output.close()
@@ -0,0 +1,362 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Conversion of a sequence of quilt images (e.g. an animation) to native
+# images, using a pool of worker processes. 
+#
+# The lookup table is computed (or loaded from the cache) once, before 
+# the workers are forked, so they all share the same copy. Each worker
+# converts a chunk of frames at a time, decoding the next quilt image 
+# in a background thread while the current one is interlaced and encoded.
+#
+# Alternatively, a stream of raw RGB frames can be converted into a stream
+# of raw native frames, e.g. as part of a video pipeline. Input and output
+# buffers are allocated once and reused for every frame.
+
+import os, sys, time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+from interlace import load_quilt, interlace
+from metrics import Stages
+from rawimage import is_raw, check_order, save_raw, MappedOutput
+
+def save_image(img, filename, **params):
+    
+    # Write to a temporary file first, so an interrupted run never
+    # leaves a partial output file behind (which would be skipped
+    # when resuming)
+    ext = os.path.splitext(filename)[1].lower()
+    fmt = Image.registered_extensions().get(ext)
+    
+    tmpname = filename + '.part'
+    img.save(tmpname, format=fmt, **params)
+    os.replace(tmpname, filename)
+    
+    
+def save_native(native, filename, order='rgb', **params):
+    
+    # native: RGB array. Uncompressed formats (see rawimage.py) are written
+    # in the given channel order, others through PIL with params (e.g. 
+    # compress_level).
+    
+    if is_raw(filename):
+        save_raw(native, filename, order)
+    else:
+        check_order(filename, order)
+        save_image(Image.fromarray(native), filename, **params)
+        
+
+def _init_worker(table, quilt_size, quilt_pattern, native_pattern, order, save_params, cache, 
+    cache_params, profiler=None):
+    
+    global _table, _quilt_size, _quilt_pattern, _native_pattern, _order, _save_params, _profiler
+    global _cache, _cache_params
+    
+    _table = table
+    _quilt_size = quilt_size
+    _quilt_pattern = quilt_pattern
+    _native_pattern = native_pattern
+    _order = order
+    _save_params = save_params
+    _cache = cache
+    _cache_params = cache_params
+    _profiler = profiler
+    
+    
+def _load(frame):
+    
+    # Decoding is timed in the loader thread, with its own Stages
+    stages = Stages()
+    
+    with stages('decode'):
+        quilt = load_quilt(_quilt_pattern % frame)
+    
+    if quilt.shape[1::-1] != _quilt_size:
+        raise ValueError('%s: quilt size %d x %d, expected %d x %d' % 
+            ((_quilt_pattern % frame,) + quilt.shape[1::-1] + _quilt_size))
+            
+    return quilt, stages
+    
+    
+def _convert_chunk(frames):
+    
+    # Returns (frame, stage timings) for each frame converted
+    
+    results = []
+    keys = {}
+    
+    if _cache is not None:
+        
+        # Only convert the frames that are not cached
+        missing = []
+        
+        for frame in frames:
+            stages = Stages(_profiler)
+            with stages('cache'):
+                keys[frame] = _cache.key(_quilt_pattern % frame, _cache_params)
+                cached = _cache.fetch(keys[frame], _native_pattern % frame)
+            if cached:
+                results.append((frame, stages.result()))
+            else:
+                missing.append(frame)
+                
+        frames = missing
+        if len(frames) == 0:
+            return results
+    
+    out = np.empty(_table.shape, np.uint8)
+    
+    with ThreadPoolExecutor(1) as decoder:
+        
+        pending = decoder.submit(_load, frames[0])
+        
+        for idx, frame in enumerate(frames):
+            
+            quilt, load_stages = pending.result()
+            
+            # Prefetch next
+            if idx+1 < len(frames):
+                pending = decoder.submit(_load, frames[idx+1])
+            
+            stages = Stages(_profiler)
+            
+            if is_raw(_native_pattern):
+                
+                # Straight into the output file
+                with stages('encode'):
+                    output = MappedOutput(_native_pattern % frame, out.shape[1], out.shape[0], _order)
+                with stages('gather'):
+                    interlace(quilt, _table, out=output.rgb)
+                with stages('encode'):
+                    output.close()
+                    
+            else:
+                
+                with stages('gather'):
+                    interlace(quilt, _table, out=out)
+                
+                with stages('encode'):
+                    save_image(Image.fromarray(out), _native_pattern % frame, **_save_params)
+                    
+            if _cache is not None:
+                with stages('cache'):
+                    _cache.store(keys[frame], _native_pattern % frame)
+                    
+            del quilt
+                
+            timings = load_stages.result()
+            timings.update(stages.result())
+            results.append((frame, timings))
+            
+    return results
+    
+    
+def convert_sequence(table, quilt_size, quilt_pattern, native_pattern, first, last, 
+    workers=None, skip_existing=False, chunksize=4, metrics=None, order='rgb', cache=None, 
+    cache_params=None, **params):
+    
+    # metrics: a metrics.Metrics, to which a record is written per frame.
+    # Only the worker processes' own stages can be profiled, so profiling
+    # is done with a single worker only. order: channel order for raw 
+    # output files, params are passed on to PIL for other formats. cache:
+    # a nativecache.NativeCache, with cache_params the conversion 
+    # parameters (see nativecache.conversion_params()).
+    
+    frames = list(range(first, last+1))
+    
+    if skip_existing:
+        frames = [f for f in frames if not os.path.isfile(native_pattern % f)]
+        print('%d of %d frames to convert' % (len(frames), last-first+1))
+        
+    if len(frames) == 0:
+        return
+        
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, len(frames)))
+    
+    # Use smaller chunks when there's few frames per worker, to keep 
+    # them all busy
+    chunksize = max(1, min(chunksize, len(frames) // workers))
+    chunks = [frames[i:i+chunksize] for i in range(0, len(frames), chunksize)]
+    
+    initargs = (table, tuple(quilt_size), quilt_pattern, native_pattern, order, params, 
+        cache, cache_params)
+    
+    t0 = time.time()
+    done = 0
+    
+    if workers == 1:
+        _init_worker(*initargs, profiler=metrics.profiler if metrics is not None else None)
+        results = map(_convert_chunk, chunks)
+        pool = None
+    else:
+        # Fork, so the workers share the table (and don't re-run the
+        # calling script)
+        ctx = multiprocessing.get_context('fork')
+        pool = ctx.Pool(workers, _init_worker, initargs)
+        results = pool.imap_unordered(_convert_chunk, chunks)
+        
+    try:
+        for records in results:
+            done += len(records)
+            if metrics is not None:
+                for frame, timings in records:
+                    metrics.write(timings, pixels=table.shape[0]*table.shape[1], frame=frame)
+            t = time.time() - t0
+            sys.stdout.write('\r%d/%d frames, %.2f frames/s' % (done, len(frames), done/t))
+            sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+            
+    print()
+
+
+def convert_devices(quilt, tables, filenames, workers=1, processes=False, stages=None, 
+    order='rgb', **params):
+    
+    # Gather the native images for several devices (tables) from the same 
+    # quilt. Images are encoded and saved in the background while the 
+    # next one is gathered, so the 'encode' stage only counts the time
+    # spent waiting for the last ones. order and params: see save_native()
+    
+    from parallel import interlace_parallel
+    
+    if stages is None:
+        stages = Stages()
+    
+    def save(native, filename):
+        save_native(native, filename, order, **params)
+        
+    with ThreadPoolExecutor(max(1, min(workers, len(tables)))) as saver:
+        
+        pending = []
+        
+        for table, filename in zip(tables, filenames):
+            with stages('gather'):
+                native = interlace_parallel(quilt, table, workers, processes)
+            pending.append(saver.submit(save, native, filename))
+            del native
+            
+        with stages('encode'):
+            for p in pending:
+                p.result()
+            
+            
+def open_stream(filename, mode):
+    
+    # '-' means stdin/stdout, otherwise a regular file or named pipe
+    if filename == '-':
+        return sys.stdin.buffer if mode == 'rb' else sys.stdout.buffer
+        
+    return open(filename, mode, buffering=0)
+    
+    
+def read_frame(f, buf):
+    
+    # Fill buf completely. Returns False on end-of-stream.
+    
+    view = memoryview(buf).cast('B')
+    n = 0
+    
+    while n < len(view):
+        k = f.readinto(view[n:])
+        if not k:
+            if n == 0:
+                return False
+            raise EOFError('Stream ended halfway a frame (%d of %d bytes)' % (n, len(view)))
+        n += k
+        
+    return True
+    
+    
+def write_frame(f, buf):
+    
+    view = memoryview(buf).cast('B')
+    n = 0
+    
+    # Raw (unbuffered) files can do partial writes
+    while n < len(view):
+        n += f.write(view[n:])
+        
+    f.flush()
+    
+    
+def convert_stream(infile, outfile, inbuf, table, workers=1, metrics=None):
+    
+    # Read raw frames of inbuf's size from infile, interlace each one
+    # with table (using workers threads) and write the raw native frame 
+    # to outfile. metrics: a metrics.Metrics, to which a record is written
+    # per frame (the 'read' stage includes waiting for the producer, 'write'
+    # waiting for the consumer).
+    
+    from parallel import interlace_threaded
+    
+    fin = open_stream(infile, 'rb')
+    fout = open_stream(outfile, 'wb')
+    
+    outbuf = np.empty(table.shape, np.uint8)
+    frames = 0
+    
+    executor = ThreadPoolExecutor(workers) if workers > 1 else None
+    
+    try:
+        while True:
+            
+            stages = Stages(metrics.profiler if metrics is not None else None)
+            
+            with stages('read'):
+                if not read_frame(fin, inbuf):
+                    break
+                    
+            with stages('gather'):
+                if executor is None:
+                    interlace(inbuf, table, out=outbuf)
+                else:
+                    interlace_threaded(inbuf, table, outbuf, executor, workers)
+                    
+            with stages('write'):
+                write_frame(fout, outbuf)
+                
+            if metrics is not None:
+                metrics.write(stages, pixels=table.shape[0]*table.shape[1], frame=frames)
+            frames += 1
+    except BrokenPipeError:
+        # Downstream consumer went away
+        pass
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if fin is not sys.stdin.buffer:
+            fin.close()
+        if fout is not sys.stdout.buffer:
+            fout.close()
+            
+    return frames
@@ -0,0 +1,131 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Sparse quilt format, holding only the quilt values that are actually
+# sampled for a specific display (calibration) and quilt layout.
+#
+# With nearest-neighbour sampling each native subpixel reads a single 
+# channel of a single quilt texel, so at most screenW*screenH*3 of the
+# quilt's values are used. A sparse file stores just those, ordered by 
+# their position in the quilt, and a native image is produced from it 
+# with a single gather.
+#
+# File layout: 'LGSQ', uint32 (little-endian) header length, JSON 
+# header, values (zlib-compressed or not).
+
+import json, struct, zlib
+import numpy as np
+
+from interlace import get_quilt_lookup_table, calibration_key, cached
+
+MAGIC = b'LGSQ'
+VERSION = 1
+
+def sparse_index(calibration, tiles, quilt_size):
+    
+    # Returns the sorted flat offsets of the quilt values used, and for 
+    # each native subpixel the index of its value in that list
+    
+    def compute():
+        table = get_quilt_lookup_table(calibration, tiles, quilt_size)
+        used, inverse = np.unique(table, return_inverse=True)
+        return used, inverse.reshape(table.shape).astype(np.uint32)
+        
+    params = (calibration_key(calibration), tuple(tiles), tuple(quilt_size))
+    
+    return cached('sparse', params, compute)
+    
+    
+def write_sparse(filename, calibration, tiles, quilt, compress_level=6):
+    
+    # quilt: (QHEIGHT, QWIDTH, 3) uint8 array
+    
+    quilt_size = quilt.shape[1::-1]
+    used, inverse = sparse_index(calibration, tiles, quilt_size)
+    
+    values = np.take(quilt.reshape(-1), used)
+    
+    if compress_level > 0:
+        payload = zlib.compress(values, compress_level)
+    else:
+        payload = values.tobytes()
+    
+    header = dict(
+        version=VERSION,
+        screen=[calibration.screenW, calibration.screenH],
+        tiles=list(tiles),
+        quilt_size=list(quilt_size),
+        calibration=calibration_key(calibration),
+        count=len(values),
+        compression='zlib' if compress_level > 0 else 'none')
+        
+    header = json.dumps(header).encode('utf8')
+    
+    with open(filename, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        f.write(payload)
+        
+    return len(values)
+    
+    
+def read_sparse_header(f):
+    
+    if f.read(4) != MAGIC:
+        raise ValueError('Not a sparse quilt file')
+        
+    length = struct.unpack('<I', f.read(4))[0]
+    header = json.loads(f.read(length).decode('utf8'))
+    
+    if header['version'] != VERSION:
+        raise ValueError('Unsupported sparse quilt version %d' % header['version'])
+        
+    return header
+    
+    
+def read_sparse(filename, calibration, out=None):
+    
+    # Returns the native image for the sparse quilt, which needs to
+    # have been made for this calibration
+    
+    with open(filename, 'rb') as f:
+        
+        header = read_sparse_header(f)
+        
+        if tuple(header['calibration']) != calibration_key(calibration):
+            raise ValueError('%s was made for a different calibration' % filename)
+            
+        payload = f.read()
+        
+    if header['compression'] == 'zlib':
+        payload = zlib.decompress(payload)
+        
+    values = np.frombuffer(payload, np.uint8)
+    
+    if len(values) != header['count']:
+        raise ValueError('%s: expected %d values, got %d' % (filename, header['count'], len(values)))
+    
+    used, inverse = sparse_index(calibration, header['tiles'], header['quilt_size'])
+    
+    return np.take(values, inverse, out=out, mode='clip')
@@ -0,0 +1,55 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks frames2native.py with view images in the formats it reads, run
+# with pytest
+
+import os, sys, subprocess
+import numpy as np
+from PIL import Image
+
+from interlace import load_quilt
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VISUAL = os.path.join(HERE, 'visual.default.json')
+
+def frames2native(tmp_path, *args):
+    env = dict(os.environ, LG_CACHE_DIR=str(tmp_path / 'cache'))
+    subprocess.check_call([sys.executable, os.path.join(HERE, 'frames2native.py')] + list(args), 
+        env=env, stdout=subprocess.DEVNULL)
+    
+def test_low_memory_npy(tmp_path):
+    
+    # Views of 64x40, as .npy and .png files
+    rng = np.random.default_rng(1)
+    for view in range(45):
+        img = rng.integers(0, 256, (40, 64, 3), dtype=np.uint8)
+        np.save(str(tmp_path / ('view%02d.npy' % view)), img)
+        Image.fromarray(img).save(str(tmp_path / ('view%02d.png' % view)))
+        
+    frames2native(tmp_path, VISUAL, str(tmp_path / 'view%02d.png'), '0', '44', str(tmp_path / 'ref.npy'))
+    frames2native(tmp_path, '-l', VISUAL, str(tmp_path / 'view%02d.npy'), '0', '44', str(tmp_path / 'low.npy'))
+    
+    assert np.array_equal(load_quilt(str(tmp_path / 'low.npy')), load_quilt(str(tmp_path / 'ref.npy')))
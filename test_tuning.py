@@ -0,0 +1,95 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks that calibration tuning gives the same native image as the 
+# conversion scripts, run with pytest
+
+import os
+import numpy as np
+import pytest
+
+from calibration import Calibration
+from interlace import interlace, quilt_lookup_table
+from tuning import CalibrationTuner
+
+VISUAL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'visual.default.json')
+
+# Quilt sizes that are a multiple of the tile grid
+# Center, pitch and slope changes, including negative slopes (phases 
+# close to a view boundary map to view 0 or the last view)
+CHANGES = [
+    dict(center=0.1),
+    dict(center=0.37),
+    dict(pitch=49.91, slope=5.8),
+    dict(center=0.0, pitch=49.91, slope=-5.5),
+    dict(center=0.0, pitch=49.91, slope=-3.0),
+    dict(pitch=50.3, center=0.21, slope=6.1),
+]
+
+# Quilt sizes that are a multiple of the tile grid
+@pytest.mark.parametrize('quilt_size, tiles', [
+    ((4000, 4005), (5, 9)),
+    ((4000, 3600), (5, 9)),
+    ((2048, 2048), (4, 8)),
+    ((3360, 3360), (8, 6)),
+    ((1000, 999), (5, 9)),
+])
+def test_bit_identical(quilt_size, tiles):
+    
+    QWIDTH, QHEIGHT = quilt_size
+    rng = np.random.default_rng(1)
+    quilt = rng.integers(0, 256, (QHEIGHT, QWIDTH, 3), dtype=np.uint8)
+    
+    calibration = Calibration(VISUAL)
+    with CalibrationTuner(calibration, tiles, quilt) as tuner:
+        for changes in CHANGES:
+            native = tuner.update(**changes)
+            table = quilt_lookup_table(calibration, tiles, quilt_size)
+            assert np.array_equal(native, interlace(quilt, table))
+            
+# A padded quilt as make_quilt.py writes it, 4096 is not a multiple of 
+# 5 or 9: the texels may be one column and/or row off (see tuning.py)
+def test_padded_quilt():
+    
+    QWIDTH = QHEIGHT = 4096
+    tiles = (5, 9)
+    
+    # Each texel stores its column and row modulo 16, so a texel in 
+    # another view (819 or 455 texels away) shows up as well
+    y, x = np.mgrid[:QHEIGHT,:QWIDTH]
+    quilt = np.repeat((((x & 15) << 4) | (y & 15)).astype(np.uint8)[:,:,np.newaxis], 3, axis=2)
+    
+    calibration = Calibration(VISUAL)
+    with CalibrationTuner(calibration, tiles, quilt) as tuner:
+        for changes in CHANGES:
+            native = tuner.update(**changes)
+            table = quilt_lookup_table(calibration, tiles, (QWIDTH, QHEIGHT))
+            reference = interlace(quilt, table)
+            
+            dx = ((native >> 4) - (reference >> 4)) & 15
+            dy = ((native & 15) - (reference & 15)) & 15
+            assert np.all((dx <= 1) | (dx == 15))
+            assert np.all((dy <= 1) | (dy == 15))
+            assert np.mean(native != reference) < 0.45
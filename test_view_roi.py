@@ -0,0 +1,74 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Checks the view masks of view_roi.py against the texels actually 
+# sampled from quilts built by make_quilt.py, run with pytest
+
+import os, sys, subprocess
+import numpy as np
+import pytest
+
+from calibration import Calibration
+from interlace import load_quilt, quilt_lookup_table
+from view_roi import quilt_view_masks
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VISUAL = os.path.join(HERE, 'visual.default.json')
+
+@pytest.mark.parametrize('view_size, tiles', [
+    ((100, 60), (5, 9)),    # padded to 512x1024
+    ((819, 455), (5, 9)),   # padded to 4096x4096
+    ((128, 64), (4, 8)),    # no padding
+])
+def test_quilt_view_masks(tmp_path, view_size, tiles):
+    
+    VIEW_WIDTH, VIEW_HEIGHT = view_size
+    num_views = tiles[0] * tiles[1]
+    
+    # View images holding 1 + the index of each of their pixels, as 24-bit RGB
+    for view in range(num_views):
+        ids = 1 + view * VIEW_WIDTH * VIEW_HEIGHT + np.arange(VIEW_WIDTH * VIEW_HEIGHT)
+        rgb = np.stack([(ids >> 16) & 255, (ids >> 8) & 255, ids & 255], axis=-1).astype(np.uint8)
+        np.save(str(tmp_path / ('view%02d.npy' % view)), rgb.reshape(VIEW_HEIGHT, VIEW_WIDTH, 3))
+        
+    quilt_file = str(tmp_path / 'quilt.npy')
+    subprocess.check_call([sys.executable, os.path.join(HERE, 'make_quilt.py'), '-j', '1', quilt_file, 
+        str(tiles[0]), str(tiles[1]), str(tmp_path / 'view%02d.npy'), '0', str(num_views - 1)],
+        stdout=subprocess.DEVNULL)
+        
+    quilt = load_quilt(quilt_file).astype(np.int64)
+    ids = (quilt[:,:,0] << 16) | (quilt[:,:,1] << 8) | quilt[:,:,2]
+    quilt_size = ids.shape[::-1]
+    
+    # The view pixels quilt2native.py samples, padding (id 0) excluded
+    calibration = Calibration(VISUAL)
+    table = quilt_lookup_table(calibration, tiles, quilt_size)
+    sampled = ids.reshape(-1)[table.reshape(-1) // 3]
+    expected = np.zeros(num_views * VIEW_WIDTH * VIEW_HEIGHT + 1, bool)
+    expected[sampled] = True
+    
+    masks = quilt_view_masks(calibration, tiles, view_size, quilt_size)
+    
+    assert np.array_equal(masks.reshape(-1), expected[1:])
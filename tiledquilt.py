@@ -0,0 +1,294 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Tiled quilt container, in which each tile (or each row of tiles) of a
+# quilt is compressed separately. Consumers that only need some of the
+# views decode just those chunks, and a full quilt can be decoded with
+# several threads.
+#
+# File layout: 'LGTQ', uint32 (little-endian) header length, JSON 
+# header, chunks. The header holds the quilt size, tiles and the pixel
+# rectangle (x0, y0, x1, y1) of each view, numbered from the bottom-left
+# tile as in make_quilt.py. Each chunk has a rectangle, the views it
+# holds, and its offset and length after the header. Chunks are PNG 
+# images, or raw RGB. Quilt pixels outside all chunks (e.g. padding) 
+# are black.
+
+import io, os, json, struct
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+from layout import quilt_view_rects, pixel_range
+
+MAGIC = b'LGTQ'
+VERSION = 1
+
+FORMATS = ('png', 'raw')
+
+def is_tiled(filename):
+    
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(4) == MAGIC
+    except OSError:
+        return False
+        
+        
+def tile_pixel_rects(tiles, quilt_size):
+    
+    # Whole-pixel view rectangles for a quilt with fractional tile sizes:
+    # the pixels whose centre lies in the tile, so each pixel is in one view
+    
+    QWIDTH, QHEIGHT = quilt_size
+    rects = []
+    
+    for x0, y0, x1, y1 in quilt_view_rects(tiles, quilt_size):
+        cols = pixel_range(x0, x1, QWIDTH)
+        rows = pixel_range(y0, y1, QHEIGHT)
+        rects.append((cols[0], rows[0], cols[1], rows[1]))
+        
+    return rects
+    
+    
+def encode_chunk(pixels, fmt, compress_level):
+    
+    if fmt == 'raw':
+        return np.ascontiguousarray(pixels).tobytes()
+        
+    f = io.BytesIO()
+    Image.fromarray(pixels).save(f, format='PNG', compress_level=compress_level)
+    return f.getvalue()
+    
+    
+def write_tiled(filename, quilt, tiles, view_rects=None, bands=False, fmt='png', 
+    compress_level=6, workers=1):
+    
+    # quilt: (QHEIGHT, QWIDTH, 3) uint8 array. view_rects: the pixel 
+    # rectangle of each view, by default from tile_pixel_rects(). With 
+    # bands there's a chunk per row of tiles, instead of per tile. Chunks
+    # are encoded with workers threads.
+    
+    if fmt not in FORMATS:
+        raise ValueError('Unknown chunk format "%s"' % fmt)
+        
+    quilt_size = quilt.shape[1::-1]
+    num_views = tiles[0] * tiles[1]
+    
+    if view_rects is None:
+        view_rects = tile_pixel_rects(tiles, quilt_size)
+    view_rects = [tuple(int(c) for c in rect) for rect in view_rects]
+    
+    if bands:
+        groups = [list(range(row*tiles[0], (row+1)*tiles[0])) for row in range(tiles[1])]
+    else:
+        groups = [[view] for view in range(num_views)]
+        
+    # Chunk rectangles, bounding the views in them
+    chunks = []
+    for views in groups:
+        rects = [view_rects[v] for v in views]
+        rect = (min(r[0] for r in rects), min(r[1] for r in rects),
+            max(r[2] for r in rects), max(r[3] for r in rects))
+        chunks.append(dict(views=views, rect=rect))
+        
+    def encode(chunk):
+        x0, y0, x1, y1 = chunk['rect']
+        return encode_chunk(quilt[y0:y1, x0:x1], fmt, compress_level)
+        
+    with ThreadPoolExecutor(max(1, workers)) as executor:
+        payloads = list(executor.map(encode, chunks))
+        
+    offset = 0
+    for chunk, payload in zip(chunks, payloads):
+        chunk['offset'] = offset
+        chunk['length'] = len(payload)
+        offset += len(payload)
+        
+    header = dict(
+        version=VERSION,
+        quilt_size=list(quilt_size),
+        tiles=list(tiles),
+        order='bottom-left',
+        views=view_rects,
+        format=fmt,
+        chunks=chunks)
+        
+    header = json.dumps(header).encode('utf8')
+    
+    with open(filename, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for payload in payloads:
+            f.write(payload)
+            
+    return offset
+    
+    
+class TiledQuilt:
+    
+    # Reads (parts of) a tiled quilt file. Chunks are read with pread(), 
+    # so the methods can be used from multiple threads.
+    
+    def __init__(self, filename):
+        
+        self.filename = filename
+        self.fd = os.open(filename, os.O_RDONLY)
+        
+        try:
+            if os.pread(self.fd, 4, 0) != MAGIC:
+                raise ValueError('%s: not a tiled quilt file' % filename)
+                
+            length = struct.unpack('<I', os.pread(self.fd, 4, 4))[0]
+            header = json.loads(os.pread(self.fd, length, 8).decode('utf8'))
+            
+            if header['version'] != VERSION:
+                raise ValueError('%s: unsupported tiled quilt version %d' % (filename, header['version']))
+                
+        except Exception:
+            os.close(self.fd)
+            raise
+            
+        self.data_offset = 8 + length
+        self.quilt_size = tuple(header['quilt_size'])
+        self.tiles = tuple(header['tiles'])
+        self.view_rects = [tuple(rect) for rect in header['views']]
+        self.format = header['format']
+        self.chunks = header['chunks']
+        
+        # Chunk holding each view
+        self.view_chunk = {}
+        for i, chunk in enumerate(self.chunks):
+            for view in chunk['views']:
+                self.view_chunk[view] = i
+                
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+        
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            
+    @property
+    def num_views(self):
+        return len(self.view_rects)
+        
+    def view_size(self, view):
+        x0, y0, x1, y1 = self.view_rects[view]
+        return x1 - x0, y1 - y0
+        
+    def read_chunk(self, index):
+        
+        # Returns the chunk's pixels, as (height, width, 3) array
+        
+        chunk = self.chunks[index]
+        x0, y0, x1, y1 = chunk['rect']
+        
+        data = os.pread(self.fd, chunk['length'], self.data_offset + chunk['offset'])
+        if len(data) != chunk['length']:
+            raise ValueError('%s: truncated chunk %d' % (self.filename, index))
+            
+        if self.format == 'raw':
+            pixels = np.frombuffer(data, np.uint8).reshape(y1-y0, x1-x0, 3)
+        else:
+            img = Image.open(io.BytesIO(data))
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            pixels = np.asarray(img)
+            
+        if pixels.shape[:2] != (y1-y0, x1-x0):
+            raise ValueError('%s: chunk %d has size %d x %d, expected %d x %d' % 
+                (self.filename, index, pixels.shape[1], pixels.shape[0], x1-x0, y1-y0))
+                
+        return pixels
+        
+    def crop_view(self, view, pixels):
+        
+        # The view's part of the pixels of its chunk
+        
+        x0, y0, x1, y1 = self.view_rects[view]
+        cx, cy = self.chunks[self.view_chunk[view]]['rect'][:2]
+        
+        return pixels[y0-cy:y1-cy, x0-cx:x1-cx]
+        
+    def read_view(self, view):
+        
+        # Returns the view's image, as (height, width, 3) array
+        return self.crop_view(view, self.read_chunk(self.view_chunk[view]))
+        
+    def read_views(self, views, workers=None):
+        
+        # Decodes only the chunks holding the views, in parallel. Views
+        # in the same chunk (a row of tiles) share a single decode.
+        
+        needed = sorted(set(self.view_chunk[v] for v in views))
+        
+        with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+            decoded = dict(zip(needed, executor.map(self.read_chunk, needed)))
+            
+        return [self.crop_view(view, decoded[self.view_chunk[view]]) for view in views]
+        
+    def read_quilt(self, workers=None, out=None, rows=None):
+        
+        # Returns the full quilt as (QHEIGHT, QWIDTH, 3) array, decoding 
+        # the chunks in parallel. rows: optional (first, last+1) range of
+        # quilt rows, then only the chunks overlapping them are decoded.
+        
+        QWIDTH, QHEIGHT = self.quilt_size
+        first, last = rows if rows is not None else (0, QHEIGHT)
+        
+        if out is None:
+            out = np.zeros((last - first, QWIDTH, 3), np.uint8)
+        else:
+            out[:] = 0
+            
+        needed = [i for i, chunk in enumerate(self.chunks)
+            if chunk['rect'][1] < last and chunk['rect'][3] > first]
+        
+        def place(index):
+            x0, y0, x1, y1 = self.chunks[index]['rect']
+            pixels = self.read_chunk(index)
+            top, bottom = max(y0, first), min(y1, last)
+            out[top-first:bottom-first, x0:x1] = pixels[top-y0:bottom-y0]
+            
+        with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+            list(executor.map(place, needed))
+            
+        return out
+        
+    def row_bands(self):
+        
+        # (first, last+1) ranges of quilt rows, split at the chunk edges, 
+        # so reading them band by band decodes each chunk about once
+        
+        edges = {0, self.quilt_size[1]}
+        for chunk in self.chunks:
+            edges.update((chunk['rect'][1], chunk['rect'][3]))
+        edges = sorted(edges)
+        
+        return list(zip(edges[:-1], edges[1:]))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# Convert between quilt layouts: grid quilts, linear quilts and separate 
+# frame images, with different numbers of tiles and sizes.
+#
+# Paul Melis <paul.melis@surfsara.nl>
+# SURFsara Visualization group
+#
+#
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os, sys, getopt, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+from interlace import load_quilt
+from layout import quilt_views, frame_views, transcode
+from sequence import save_image
+
+def usage():
+    print('usage: %s [options] <input> <output>' % sys.argv[0])
+    print()
+    print('Layouts are grid:<tilesh>x<tilesv>, linear:<tiles> or frames:<count>. For frames')
+    print('the input or output is a printf-style pattern, e.g. view%02d.png, with views')
+    print('numbered from 0. When the number of views differs the nearest view is used.')
+    print()
+    print('options:')
+    print('  -i <layout>        Input layout (default: grid:5x9)')
+    print('  -o <layout>        Output layout (default: grid:5x9)')
+    print('  -s <w>x<h>         Output quilt size, or frame size for frames. Default is to')
+    print('                     keep the size of the views')
+    print('  -f <method>        Interpolation when the view size changes: nearest (default)')
+    print('                     or linear')
+    print('  -z <level>         PNG compression level, 0 (fastest) - 9 (smallest), default 6')
+    print('  -j <workers>       Number of threads decoding and encoding frame images')
+    print('                     (default: number of cores)')
+    print()
+    sys.exit(-1)
+    
+def parse_layout(s):
+    
+    kind, _, count = s.partition(':')
+    
+    if kind == 'grid':
+        return kind, tuple(map(int, count.split('x')))
+    elif kind == 'linear':
+        return kind, (int(count), 1)
+    elif kind == 'frames':
+        return kind, (int(count), 1)
+        
+    usage()
+    
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'i:o:s:f:z:j:')
+except getopt.GetoptError:
+    usage()
+    
+if len(args) != 2:
+    usage()
+    
+input_layout = ('grid', (5, 9))
+output_layout = ('grid', (5, 9))
+output_size = None
+method = 'nearest'
+compress_level = 6
+workers = os.cpu_count()
+
+for o, a in opts:
+    if o == '-i':
+        input_layout = parse_layout(a)
+    elif o == '-o':
+        output_layout = parse_layout(a)
+    elif o == '-s':
+        output_size = tuple(map(int, a.split('x')))
+    elif o == '-f':
+        method = a
+    elif o == '-z':
+        compress_level = int(a)
+    elif o == '-j':
+        workers = int(a)
+        
+input_file, output_file = args
+
+if method not in ('nearest', 'linear'):
+    usage()
+    
+t0 = time.time()
+
+with ThreadPoolExecutor(workers) as pool:
+    
+    kind, tiles = input_layout
+    
+    if kind == 'frames':
+        frames = list(pool.map(lambda i: load_quilt(input_file % i), range(tiles[0])))
+        sources = frame_views(frames)
+    else:
+        sources = quilt_views(load_quilt(input_file), tiles)
+        
+    # Size of a single view
+    x0, y0, x1, y1 = sources[0][1]
+    view_size = (x1 - x0, y1 - y0)
+    
+    t1 = time.time()
+    
+    kind, tiles = output_layout
+    
+    if kind == 'frames':
+        
+        if output_size is None:
+            output_size = tuple(int(round(s)) for s in view_size)
+            
+        frames = [np.zeros((output_size[1], output_size[0], 3), np.uint8) for i in range(tiles[0])]
+        transcode(sources, frame_views(frames), method)
+        
+        t2 = time.time()
+        
+        list(pool.map(lambda i: save_image(Image.fromarray(frames[i]), output_file % i, 
+            compress_level=compress_level), range(tiles[0])))
+        
+    else:
+        
+        if output_size is None:
+            output_size = (int(round(view_size[0]*tiles[0])), int(round(view_size[1]*tiles[1])))
+            
+        quilt = np.zeros((output_size[1], output_size[0], 3), np.uint8)
+        transcode(sources, quilt_views(quilt, tiles), method)
+        
+        t2 = time.time()
+        
+        save_image(Image.fromarray(quilt), output_file, compress_level=compress_level)
+        
+t3 = time.time()
+
+print('Decoding %.3f s, transcoding %.3f s, encoding %.3f s' % (t1-t0, t2-t1, t3-t2))
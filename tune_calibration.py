@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#
+# Interactive tuning of the center, pitch and slope calibration values
+# of a display. The quilt is decoded once, after each change only the
+# view each native subpixel samples is recomputed (see tuning.py), so 
+# an update takes well under 100 ms for a 2560x1600 display.
+#
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os, sys, getopt, time
+
+from calibration import Calibration
+from interlace import load_quilt
+from rawimage import check_order
+from sequence import save_native
+from tuning import CalibrationTuner
+
+VALUES = ('center', 'pitch', 'slope')
+
+def usage():
+    print('usage: %s [options] <visual.json> <quilt-image> [tilesh tilesv] <native-image>' % sys.argv[0])
+    print()
+    print('Interactively tune the center, pitch and slope calibration values. The native')
+    print('image is written again after each change, show it on the display with a viewer')
+    print('that reloads it. Use a .raw, .ppm or .npy file, encoding PNG takes much longer')
+    print('than the update itself. A numbers quilt (see gen_numbers_quilt.py) works well.')
+    print()
+    print('options:')
+    print('  -o <file.json>     Calibration file written by "save" (default: none, pass a name)')
+    print('  -j <workers>       Number of threads (default: number of cores)')
+    print('  -O <order>         Channel order for .npy and .raw output: rgb (default), bgr,')
+    print('                     rgba or bgra')
+    print()
+    print('Commands, one per line on stdin:')
+    print('  center|pitch|slope <value>     Set a value')
+    print('  center|pitch|slope += <step>   Change a value (also -=)')
+    print('  <empty line>                   Repeat the previous command')
+    print('  show                           Print the current values')
+    print('  save [file.json]               Write the calibration')
+    print('  quit')
+    print()
+    sys.exit(-1)
+    
+    
+def parse_command(line, values):
+    
+    # Returns (name, value) for a change, raises ValueError otherwise
+    
+    words = line.split()
+    
+    if len(words) == 2 and words[0] in VALUES:
+        return words[0], float(words[1])
+    if len(words) == 3 and words[0] in VALUES and words[1] in ('+=', '-='):
+        step = float(words[2])
+        return words[0], values[words[0]] + (step if words[1] == '+=' else -step)
+        
+    raise ValueError('Unknown command "%s"' % line)
+    
+    
+def main():
+    
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'o:j:O:')
+    except getopt.GetoptError:
+        usage()
+        
+    if len(args) not in [3,5]:
+        usage()
+        
+    output_file = None
+    workers = os.cpu_count()
+    order = 'rgb'
+    
+    for o, a in opts:
+        if o == '-o':
+            output_file = a
+        elif o == '-j':
+            workers = int(a)
+        elif o == '-O':
+            order = a
+            
+    try:
+        check_order(args[-1], order)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+        
+    calibration = Calibration(args[0])
+    quilt_image_file = args[1]
+    if len(args) == 5:
+        TILES = tuple(map(int, args[2:4]))
+        native_image_file = args[4]
+    else:
+        TILES = (5, 9)
+        native_image_file = args[2]
+        
+    quilt = load_quilt(quilt_image_file)
+    
+    def show(change=None):
+        
+        t0 = time.time()
+        native = tuner.update(**change)
+        t1 = time.time()
+        save_native(native, native_image_file, order)
+        t2 = time.time()
+        
+        print('center %.4f  pitch %.4f  slope %.4f  (update %d ms, write %d ms)' % 
+            (tuple(tuner.values()[name] for name in VALUES) + ((t1-t0)*1000, (t2-t1)*1000)))
+        
+    with CalibrationTuner(calibration, TILES, quilt, workers) as tuner:
+        
+        del quilt
+        show({})
+        
+        interactive = sys.stdin.isatty()
+        previous = None
+        
+        while True:
+            
+            try:
+                line = input('> ' if interactive else '').strip()
+            except EOFError:
+                break
+                
+            if not line:
+                line = previous
+            if not line:
+                continue
+            previous = line
+                
+            words = line.split()
+            
+            if words[0] == 'quit':
+                break
+            elif words[0] == 'show':
+                print(' '.join('%s %s' % (name, tuner.values()[name]) for name in VALUES))
+            elif words[0] == 'save':
+                filename = words[1] if len(words) > 1 else output_file
+                if filename is None:
+                    print('No calibration file name given (save <file.json> or -o)')
+                    continue
+                tuner.save(filename)
+                print('Saved %s' % filename)
+            else:
+                try:
+                    name, value = parse_command(line, tuner.values())
+                    show({name: value})
+                except ValueError as e:
+                    print(e)
+                    previous = None
+                
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Interactive calibration tuning. Changing the center, pitch or slope 
+# only changes the phase of each native subpixel, i.e. which view it 
+# samples, not where it samples within the view. So the quilt is 
+# rearranged once into a stack of equally sized tiles, ordered by the 
+# view index the phase maps to, and the offset of each subpixel within 
+# a tile is computed once. An update then computes the phase in 32-bit 
+# fixed point (as a row term plus a column term, wrapping around gives 
+# the fractional part for free), turns it into the tile index and 
+# gathers, a few passes over the native subpixels in total.
+#
+# The view sampled by each subpixel is the same as in 
+# interlace.quilt_lookup_table(), phases close to a view boundary are 
+# computed again in the same way. When the quilt size is a multiple of 
+# the number of tiles (e.g. 4000x4005 for 5x9) the texel sampled within
+# the view is the same as well, so the native image is identical to the
+# conversion scripts' output. Otherwise the texels sampled differ 
+# between the tiles, which a single stack of tiles can not follow: for a
+# 4096x4096 5x9 quilt about 43% of the subpixels sample a texel one 
+# column (24%) and/or row (25%) away, never further. Some of those 
+# are where quilt_lookup_table() rounds down onto the last texel of the
+# neighbouring tile.
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from interlace import native_uv, quilt_phase, quilt_tiles
+from parallel import row_bands
+
+# Size of the bands of native rows an update works on
+BAND_BYTES = 256*1024
+
+def fixed_point_phase(a):
+    # Fractional part of a, as unsigned 32-bit fixed point
+    frac = a - np.floor(a)
+    return (frac * 2.0**32).astype(np.uint64).astype(np.uint32)
+    
+def tile_samples(a, num_tiles, size):
+    
+    # Returns the quilt columns (or rows) of the tiles as (num_tiles, n)
+    # array, and per native column (row) the index of the one it samples.
+    # a: native u (or v) coordinates, size: quilt width (height).
+    
+    # Quilt column sampled by each native column in each column of 
+    # tiles, computed as in quilt_lookup_table()
+    x = np.array([(((t + a) * (1.0/num_tiles)) * size).astype(np.int64) for t in range(num_tiles)])
+    
+    if size % num_tiles == 0:
+        # One tile column per distinct combination of quilt columns in the
+        # tiles, a little more than the tile width due to rounding
+        samples, index = np.unique(x, axis=1, return_inverse=True)
+        index = index.reshape(-1)
+    else:
+        # Tile 0's columns relative to the first, at each tile's most 
+        # common origin (the tiles are not equally wide)
+        index = x[0] - x[0].min()
+        origins = [np.bincount(d - d.min()).argmax() + d.min() for d in x - x[0]]
+        samples = np.array(origins)[:,np.newaxis] + np.arange(index.max() + 1) + x[0].min()
+        
+    return np.minimum(samples, size - 1), index
+    
+    
+class CalibrationTuner:
+    
+    def __init__(self, calibration, tiles, quilt, workers=1):
+        
+        # calibration: a Calibration, which is updated in place. quilt: 
+        # (QHEIGHT, QWIDTH, 3) uint8 array. workers > 1 updates with 
+        # multiple threads.
+        
+        QHEIGHT, QWIDTH = quilt.shape[:2]
+        self.calibration = calibration
+        self.tiles = tuple(tiles)
+        self.workers = workers
+        self.executor = None
+        
+        W, H = calibration.screenW, calibration.screenH
+        num_views = tiles[0] * tiles[1]
+        
+        # Quilt columns and rows of the tiles, and per native column (row)
+        # the tile column (row) it samples
+        u, v = native_uv(calibration)
+        cols, x = tile_samples(u[0], tiles[0], QWIDTH)
+        rows, y = tile_samples(v[:,0], tiles[1], QHEIGHT)
+        
+        tile_w, tile_h = cols.shape[1], rows.shape[1]
+        
+        # The tiles, in the order of the (phase) index k = floor(frac(phase) * 
+        # num_views), with tile rows from the top of the quilt and tile 
+        # columns from the right. The tiles are padded to an odd number of 
+        # cache lines, with power of two tile sizes the subpixels sampling 
+        # neighbouring views otherwise compete for the same cache sets.
+        tile_bytes = tile_h * tile_w * 3
+        stride = -(-tile_bytes // 64) | 1
+        self.stack = np.empty((num_views, stride * 64), np.uint8)
+        
+        for k in range(num_views):
+            ty, tx = divmod(k, tiles[0])
+            tx = tiles[0] - 1 - tx
+            tile = quilt[rows[ty][:,np.newaxis], cols[tx]]
+            self.stack[k,:tile_bytes] = tile.reshape(-1)
+        
+        # Per native subpixel the offset within a tile, as (H, W*3) array
+        self.base = np.empty((H, W*3), np.uint32)
+        self.base.reshape(H, W, 3)[:] = ((y[:,np.newaxis,np.newaxis] * tile_w 
+            + x[:,np.newaxis]) * 3 + np.arange(3))
+        
+        self.stride = np.uint32(self.stack.shape[1])
+        # Fixed point phase to index k, rounding the boundaries up by less 
+        # than num_views / 2^32
+        self.divisor = np.uint32(-(-2**32 // num_views))
+        
+        # Phases closer than (num_views + 16) / 2^32 to a view boundary 
+        # can map to another view than in quilt_lookup_table(), due to the 
+        # rounding above, of the fixed point phase and of its float 
+        # computation (e.g. view 0 instead of view 44 at phase ~0). Their
+        # index is computed again as in quilt_lookup_table(), which is only
+        # a few subpixels (see near_boundary()).
+        self.num_views = np.uint32(num_views)
+        self.margin = np.uint32((num_views + 16) * num_views)
+        
+        # Per native column and subpixel, the u coordinate and subpixel 
+        # number, and per native row 1-v, for the phase
+        self.u = np.repeat(u[0], 3)
+        self.c = np.tile(np.arange(3), W)
+        self.w = 1.0 - v[:,0]
+        self.native_uv = (u[0], v[:,0])
+        
+        # Allocated (and touched) up front, to keep page faults out of the updates
+        self.offsets = np.zeros((H, W*3), np.uint32)
+        self.native = np.zeros((H, W, 3), np.uint8)
+        self.offsets.fill(0)
+        self.native.fill(0)
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+        
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+            
+    def update(self, pitch=None, slope=None, center=None, out=None):
+        
+        # Change calibration values (None keeps the current value) and 
+        # return the native image, in out when given. The returned array
+        # is reused by the next update when out is None.
+        
+        cal = self.calibration
+        cal.update(pitch, slope, center)
+        
+        # Same phase as interlace.quilt_phase(), plus the subpixel offset
+        col = fixed_point_phase(self.u * cal.pitch + self.c * cal.subp - cal.center)
+        row = fixed_point_phase(self.w * cal.tilt * cal.pitch)
+        
+        near_rows, near_cols = self.near_boundary(row, col)
+        
+        if out is None:
+            out = self.native
+        
+        stack = self.stack.reshape(-1)
+        
+        def gather(band):
+            
+            first, last = band
+            offsets = self.offsets[first:last]
+            
+            np.add(row[first:last,np.newaxis], col, out=offsets)
+            np.floor_divide(offsets, self.divisor, out=offsets)
+            
+            i, j = np.searchsorted(near_rows, band)
+            near = (near_rows[i:j] - first) * offsets.shape[1] + near_cols[i:j]
+            if near.size > 0:
+                offsets.reshape(-1)[near] = self.reference_views(first, near)
+            np.multiply(offsets, self.stride, out=offsets)
+            offsets += self.base[first:last]
+            
+            np.take(stack, offsets.reshape(out[first:last].shape), out=out[first:last], mode='clip')
+            
+        # Bands of about BAND_BYTES of offsets, so the passes over them
+        # stay in the cache
+        rows = max(1, BAND_BYTES // self.offsets[0].nbytes)
+        bands = row_bands(cal.screenH, -(-cal.screenH // rows))
+        
+        if self.workers <= 1:
+            for band in bands:
+                gather(band)
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.workers)
+            list(self.executor.map(gather, bands))
+            
+        return out
+        
+    def near_boundary(self, row, col):
+        
+        # Returns the rows and columns (in increasing row order) of the 
+        # subpixels whose fixed point phase row[y] + col[x] is near a view
+        # boundary: their position within the view, num_views * phase 
+        # (wrapping around), is within margin of 0. Instead of checking 
+        # all subpixels, the positions of the columns are sorted, so for
+        # each row the columns within the range are found by bisection.
+        
+        margin = self.margin
+        col_position = col * self.num_views
+        row_position = row * self.num_views
+        
+        order = np.argsort(col_position)
+        positions = col_position[order]
+        n = len(positions)
+        
+        # Range [lo, lo + 2*margin) of column positions, wrapping around
+        lo = np.uint32(0) - row_position - margin
+        start = np.searchsorted(positions, lo)
+        end = np.searchsorted(positions, lo + margin*2)
+        count = (end - start) % n
+        count[(count == 0) & (lo + margin*2 < lo)] = n
+        
+        rows = []
+        cols = []
+        for y in np.flatnonzero(count):
+            cols.append(order[np.arange(start[y], start[y] + count[y]) % n])
+            rows.append(np.full(count[y], y))
+            
+        if len(rows) == 0:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+            
+        return np.concatenate(rows), np.concatenate(cols)
+        
+    def reference_views(self, first, near):
+        
+        # The view index k of the subpixels at flat positions near in the
+        # rows from first, computed as in quilt_lookup_table()
+        
+        cal = self.calibration
+        W = cal.screenW
+        u, v = self.native_uv
+        
+        y = first + near // (W*3)
+        x, c = np.divmod(near % (W*3), 3)
+        
+        a = quilt_phase(cal, u[x], v[y])
+        tx, ty = quilt_tiles(a + c*cal.subp, self.tiles)
+        k = ty*self.tiles[0] + (self.tiles[0] - 1 - tx)
+        
+        # frac() can round up to 1, quilt_lookup_table() then samples past the tiles
+        return np.minimum(k, self.num_views - 1).astype(np.uint32)
+        
+    def values(self):
+        # The current calibration values, as stored in the JSON file
+        return {name: self.calibration.config[name]['value'] for name in ('center', 'pitch', 'slope')}
+        
+    def save(self, jsonfile):
+        self.calibration.save(jsonfile)
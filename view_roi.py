@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+#
+# For a specific LG (calibration) and quilt layout, determine per view
+# which of its pixels are actually sampled for the native image. For 
+# each view the pixel mask, its bounding box and the coverage are 
+# exported, so a renderer can skip views (or parts of views) that 
+# contribute nothing.
+#
+# Output is <prefix>.json, with the per-view statistics, plus either 
+# <prefix>.npz holding the masks as bitmaps (array 'masks', shape 
+# (views, view-h, ceil(view-w/8)), see numpy.unpackbits()), or with -r 
+# the masks as run-length encoded rows in the JSON file ([row, first, 
+# last+1] runs).
+#
+# Views are numbered from the bottom-left tile of the quilt, as in 
+# make_quilt.py.
+#
+# Copyright (c) 2019, SURFsara BV
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of SURFsara BV nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SURFSARA BV BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import sys, json, getopt
+import numpy as np
+
+from calibration import Calibration
+from interlace import quilt_lookup_table, view_lookup_table
+from make_quilt import padded_quilt_size, tile_position
+
+def usage():
+    print('usage: %s [options] <visual.json> <tilesh> <tilesv> <view-w> <view-h> <output-prefix>' % sys.argv[0])
+    print()
+    print('options:')
+    print('  -q <w>x<h>   Quilt size the views are placed in (default: padded to a power of')
+    print('               two, as make_quilt.py does)')
+    print('  -f           Sample as frames2native.py does (pixel centers of the view images),')
+    print('               instead of as quilt2native.py and linquilt2native.py')
+    print('  -r           Store the masks as run-length encoded rows in the JSON file')
+    print()
+    sys.exit(-1)
+    
+    
+def quilt_view_masks(calibration, tiles, view_size, quilt_size):
+    
+    # Per view the pixels sampled by quilt2native.py (linquilt2native.py)
+    # from a quilt of quilt_size, with the views placed as make_quilt.py 
+    # does, as (num_views, VIEW_HEIGHT, VIEW_WIDTH) bool array. Texels in
+    # the padding of the quilt are sampled too, but belong to no view.
+    
+    VIEW_WIDTH, VIEW_HEIGHT = view_size
+    QWIDTH, QHEIGHT = quilt_size
+    num_views = tiles[0] * tiles[1]
+    
+    sampled = np.zeros(QWIDTH * QHEIGHT, bool)
+    sampled[quilt_lookup_table(calibration, tiles, quilt_size).reshape(-1) // 3] = True
+    sampled = sampled.reshape(QHEIGHT, QWIDTH)
+    
+    masks = np.empty((num_views, VIEW_HEIGHT, VIEW_WIDTH), bool)
+    for view in range(num_views):
+        left, top = tile_position(view, view_size, tiles, QHEIGHT)
+        masks[view] = sampled[top:top+VIEW_HEIGHT, left:left+VIEW_WIDTH]
+        
+    return masks
+    
+    
+def frames_view_masks(calibration, tiles, view_size):
+    
+    # Per view the pixels sampled by frames2native.py from separate view
+    # images, as (num_views, VIEW_HEIGHT, VIEW_WIDTH) bool array
+    
+    VIEW_WIDTH, VIEW_HEIGHT = view_size
+    num_views = tiles[0] * tiles[1]
+    
+    views, offsets = view_lookup_table(calibration, tiles, view_size, 0.5)
+    
+    # Mark the sampled pixel of each view, for all three subpixels
+    masks = np.zeros(num_views * VIEW_HEIGHT * VIEW_WIDTH, bool)
+    
+    pixels = offsets // 3
+    for c in range(3):
+        idx = views[:,:,c].astype(np.int64)
+        idx *= VIEW_HEIGHT * VIEW_WIDTH
+        idx += pixels
+        masks[idx] = True
+        
+    return masks.reshape(num_views, VIEW_HEIGHT, VIEW_WIDTH)
+    
+    
+def main():
+    
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'q:fr')
+    except getopt.GetoptError:
+        usage()
+        
+    if len(args) != 6:
+        usage()
+        
+    quilt_size = None
+    frames = False
+    rle = False
+    
+    for o, a in opts:
+        if o == '-q':
+            quilt_size = tuple(map(int, a.split('x')))
+        elif o == '-f':
+            frames = True
+        elif o == '-r':
+            rle = True
+            
+    calibration = Calibration(args[0])
+    TILES = tuple(map(int, args[1:3]))
+    VIEW_WIDTH, VIEW_HEIGHT = map(int, args[3:5])
+    output_prefix = args[5]
+    
+    NUM_VIEWS = TILES[0] * TILES[1]
+    
+    if frames:
+        masks = frames_view_masks(calibration, TILES, (VIEW_WIDTH, VIEW_HEIGHT))
+    else:
+        if quilt_size is None:
+            quilt_size = padded_quilt_size((VIEW_WIDTH, VIEW_HEIGHT), TILES)
+        if quilt_size[0] < VIEW_WIDTH * TILES[0] or quilt_size[1] < VIEW_HEIGHT * TILES[1]:
+            print('Quilt size %d x %d too small for the views' % quilt_size)
+            sys.exit(-1)
+        masks = quilt_view_masks(calibration, TILES, (VIEW_WIDTH, VIEW_HEIGHT), quilt_size)
+        
+    result = dict(
+        calibration=args[0],
+        tiles=list(TILES),
+        view_size=[VIEW_WIDTH, VIEW_HEIGHT],
+        sampling='center' if frames else 'corner',
+        views=[])
+        
+    if not frames:
+        result['quilt_size'] = list(quilt_size)
+        
+    print('view  coverage  bounding box')
+    
+    for view in range(NUM_VIEWS):
+        
+        mask = masks[view]
+        
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        
+        count = int(mask.sum())
+        coverage = 100.0 * count / mask.size
+        
+        if count > 0:
+            # [x0, y0, x1, y1], exclusive x1 and y1
+            bbox = [int(cols[0]), int(rows[0]), int(cols[-1])+1, int(rows[-1])+1]
+        else:
+            bbox = None
+            
+        entry = dict(view=view, pixels=count, coverage=coverage, bbox=bbox)
+        
+        if rle:
+            # Runs start where a row goes from 0 to 1, and end where it goes back
+            d = np.diff(np.pad(mask, ((0,0),(1,1))).astype(np.int8), axis=1)
+            starts = np.argwhere(d == 1)
+            ends = np.argwhere(d == -1)
+            entry['runs'] = np.column_stack((starts, ends[:,1])).tolist()
+            
+        result['views'].append(entry)
+        
+        print('%4d  %7.2f%%  %s' % (view, coverage, bbox))
+        
+    json.dump(result, open(output_prefix + '.json', 'wt'), indent=None if rle else 4)
+    
+    if not rle:
+        np.savez_compressed(output_prefix + '.npz', masks=np.packbits(masks, axis=2))
+        
+
+if __name__ == '__main__':
+    main()